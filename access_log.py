@@ -0,0 +1,134 @@
+"""
+Журнал доступа: одна запись на запрос и выборочное логирование.
+
+Запись содержит метод, путь, статус, эндпоинт, время обработки и метрики БД.
+Доля сохраняемых записей задается правилами ACCESS_LOG_SAMPLING, например
+"index=0.1,3xx=0.5,2xx=1": сначала проверяется правило эндпоинта, затем
+класса статуса. Ответы 4xx/5xx, запросы, во время которых записано
+предупреждение или ошибка (неудачный вход, доступ к чужой заметке и т.п.),
+и эндпоинты из ACCESS_LOG_ALWAYS_KEEP сохраняются всегда.
+
+Каждая запись содержит поле Sample (доля, с которой она сохранена), а
+периодическая сводка - число отброшенных записей по эндпоинтам, поэтому
+по журналу можно восстановить полное число запросов.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter
+from urllib.parse import unquote_plus
+
+import request_metrics
+
+
+def parse_sampling_rules(spec):
+    """'index=0.1,2xx=1' -> {'index': 0.1, '2xx': 1.0}"""
+    rules = {}
+    for item in (spec or '').split(','):
+        if not item.strip():
+            continue
+        key, _, value = item.partition('=')
+        rate = float(value)
+        if not 0 <= rate <= 1:
+            raise ValueError(f"Доля выборки должна быть от 0 до 1: {item}")
+        rules[key.strip()] = rate
+    return rules
+
+
+class SecurityEventFilter(logging.Filter):
+    """Отмечает запрос как значимый для безопасности, если в нем записано предупреждение"""
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            metrics = request_metrics.current()
+            if metrics is not None:
+                metrics.security_event = True
+        return True
+
+
+class AccessLogSampler:
+    """Решение о записи запроса в журнал и учет отброшенных записей"""
+
+    def __init__(self, rules=None, always_keep=(), summary_interval=60):
+        self.rules = dict(rules or {})
+        self.always_keep = set(always_keep)
+        self.summary_interval = summary_interval
+        self.dropped = Counter()  # (endpoint, класс статуса) -> число записей
+        self._lock = threading.Lock()
+        self._next_summary = time.monotonic() + summary_interval
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            rules=parse_sampling_rules(os.getenv('ACCESS_LOG_SAMPLING', '')),
+            always_keep=[name.strip() for name in os.getenv('ACCESS_LOG_ALWAYS_KEEP', '').split(',') if name.strip()],
+            summary_interval=float(os.getenv('ACCESS_LOG_SUMMARY_INTERVAL', '60'))
+        )
+
+    def rate_for(self, endpoint, status_code, security_event=False):
+        if status_code >= 400 or security_event or endpoint in self.always_keep:
+            return 1.0
+        rate = self.rules.get(endpoint)
+        if rate is None:
+            rate = self.rules.get(f"{status_code // 100}xx", 1.0)
+        return rate
+
+    def sample(self, endpoint, status_code, security_event=False):
+        """Доля выборки, если запись нужно сохранить, иначе None"""
+        rate = self.rate_for(endpoint, status_code, security_event)
+        if rate >= 1.0 or (rate > 0 and random.random() < rate):
+            return rate
+        with self._lock:
+            self.dropped[(endpoint, f"{status_code // 100}xx")] += 1
+        return None
+
+    def pop_summary(self):
+        """Сводка отброшенных записей, если подошло время очередной сводки"""
+        now = time.monotonic()
+        if now < self._next_summary:
+            return None
+        with self._lock:
+            if now < self._next_summary:
+                return None
+            self._next_summary = now + self.summary_interval
+            dropped, self.dropped = self.dropped, Counter()
+        if not dropped:
+            return None
+        details = ', '.join(
+            f"{endpoint} {status_class}={count}" for (endpoint, status_class), count in sorted(dropped.items(), key=str)
+        )
+        return f"Access log sampling - Sampled out: {sum(dropped.values())} - {details}"
+
+
+def _escape(value):
+    """Переводы строк в значении не должны порождать поддельные строки журнала"""
+    return value.replace('\r', '\\r').replace('\n', '\\n')
+
+
+class SingleLineFormatter(logging.Formatter):
+    """
+    Каждая запись журнала - ровно одна строка: переводы строк в сообщении
+    (имя пользователя, заголовок заметки, трассировка исключения) экранируются,
+    иначе введенный пользователем текст мог бы выглядеть для SIEM отдельной
+    записью с чужим IP
+    """
+
+    def format(self, record):
+        return _escape(super().format(record))
+
+
+def format_access_record(method, path, status_code, endpoint, metrics, rate, query='', user_agent=None):
+    """Одна строка журнала на запрос (поля Status/Path используются SIEM)"""
+    record = (
+        f"Access - Method: {method} - Path: {_escape(path).replace(' ', '%20')} - Status: {status_code} - "
+        f"Endpoint: {endpoint} - {metrics.summary()} - Sample: {rate:g}"
+    )
+    if query:
+        # Декодированная строка запроса: в ней SIEM ищет SQL-инъекции
+        record += f" - Query: {_escape(unquote_plus(query[:1024]))[:512]}"
+    if user_agent is not None:
+        record += f" - User-Agent: {user_agent}"
+    return record
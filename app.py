@@ -1,53 +1,27 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+import time
+from flask import (Flask, Response, render_template, request, redirect, url_for, session, flash,
+                   has_request_context, jsonify, before_render_template, template_rendered)
 from flask_wtf.csrf import CSRFProtect
-from dotenv import load_dotenv
 from datetime import datetime, timedelta, timezone
-import psycopg2
 from werkzeug.security import generate_password_hash, check_password_hash
 import logging
-from logging.handlers import RotatingFileHandler
+import math
+from app_settings import DB_CONFIG, setup_logging
+from circuit_breaker import CircuitOpenError
+from db_router import DatabaseRouter, read_your_writes_window
+from storage import create_storage_backend
+import request_metrics
+from access_log import AccessLogSampler, format_access_record
+from note_feed import NoteChangeFeed, build_delta, delta_range, event_stream
+from queries import (SELECT_USER_BY_USERNAME, INSERT_USER, SELECT_ALL_NOTES, SELECT_USER_NOTES,
+                     SELECT_NOTE_BY_ID, SELECT_NOTE_CONTENT, INSERT_NOTE, UPDATE_NOTE, DELETE_NOTE,
+                     SELECT_NOTE_CHANGE_BOUNDS, SELECT_FEED_DELTA, PURGE_NOTE_CHANGES,
+                     BACKFILL_NOTE_PREVIEWS, note_preview, format_feed_note)
+from server_session import (ServerSideSessionInterface, SessionCache,
+                            PostgresSessionStore, SQLiteSessionStore)
 
 
-# Настройка логирования
-def setup_logging():
-    """Настройка системы логирования для Flask приложения с поддержкой Unicode"""
-    # Создаем папку для логов если её нет
-    if not os.path.exists('logs'):
-        os.makedirs('logs')
-
-    # Настройка формата логов
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - [%(ip)s] - %(message)s'
-    )
-
-    # Хендлер для файла (поддерживает Unicode)
-    file_handler = RotatingFileHandler(
-        'logs/flask_app.log',
-        maxBytes=10240,  # 10KB
-        backupCount=10,
-        encoding='utf-8'  # Добавляем кодировку UTF-8
-    )
-    file_handler.setFormatter(formatter)
-    file_handler.setLevel(logging.INFO)
-
-    # Хендлер для консоли
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
-    console_handler.setLevel(logging.INFO)
-
-    # Получаем логгер приложения
-    app_logger = logging.getLogger('flask_app')
-    app_logger.setLevel(logging.INFO)
-    app_logger.addHandler(file_handler)
-    app_logger.addHandler(console_handler)
-
-    return app_logger
-
-
-# Загрузка переменных окружения
-load_dotenv()
-
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'fallback-secret-key-for-dev')
 
@@ -61,9 +35,6 @@ app.config.update(
 
 csrf = CSRFProtect(app)
 
-# Инициализация логгера
-app_logger = setup_logging()
-
 
 # Фильтр для добавления IP адреса в логи
 class IPFilter(logging.Filter):
@@ -72,95 +43,160 @@ class IPFilter(logging.Filter):
         return True
 
 
-app_logger.addFilter(IPFilter())
+# Инициализация логгера
+app_logger = setup_logging(IPFilter())
+
+# Реплики для чтения: DB_REPLICA_DSNS="host=replica1 port=5433;host=replica2"
+db_router = DatabaseRouter.from_env(DB_CONFIG)
+
+# Хранилище данных: postgres или sqlite (встроенная БД для одного узла)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'postgres').lower()
+storage = create_storage_backend(
+    STORAGE_BACKEND,
+    router=db_router,
+    sqlite_path=os.getenv('SQLITE_DB_PATH', 'data/notes.sqlite3')
+)
+
+# Сколько секунд после собственной записи пользователь читает с primary
+# (не меньше отставания, с которым реплика остается в ротации)
+READ_YOUR_WRITES_WINDOW = read_your_writes_window(
+    os.getenv('DB_READ_YOUR_WRITES_WINDOW'),
+    db_router.max_replica_lag,
+    db_router.health_check_interval,
+    has_replicas=bool(db_router.replicas)
+)
+
+# Инкрементальное обновление ленты (см. note_feed.py): сколько изменений отдавать
+# за один запрос и сколько хранить в журнале
+FEED_DELTA_LIMIT = int(os.getenv('FEED_DELTA_LIMIT', '200'))
+# Сколько номеров перед курсором перечитывать: изменения, зафиксированные
+# позже изменений с большими номерами
+FEED_DELTA_OVERLAP = int(os.getenv('FEED_DELTA_OVERLAP', '100'))
+NOTE_CHANGES_KEEP = int(os.getenv('NOTE_CHANGES_KEEP', '10000'))
+# Открытый поток событий занимает поток waitress до конца соединения,
+# поэтому по умолчанию потоков событий не больше половины потоков сервера
+NOTES_STREAM_MAX_CLIENTS = int(os.getenv(
+    'NOTES_STREAM_MAX_CLIENTS', str(max(int(os.getenv('SERVER_THREADS', '4')) // 2, 1))
+))
+NOTES_STREAM_MAX_SECONDS = float(os.getenv('NOTES_STREAM_MAX_SECONDS', '300'))
+
+
+def reads_must_use_primary():
+    """Чтение сразу после записи этого же пользователя идет на primary"""
+    if not has_request_context():
+        return False
+    last_write_at = session.get('last_write_at')
+    return last_write_at is not None and time.time() - last_write_at < READ_YOUR_WRITES_WINDOW
 
-# Конфигурация подключения к PostgreSQL
-DB_CONFIG = {
-    'host': 'localhost',
-    'user': 'app_user',
-    'password': os.getenv('DB_PASSWORD', 'secure_password_123'),
-    'database': 'notes_app_db',
-    'port': 5432
-}
 
+def remember_write():
+    """Отметка о записи пользователя для read-your-writes"""
+    if has_request_context():
+        session['last_write_at'] = time.time()
 
-def get_db_connection():
-    """Создание защищенного подключения к PostgreSQL"""
+
+def get_db_connection(readonly=False):
+    """Создание защищенного подключения к БД (чтение может идти на реплику)"""
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
+        started = time.perf_counter()
+        conn = storage.connect(readonly=readonly and not reads_must_use_primary())
+        request_metrics.record_connect(time.perf_counter() - started)
         return conn
-    except psycopg2.Error as e:
-        app_logger.error(f"Ошибка подключения к PostgreSQL: {e}")
+    except CircuitOpenError:
+        # БД недоступна: запрос отклонен без ожидания таймаута подключения
+        return None
+    except storage.Error as e:
+        app_logger.error(f"Ошибка подключения к БД ({storage.name}): {e}")
         return None
 
 
+def release_db_connection(conn):
+    """Возврат подключения хранилищу"""
+    storage.release(conn)
+
+
+# Хранилище сессий: cookie (только подписанная cookie), postgres или sqlite.
+# Для postgres/sqlite в cookie хранится лишь идентификатор сессии
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'postgres' if STORAGE_BACKEND == 'postgres' else 'sqlite').lower()
+
+
+def create_session_interface(backend):
+    """Создание серверного хранилища сессий по имени бэкенда"""
+    if backend == 'postgres' and STORAGE_BACKEND != 'postgres':
+        app_logger.warning("Сессии в PostgreSQL требуют STORAGE_BACKEND=postgres, используется sqlite")
+        backend = 'sqlite'
+
+    if backend == 'postgres':
+        store = PostgresSessionStore(get_db_connection, release_db_connection)
+    elif backend == 'sqlite':
+        store = SQLiteSessionStore(os.getenv('SESSION_SQLITE_PATH', 'data/sessions.sqlite3'))
+    else:
+        return None
+
+    cache = SessionCache(
+        max_entries=int(os.getenv('SESSION_CACHE_SIZE', '10000')),
+        # Не дольше ttl выход в одном процессе не виден другим (см. server_session.py)
+        ttl=float(os.getenv('SESSION_CACHE_TTL', '2'))
+    )
+    return ServerSideSessionInterface(
+        store,
+        cache=cache,
+        cleanup_interval=int(os.getenv('SESSION_CLEANUP_INTERVAL', '300'))
+    )
+
+
+session_interface = create_session_interface(SESSION_BACKEND)
+if session_interface is not None:
+    app.session_interface = session_interface
+    app_logger.info(f"Серверное хранилище сессий: {SESSION_BACKEND}")
+
+
 def init_database():
-    """Инициализация базы данных PostgreSQL"""
+    """Инициализация базы данных"""
     try:
         conn = get_db_connection()
         if conn is None:
             app_logger.error("Не удалось подключиться к БД")
             return False
 
-        cursor = conn.cursor()
-
-        # Создаем таблицу пользователей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                username VARCHAR(50) UNIQUE NOT NULL,
-                password_hash VARCHAR(255) NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        # Создаем таблицу заметок
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS notes (
-                id SERIAL PRIMARY KEY,
-                title VARCHAR(255) NOT NULL,
-                content TEXT NOT NULL,
-                user_id INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-            )
-        ''')
+        cursor = storage.cursor(conn)
+
+        # Создаем таблицы пользователей и заметок
+        for statement in storage.schema:
+            storage.execute(cursor, statement)
+        storage.upgrade_schema(cursor)
+        storage.execute(cursor, BACKFILL_NOTE_PREVIEWS)
 
         conn.commit()
 
         # Создаем тестового пользователя
-        cursor.execute("SELECT * FROM users WHERE username = 'testuser'")
+        storage.execute(cursor, SELECT_USER_BY_USERNAME, ('testuser',))
         if not cursor.fetchone():
             test_password = os.getenv('TEST_USER_PASSWORD', 'testpassword123')
             password_hash = generate_password_hash(test_password)
-            cursor.execute(
-                "INSERT INTO users (username, password_hash) VALUES (%s, %s) RETURNING id",
-                ('testuser', password_hash)
-            )
+            storage.execute(cursor, INSERT_USER + " RETURNING id", ('testuser', password_hash))
             user_id = cursor.fetchone()[0]
 
             # Создаем тестовые заметки
             notes_data = [
-                ('Первая заметка', 'Это моя первая тестовая заметка', user_id),
-                ('Список покупок', 'Молоко, хлеб, яйца', user_id),
-                ('Идеи для проекта', 'Разработать веб-приложение', user_id)
+                ('Первая заметка', 'Это моя первая тестовая заметка'),
+                ('Список покупок', 'Молоко, хлеб, яйца'),
+                ('Идеи для проекта', 'Разработать веб-приложение')
             ]
 
-            for note in notes_data:
-                cursor.execute(
-                    "INSERT INTO notes (title, content, user_id) VALUES (%s, %s, %s)",
-                    note
-                )
+            for title, content in notes_data:
+                storage.execute(cursor, INSERT_NOTE, (title, content, note_preview(content), user_id))
+                cursor.fetchone()
 
             conn.commit()
             app_logger.info("Тестовый пользователь создан: testuser / testpassword123")
 
         cursor.close()
-        conn.close()
-        app_logger.info("База данных PostgreSQL инициализирована")
+        release_db_connection(conn)
+        app_logger.info(f"База данных инициализирована ({storage.name})")
         return True
 
-    except psycopg2.Error as e:
+    except storage.Error as e:
         app_logger.error(f"Ошибка инициализации БД: {e}")
         return False
 
@@ -168,13 +204,13 @@ def init_database():
 # Функции для работы с пользователями и заметками
 def user_exists(username):
     """Проверка существования пользователя"""
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     if conn is None:
         return False
 
-    cursor = conn.cursor()
+    cursor = storage.cursor(conn)
     try:
-        cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
+        storage.execute(cursor, SELECT_USER_BY_USERNAME, (username,))
         user = cursor.fetchone()
         return user is not None
     except Exception as e:
@@ -182,7 +218,7 @@ def user_exists(username):
         return False
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
 
 
 def register_user(username, password):
@@ -191,18 +227,16 @@ def register_user(username, password):
     if conn is None:
         return False
 
-    cursor = conn.cursor()
-    password_hash = generate_password_hash(password)
+    cursor = storage.cursor(conn)
+    with request_metrics.timed('hash'):
+        password_hash = generate_password_hash(password)
 
     try:
-        cursor.execute(
-            "INSERT INTO users (username, password_hash) VALUES (%s, %s)",
-            (username, password_hash)
-        )
+        storage.execute(cursor, INSERT_USER, (username, password_hash))
         conn.commit()
         app_logger.info(f"Успешная регистрация пользователя: {username}")
         return True
-    except psycopg2.IntegrityError:
+    except storage.IntegrityError:
         app_logger.warning(f"Попытка регистрации существующего пользователя: {username}")
         flash('Пользователь с таким именем уже существует', 'error')
         return False
@@ -211,7 +245,11 @@ def register_user(username, password):
         return False
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
+
+
+# Хэш случайного пароля: проверяется при входе несуществующего пользователя
+DUMMY_PASSWORD_HASH = generate_password_hash(os.urandom(16).hex())
 
 
 def login_user(username, password):
@@ -221,12 +259,18 @@ def login_user(username, password):
         app_logger.error("Database connection failed during login attempt")
         return None
 
-    cursor = conn.cursor()
+    cursor = storage.cursor(conn)
     try:
-        cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
+        storage.execute(cursor, SELECT_USER_BY_USERNAME, (username,))
         user = cursor.fetchone()
 
-        if user and check_password_hash(user[2], password):
+        with request_metrics.timed('hash'):
+            # Для несуществующего пользователя хэш тоже проверяется: время ответа
+            # не должно выдавать, есть ли такой пользователь
+            password_hash = user[2] if user is not None else DUMMY_PASSWORD_HASH
+            password_valid = check_password_hash(password_hash, password) and user is not None
+
+        if password_valid:
             app_logger.info(f"Successful login for user: {username}")
             return user
         else:
@@ -237,42 +281,106 @@ def login_user(username, password):
         return None
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
+
+
+# Последняя успешно прочитанная лента процесса: показывается, пока БД недоступна
+last_good_feed = {'notes': [], 'cursor': 0, 'fetched_at': None}
 
 
 def get_all_notes():
-    """Получение всех заметок"""
-    conn = get_db_connection()
+    """
+    Получение всех заметок и курсора ленты (номера последнего изменения).
+    Возвращает (заметки, курсор, stale); stale - БД недоступна и лента взята
+    из последнего успешного чтения (last_good_feed).
+    """
+    conn = get_db_connection(readonly=True)
     if conn is None:
-        return []
+        return last_good_feed['notes'], last_good_feed['cursor'], True
 
-    cursor = conn.cursor()
+    cursor = storage.cursor(conn)
     try:
-        cursor.execute("""
-            SELECT notes.*, users.username 
-            FROM notes 
-            JOIN users ON notes.user_id = users.id 
-            ORDER BY notes.created_at DESC
-        """)
-        notes = cursor.fetchall()
-        return notes
+        storage.execute(cursor, SELECT_ALL_NOTES)
+        rows = cursor.fetchall()
+        feed_cursor = rows[0][6] if rows else 0
+        notes = [row for row in rows if row[0] is not None]
+        last_good_feed.update(notes=notes, cursor=feed_cursor, fetched_at=datetime.now())
+        return notes, feed_cursor, False
     except Exception as e:
         app_logger.error(f"Ошибка получения всех заметок: {e}")
-        return []
+        return last_good_feed['notes'], last_good_feed['cursor'], True
+    finally:
+        cursor.close()
+        release_db_connection(conn)
+
+
+def get_feed_delta(since):
+    """Изменения ленты после курсора (см. note_feed.build_delta)"""
+    # Чтение с primary: уведомление об изменении может прийти раньше,
+    # чем изменение появится на реплике
+    conn = get_db_connection()
+    if conn is None:
+        return None
+
+    cursor = storage.cursor(conn)
+    try:
+        storage.execute(cursor, SELECT_NOTE_CHANGE_BOUNDS)
+        bounds = cursor.fetchone()
+        storage.execute(cursor, SELECT_FEED_DELTA, delta_range(since, FEED_DELTA_LIMIT, FEED_DELTA_OVERLAP))
+        rows = cursor.fetchall()
+        return build_delta(since, bounds, rows, FEED_DELTA_LIMIT + FEED_DELTA_OVERLAP)
+    except Exception as e:
+        app_logger.error(f"Ошибка получения изменений ленты: {e}")
+        return None
+    finally:
+        cursor.close()
+        release_db_connection(conn)
+
+
+def get_feed_cursor():
+    """Номер последнего изменения ленты (для потока изменений)"""
+    conn = get_db_connection()
+    if conn is None:
+        return None
+
+    cursor = storage.cursor(conn)
+    try:
+        storage.execute(cursor, SELECT_NOTE_CHANGE_BOUNDS)
+        return cursor.fetchone()[1]
+    except Exception as e:
+        app_logger.error(f"Ошибка получения курсора ленты: {e}")
+        return None
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
+
+
+def purge_note_changes():
+    """Удаление старых записей журнала изменений ленты"""
+    conn = get_db_connection()
+    if conn is None:
+        return
+
+    cursor = storage.cursor(conn)
+    try:
+        storage.execute(cursor, PURGE_NOTE_CHANGES, (NOTE_CHANGES_KEEP,))
+        conn.commit()
+    except Exception as e:
+        app_logger.error(f"Ошибка очистки журнала изменений ленты: {e}")
+    finally:
+        cursor.close()
+        release_db_connection(conn)
 
 
 def get_user_notes(user_id):
     """Получение заметок пользователя"""
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     if conn is None:
         return []
 
-    cursor = conn.cursor()
+    cursor = storage.cursor(conn)
     try:
-        cursor.execute("SELECT * FROM notes WHERE user_id = %s ORDER BY created_at DESC", (user_id,))
+        storage.execute(cursor, SELECT_USER_NOTES, (user_id,))
         notes = cursor.fetchall()
         return notes
     except Exception as e:
@@ -280,7 +388,7 @@ def get_user_notes(user_id):
         return []
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
 
 
 def add_note_to_db(title, content, user_id):
@@ -289,14 +397,12 @@ def add_note_to_db(title, content, user_id):
     if conn is None:
         return None
 
-    cursor = conn.cursor()
+    cursor = storage.cursor(conn)
     try:
-        cursor.execute(
-            "INSERT INTO notes (title, content, user_id) VALUES (%s, %s, %s) RETURNING id",
-            (title, content, user_id)
-        )
+        storage.execute(cursor, INSERT_NOTE, (title, content, note_preview(content), user_id))
         note_id = cursor.fetchone()[0]
         conn.commit()
+        remember_write()
         app_logger.info(f"Заметка добавлена пользователем {user_id}: {title}")
         return note_id
     except Exception as e:
@@ -304,7 +410,7 @@ def add_note_to_db(title, content, user_id):
         return None
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
 
 
 def update_note_in_db(note_id, title, content, user_id):
@@ -313,15 +419,13 @@ def update_note_in_db(note_id, title, content, user_id):
     if conn is None:
         return False
 
-    cursor = conn.cursor()
+    cursor = storage.cursor(conn)
     try:
-        cursor.execute(
-            "UPDATE notes SET title = %s, content = %s WHERE id = %s AND user_id = %s",
-            (title, content, note_id, user_id)
-        )
+        storage.execute(cursor, UPDATE_NOTE, (title, content, note_preview(content), note_id, user_id))
         conn.commit()
         success = cursor.rowcount > 0
         if success:
+            remember_write()
             app_logger.info(f"Заметка {note_id} обновлена пользователем {user_id}")
         else:
             app_logger.warning(f"Попытка обновления чужой заметки {note_id} пользователем {user_id}")
@@ -331,7 +435,7 @@ def update_note_in_db(note_id, title, content, user_id):
         return False
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
 
 
 def delete_note_from_db(note_id, user_id):
@@ -340,15 +444,13 @@ def delete_note_from_db(note_id, user_id):
     if conn is None:
         return False
 
-    cursor = conn.cursor()
+    cursor = storage.cursor(conn)
     try:
-        cursor.execute(
-            "DELETE FROM notes WHERE id = %s AND user_id = %s",
-            (note_id, user_id)
-        )
+        storage.execute(cursor, DELETE_NOTE, (note_id, user_id))
         conn.commit()
         success = cursor.rowcount > 0
         if success:
+            remember_write()
             app_logger.info(f"Заметка {note_id} удалена пользователем {user_id}")
         else:
             app_logger.warning(f"Попытка удаления чужой заметки {note_id} пользователем {user_id}")
@@ -358,21 +460,37 @@ def delete_note_from_db(note_id, user_id):
         return False
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
+
+
+def get_note_content(note_id):
+    """Полный текст заметки (лента показывает только превью)"""
+    conn = get_db_connection(readonly=True)
+    if conn is None:
+        return None
+
+    cursor = storage.cursor(conn)
+    try:
+        storage.execute(cursor, SELECT_NOTE_CONTENT, (note_id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+    except Exception as e:
+        app_logger.error(f"Ошибка получения текста заметки {note_id}: {e}")
+        return None
+    finally:
+        cursor.close()
+        release_db_connection(conn)
 
 
 def get_note_by_id(note_id, user_id):
     """Получение заметки по ID"""
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     if conn is None:
         return None
 
-    cursor = conn.cursor()
+    cursor = storage.cursor(conn)
     try:
-        cursor.execute(
-            "SELECT * FROM notes WHERE id = %s AND user_id = %s",
-            (note_id, user_id)
-        )
+        storage.execute(cursor, SELECT_NOTE_BY_ID, (note_id, user_id))
         note = cursor.fetchone()
         return note
     except Exception as e:
@@ -380,78 +498,193 @@ def get_note_by_id(note_id, user_id):
         return None
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
 
 
 # Middleware для логирования запросов
-@app.before_request
+# Заголовок Server-Timing с разбивкой времени запроса (db-connect, db-query, render);
+# выключен по умолчанию и отдается только запросам с токеном SERVER_TIMING_TOKEN
+# в заголовке X-Server-Timing-Token
+SERVER_TIMING_HEADER = os.getenv('SERVER_TIMING_HEADER', '0') == '1'
+SERVER_TIMING_TOKEN = os.getenv('SERVER_TIMING_TOKEN', os.getenv('PROFILING_TOKEN', ''))
+
+
+# Выборочная запись журнала доступа (см. access_log.py)
+access_sampler = AccessLogSampler.from_env()
+
+# Источник номеров изменений ленты: LISTEN/NOTIFY в PostgreSQL, опрос в SQLite
+note_feed = NoteChangeFeed(
+    get_feed_cursor,
+    listen=(lambda: db_router.primary.connect(db_router.connect_timeout)) if storage.name == 'postgres' else None,
+    poll_interval=float(os.getenv('NOTES_POLL_INTERVAL', '2')),
+    purge=purge_note_changes,
+    max_streams=NOTES_STREAM_MAX_CLIENTS
+)
+
+
 def log_request_info():
-    """Логируем информацию о каждом запросе"""
-    if request.endpoint and request.endpoint != 'static':
-        app_logger.info(
-            f"Method: {request.method} - "
-            f"Endpoint: {request.endpoint} - "
-            f"User-Agent: {request.user_agent} - "
-            f"Args: {dict(request.args)}"
-        )
+    """Начало замера метрик запроса"""
+    request_metrics.start_request(request.endpoint)
+
+
+# Первым среди before_request: запросы, отклоненные проверкой CSRF (CSRFProtect
+# зарегистрирован раньше), тоже попадают в журнал доступа
+app.before_request_funcs.setdefault(None, []).insert(0, log_request_info)
+
+
+@app.before_request
+def reject_writes_while_unavailable():
+    """Пока цепь к БД разомкнута, запись отклоняется сразу с понятной ошибкой"""
+    # Все POST в приложении пишут в БД (вход - в таблицу сессий); форма
+    # редактирования и удаление открываются GET
+    if request.method != 'POST' and request.endpoint not in ('edit_note', 'delete_note'):
+        return None
+    retry_after = storage.unavailable()
+    if not retry_after:
+        return None
+
+    message = 'База данных временно недоступна, изменения не сохранены. Повторите попытку позже'
+    app_logger.warning(f"Запись отклонена: БД недоступна ({request.endpoint})")
+    headers = {'Retry-After': str(math.ceil(retry_after))}
+    if wants_json():
+        return jsonify(error=message), 503, headers
+    return message, 503, headers
 
 
 @app.after_request
 def log_response_info(response):
-    """Логируем информацию о ответе"""
-    if request.endpoint and request.endpoint != 'static':
-        app_logger.info(
-            f"Response - Status: {response.status_code} - "
-            f"Endpoint: {request.endpoint}"
-        )
+    """Одна запись журнала на запрос: статус, время обработки и метрики БД"""
+    metrics = request_metrics.finish_request()
+    if metrics is None:
+        return response
+
+    if SERVER_TIMING_HEADER and request_metrics.server_timing_allowed(
+            request.headers.get(request_metrics.SERVER_TIMING_TOKEN_HEADER), SERVER_TIMING_TOKEN):
+        response.headers['Server-Timing'] = metrics.server_timing()
+
+    if request.endpoint != 'static':
+        status_code = response.status_code
+        rate = access_sampler.sample(request.endpoint, status_code, metrics.security_event)
+        if rate is not None:
+            # User-Agent нужен для разбора инцидентов, для успешных запросов не пишется
+            detailed = status_code >= 400 or metrics.security_event
+            app_logger.info(format_access_record(
+                request.method, request.path, status_code, request.endpoint, metrics, rate,
+                query=request.query_string.decode('utf-8', 'replace'),
+                user_agent=request.user_agent.string if detailed else None
+            ))
+        summary = access_sampler.pop_summary()
+        if summary:
+            app_logger.info(summary)
     return response
 
 
+def start_template_timer(sender, template, context, **extra):
+    context['_render_started'] = time.perf_counter()
+
+
+def stop_template_timer(sender, template, context, **extra):
+    metrics = request_metrics.current()
+    started = context.get('_render_started')
+    if metrics is not None and started is not None:
+        metrics.add_timing('render', time.perf_counter() - started)
+
+
+before_render_template.connect(start_template_timer, app)
+template_rendered.connect(stop_template_timer, app)
+
+
 # Инициализируем базу данных
-app_logger.info("Инициализация базы данных PostgreSQL...")
+app_logger.info(f"Инициализация базы данных ({storage.name})...")
 if init_database():
     app_logger.info("База данных готова к работе")
 else:
     app_logger.error("Ошибка инициализации базы данных")
 
 # Маршруты Flask
-@app.before_request
-def before_request():
-    if 'user_id' not in session:
-        session['user_id'] = None
-    if 'username' not in session:
-        session['username'] = None
-    if 'note_ids' not in session:
-        session['note_ids'] = []
-
-
 @app.route('/')
 def index():
     if not session.get('user_id'):
         return redirect(url_for('login_route'))
 
-    notes = get_all_notes()
-    user_notes = get_user_notes(session['user_id'])
-    user_note_ids = [note[0] for note in user_notes]
-    session['note_ids'] = user_note_ids
-
-    notes_formatted = []
-    for note in notes:
-        notes_formatted.append({
-            'id': note[0],
-            'title': note[1],
-            'content': note[2],
-            'user_id': note[3],
-            'created_at': note[4],
-            'username': note[5]
-        })
+    notes, feed_cursor, feed_stale = get_all_notes()
+    if feed_stale:
+        # Заметки пользователя тоже недоступны: используются id из сессии
+        user_note_ids = session.get('note_ids', [])
+    else:
+        user_notes = get_user_notes(session['user_id'])
+        user_note_ids = [note[0] for note in user_notes]
+        # Присваивание помечает сессию измененной и сохраняет ее в хранилище
+        if session.get('note_ids') != user_note_ids:
+            session['note_ids'] = user_note_ids
+
+    notes_formatted = [format_feed_note(note) for note in notes]
 
     return render_template('index.html',
                            notes=notes_formatted,
                            user_note_ids=user_note_ids,
+                           feed_cursor=feed_cursor,
+                           feed_stale=feed_stale,
+                           feed_fetched_at=last_good_feed['fetched_at'],
                            username=session.get('username'))
 
 
+def wants_json():
+    """Запрос от скрипта страницы (fetch), а не переход браузера"""
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
+
+@app.route('/notes/delta')
+def notes_delta():
+    """Заметки, измененные и удаленные после курсора, в виде готовых карточек"""
+    if not session.get('user_id'):
+        return jsonify(error='Требуется вход в систему'), 401
+
+    since = request.args.get('since', 0, type=int)
+    delta = get_feed_delta(since)
+    if delta is None:
+        return jsonify(error='Ошибка получения изменений'), 503
+    notes, deleted, cursor, reset = delta
+
+    user_id = session['user_id']
+    changed = []
+    for row in notes:
+        note = format_feed_note(row)
+        own_ids = [note['id']] if note['user_id'] == user_id else []
+        changed.append({
+            'id': note['id'],
+            'html': render_template('_note_card.html', note=note, user_note_ids=own_ids)
+        })
+
+    return jsonify(cursor=cursor, reset=reset, notes=changed, deleted=deleted)
+
+
+@app.route('/notes/stream')
+def notes_stream():
+    """Поток server-sent events: номер последнего изменения ленты"""
+    if not session.get('user_id'):
+        return jsonify(error='Требуется вход в систему'), 401
+
+    # При переподключении EventSource передает последний полученный номер
+    cursor = request.headers.get('Last-Event-ID', type=int)
+    if cursor is None:
+        cursor = request.args.get('cursor', 0, type=int)
+
+    slot = note_feed.open_stream()
+    if slot is None:
+        # Клиент перейдет на периодические запросы /notes/delta
+        return jsonify(error='Слишком много открытых потоков'), 503
+
+    response = Response(
+        event_stream(note_feed, slot, cursor, max_seconds=NOTES_STREAM_MAX_SECONDS),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Место освобождается, даже если тело ответа не начало передаваться
+    response.call_on_close(slot.release)
+    return response
+
+
 @app.route('/login', methods=['GET', 'POST'])
 def login_route():
     if request.method == 'POST':
@@ -542,6 +775,8 @@ def add_note():
 
     if not title or not content:
         app_logger.warning("Empty note data")
+        if wants_json():
+            return jsonify(error='Заполните все поля'), 400
         flash('Заполните все поля', 'error')
         return redirect(url_for('index'))
 
@@ -551,10 +786,29 @@ def add_note():
     session['note_ids'] = [note[0] for note in user_notes]
     session.modified = True
 
+    if wants_json():
+        # Карточку страница получит через /notes/delta
+        if note_id is None:
+            return jsonify(error='Ошибка добавления заметки'), 500
+        return jsonify(id=note_id), 201
+
     flash('Заметка добавлена!', 'success')
     return redirect(url_for('index'))
 
 
+@app.route('/note/<int:note_id>/content')
+def note_content(note_id):
+    """Полный текст заметки для раскрытия превью в ленте"""
+    if not session.get('user_id'):
+        return jsonify(error='Требуется вход в систему'), 401
+
+    content = get_note_content(note_id)
+    if content is None:
+        return jsonify(error='Заметка не найдена'), 404
+
+    return jsonify(id=note_id, content=content)
+
+
 @app.route('/edit/<int:note_id>', methods=['GET', 'POST'])
 def edit_note(note_id):
     if not session.get('user_id'):
@@ -598,12 +852,17 @@ def delete_note(note_id):
     success = delete_note_from_db(note_id, session['user_id'])
     if not success:
         app_logger.warning(f"Failed delete attempt for note {note_id} by user {session['user_id']}")
+        if wants_json():
+            return jsonify(error='Доступ запрещен!'), 403
         return "Доступ запрещен!", 403
 
     if note_id in session.get('note_ids', []):
         session['note_ids'].remove(note_id)
         session.modified = True
 
+    if wants_json():
+        return jsonify(deleted=note_id)
+
     flash('Заметка удалена!', 'success')
     return redirect(url_for('index'))
 
@@ -650,7 +909,7 @@ if __name__ == '__main__':
     app_logger.info("=" * 60)
     app_logger.info("Тестовый пользователь: testuser / testpassword123")
     app_logger.info("Используются параметризованные запросы")
-    app_logger.info("База данных: PostgreSQL")
+    app_logger.info(f"База данных: {storage.name}")
     app_logger.info("Логирование: logs/flask_app.log")
     app_logger.info("SQL-инъекции заблокированы")
     app_logger.info("=" * 60)
@@ -0,0 +1,71 @@
+"""
+Общие настройки Flask (app.py) и async (async_app.py) приложения:
+подключение к PostgreSQL и логирование.
+
+Оба режима пишут в один файл logs/flask_app.log в одном формате, который
+разбирает SIEM (siem_monitor.py), поэтому настройка логирования задается
+только здесь.
+"""
+
+import logging
+import os
+from logging.handlers import RotatingFileHandler
+
+from dotenv import load_dotenv
+
+from access_log import SecurityEventFilter, SingleLineFormatter
+
+# Загрузка переменных окружения
+load_dotenv()
+
+# Конфигурация подключения к PostgreSQL
+DB_CONFIG = {
+    'host': os.getenv('DB_HOST', 'localhost'),
+    'user': 'app_user',
+    'password': os.getenv('DB_PASSWORD', 'secure_password_123'),
+    'database': 'notes_app_db',
+    'port': int(os.getenv('DB_PORT', '5432'))
+}
+
+
+# Настройка логирования
+def setup_logging(ip_filter):
+    """
+    Настройка системы логирования приложения с поддержкой Unicode.
+
+    ip_filter - logging.Filter, который добавляет в запись IP текущего запроса
+    (record.ip); во Flask и в async режиме IP берется по-разному.
+    """
+    # Создаем папку для логов если её нет
+    if not os.path.exists('logs'):
+        os.makedirs('logs')
+
+    # Настройка формата логов (одна запись - одна строка, см. SingleLineFormatter)
+    formatter = SingleLineFormatter(
+        '%(asctime)s - %(name)s - %(levelname)s - [%(ip)s] - %(message)s'
+    )
+
+    # Хендлер для файла (поддерживает Unicode)
+    file_handler = RotatingFileHandler(
+        'logs/flask_app.log',
+        maxBytes=10240,  # 10KB
+        backupCount=10,
+        encoding='utf-8'
+    )
+    file_handler.setFormatter(formatter)
+    file_handler.setLevel(logging.INFO)
+
+    # Хендлер для консоли
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+    console_handler.setLevel(logging.INFO)
+
+    # Получаем логгер приложения
+    app_logger = logging.getLogger('flask_app')
+    app_logger.setLevel(logging.INFO)
+    app_logger.addHandler(file_handler)
+    app_logger.addHandler(console_handler)
+    app_logger.addFilter(ip_filter)
+    app_logger.addFilter(SecurityEventFilter())
+
+    return app_logger
@@ -0,0 +1,1015 @@
+"""
+Асинхронный режим приложения (ASGI).
+
+Те же маршруты и шаблоны, что и в app.py, но слой данных работает через пул
+asyncpg, а запросы обслуживает event loop вместо ограниченного пула потоков
+waitress. SQL общий с синхронной версией (queries.py), сессии хранятся в том же
+серверном хранилище, что и у Flask, поэтому режимы совместимы между собой.
+
+Схема БД создается синхронным приложением (app.init_database).
+Запуск: SERVER_MODE=async python run_production.py
+"""
+
+import asyncio
+import hashlib
+import hmac
+import itertools
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+
+import asyncpg
+from itsdangerous import BadData, URLSafeTimedSerializer
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+from starlette.templating import Jinja2Templates
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from db_router import DatabaseNode, DatabaseRouter, build_node_config, read_your_writes_window
+import request_metrics
+from access_log import AccessLogSampler, format_access_record
+from app_settings import DB_CONFIG, setup_logging
+from enhanced_security_middleware import IPBlocklistASGIMiddleware
+from ip_blocklist import IPBlocklist
+from note_feed import AsyncNoteChangeFeed, async_event_stream, build_delta, delta_range
+from queries import (SELECT_USER_BY_USERNAME, INSERT_USER, SELECT_ALL_NOTES, SELECT_USER_NOTES,
+                     SELECT_NOTE_BY_ID, SELECT_NOTE_CONTENT, INSERT_NOTE, UPDATE_NOTE, DELETE_NOTE,
+                     SELECT_NOTE_CHANGE_BOUNDS, SELECT_FEED_DELTA, PURGE_NOTE_CHANGES,
+                     note_preview, format_feed_note, to_asyncpg)
+from server_session import (ServerSideSessionInterface, SessionCache,
+                            PostgresSessionStore, SQLiteSessionStore)
+
+SECRET_KEY = os.getenv('SECRET_KEY', 'fallback-secret-key-for-dev')
+# Параметры cookie сессии те же, что у Flask приложения (SESSION_COOKIE_* в app.py)
+SESSION_COOKIE_NAME = 'secure_session'
+SESSION_COOKIE_SECURE = False
+SESSION_LIFETIME = timedelta(hours=1).total_seconds()
+# Заголовки с токеном CSRF, которые принимает Flask-WTF (WTF_CSRF_HEADERS)
+CSRF_HEADERS = ('X-CSRFToken', 'X-CSRF-Token')
+# Server-Timing только для запросов с токеном (см. app.py)
+SERVER_TIMING_HEADER = os.getenv('SERVER_TIMING_HEADER', '0') == '1'
+SERVER_TIMING_TOKEN = os.getenv('SERVER_TIMING_TOKEN', os.getenv('PROFILING_TOKEN', ''))
+# Выборочная запись журнала доступа (см. access_log.py)
+access_sampler = AccessLogSampler.from_env()
+# Инкрементальное обновление ленты (см. note_feed.py); поток событий в async
+# режиме не занимает поток сервера, поэтому лимит потоков событий выше
+FEED_DELTA_LIMIT = int(os.getenv('FEED_DELTA_LIMIT', '200'))
+FEED_DELTA_OVERLAP = int(os.getenv('FEED_DELTA_OVERLAP', '100'))
+NOTE_CHANGES_KEEP = int(os.getenv('NOTE_CHANGES_KEEP', '10000'))
+NOTES_STREAM_MAX_CLIENTS = int(os.getenv('NOTES_STREAM_MAX_CLIENTS', '1000'))
+NOTES_STREAM_MAX_SECONDS = float(os.getenv('NOTES_STREAM_MAX_SECONDS', '300'))
+
+# IP текущего запроса для логов
+current_ip = ContextVar('current_ip', default='N/A')
+
+
+class IPFilter(logging.Filter):
+    def filter(self, record):
+        record.ip = current_ip.get()
+        return True
+
+
+# Лог в тот же файл и в том же формате, что и у Flask приложения
+app_logger = setup_logging(IPFilter())
+
+
+# ===== Слой данных на asyncpg =====
+
+def asyncpg_config(config):
+    """Параметры psycopg2/libpq в параметры asyncpg"""
+    config = dict(config)
+    if 'dbname' in config:
+        config['database'] = config.pop('dbname')
+    config.pop('connect_timeout', None)
+    allowed = ('host', 'port', 'user', 'password', 'database')
+    return {key: config[key] for key in allowed if key in config}
+
+
+# Ошибки, после которых primary считается недоступным (см. circuit_breaker.py)
+PRIMARY_FAILURES = (OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError,
+                    asyncpg.InterfaceError, asyncpg.OperatorInterventionError)
+
+
+class AsyncDatabase:
+    """Пулы asyncpg для primary и реплик чтения"""
+
+    def __init__(self, primary_config, replica_dsns=(), min_size=2, max_size=20, eject_seconds=10,
+                 connect_timeout=3, statement_timeout=0, breaker=None,
+                 health_check_interval=5, max_replica_lag=10):
+        self.primary = DatabaseNode('primary', dict(primary_config))
+        self.replicas = [
+            DatabaseNode(f"replica-{index}", build_node_config(primary_config, dsn))
+            for index, dsn in enumerate(replica_dsns, start=1)
+        ]
+        self.min_size = min_size
+        self.max_size = max_size
+        self.eject_seconds = eject_seconds
+        self.health_check_interval = health_check_interval
+        self.max_replica_lag = max_replica_lag
+        self._health_task = None
+        self.connect_timeout = connect_timeout
+        self.statement_timeout = statement_timeout  # мс, 0 - без ограничения
+        self.breaker = breaker if breaker is not None else CircuitBreaker('PostgreSQL primary')
+        self.pools = {}
+        self._round_robin = itertools.cycle(self.replicas) if self.replicas else None
+
+    async def create_pool(self, node):
+        pool = await asyncpg.create_pool(
+            min_size=self.min_size, max_size=self.max_size,
+            timeout=self.connect_timeout,
+            command_timeout=self.statement_timeout / 1000 if self.statement_timeout else None,
+            **asyncpg_config(node.config)
+        )
+        self.pools[node.name] = pool
+        return pool
+
+    async def start(self):
+        for node in [self.primary] + self.replicas:
+            try:
+                await self.create_pool(node)
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+                node.mark_failed(self.eject_seconds)
+                app_logger.error(f"Ошибка подключения asyncpg к {node.name}: {e}")
+        if self.replicas and self.health_check_interval > 0:
+            self._health_task = asyncio.get_running_loop().create_task(self._health_loop())
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+        for pool in self.pools.values():
+            await pool.close()
+
+    async def _health_loop(self):
+        """Исключение из ротации недоступных и отстающих реплик (как в DatabaseRouter)"""
+        while True:
+            for node in self.replicas:
+                await self.check_replica(node)
+            await asyncio.sleep(self.health_check_interval)
+
+    async def check_replica(self, node):
+        try:
+            pool = self.pools.get(node.name) or await self.create_pool(node)
+            lag = float(await pool.fetchval(DatabaseRouter.lag_query, timeout=self.connect_timeout) or 0)
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+            if node.healthy:
+                app_logger.warning(f"Реплика {node.name} недоступна: {e}")
+            node.mark_failed(self.eject_seconds)
+            return False
+
+        if lag > self.max_replica_lag:
+            if node.healthy:
+                app_logger.warning(f"Реплика {node.name} отстает на {lag:.1f} с, исключена из ротации")
+            node.mark_failed(self.eject_seconds)
+            return False
+
+        node.mark_healthy()
+        return True
+
+    def _read_pools(self):
+        now = time.time()
+        for _ in range(len(self.replicas)):
+            node = next(self._round_robin)
+            if node.name in self.pools and node.available(now):
+                yield node, self.pools[node.name]
+
+    async def _timed(self, pool, method, sql, args):
+        started = time.perf_counter()
+        result = await getattr(pool, method)(sql, *args)
+        if method == 'fetch':
+            rows = len(result)
+        elif method == 'execute':
+            rows = affected_rows(result)
+        else:
+            rows = 0 if result is None else 1
+        request_metrics.record_query(sql, time.perf_counter() - started, rows)
+        return result
+
+    async def run(self, method, query, *args, readonly=False):
+        """Выполнение запроса: чтение на реплике (если есть), запись на primary"""
+        sql = to_asyncpg(query)
+        if readonly and self.replicas:
+            for node, pool in self._read_pools():
+                try:
+                    result = await self._timed(pool, method, sql, args)
+                    node.mark_healthy()
+                    return result
+                except (OSError, asyncpg.PostgresConnectionError, asyncpg.InterfaceError) as e:
+                    node.mark_failed(self.eject_seconds)
+                    app_logger.warning(f"Реплика {node.name} исключена из ротации: {e}")
+
+        # Пока цепь разомкнута, запрос отклоняется без ожидания таймаутов
+        if not self.breaker.allow():
+            raise CircuitOpenError(self.breaker.name, self.breaker.retry_after())
+        try:
+            pool = self.pools.get(self.primary.name)
+            if pool is None:
+                # primary был недоступен при запуске
+                pool = await self.create_pool(self.primary)
+            result = await self._timed(pool, method, sql, args)
+        except PRIMARY_FAILURES:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
+
+database = AsyncDatabase(
+    DB_CONFIG,
+    [dsn.strip() for dsn in os.getenv('DB_REPLICA_DSNS', '').split(';') if dsn.strip()],
+    min_size=int(os.getenv('ASYNC_DB_POOL_MIN', '2')),
+    max_size=int(os.getenv('ASYNC_DB_POOL_MAX', '20')),
+    eject_seconds=float(os.getenv('DB_REPLICA_EJECT_SECONDS', '10')),
+    health_check_interval=float(os.getenv('DB_REPLICA_HEALTH_INTERVAL', '5')),
+    max_replica_lag=float(os.getenv('DB_REPLICA_MAX_LAG', '10')),
+    connect_timeout=int(os.getenv('DB_CONNECT_TIMEOUT', '3')),
+    statement_timeout=int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '5000')),
+    breaker=CircuitBreaker(
+        'PostgreSQL primary',
+        failure_threshold=int(os.getenv('DB_BREAKER_FAILURES', '5')),
+        reset_timeout=float(os.getenv('DB_BREAKER_RESET_SECONDS', '1')),
+        max_reset_timeout=float(os.getenv('DB_BREAKER_MAX_RESET_SECONDS', '60'))
+    )
+)
+
+
+# Сколько секунд после собственной записи пользователь читает с primary
+# (не меньше отставания, с которым реплика остается в ротации)
+READ_YOUR_WRITES_WINDOW = read_your_writes_window(
+    os.getenv('DB_READ_YOUR_WRITES_WINDOW'),
+    database.max_replica_lag,
+    database.health_check_interval,
+    has_replicas=bool(database.replicas)
+)
+
+
+def reads_must_use_primary(request):
+    last_write_at = request.state.session.get('last_write_at')
+    return last_write_at is not None and time.time() - last_write_at < READ_YOUR_WRITES_WINDOW
+
+
+def remember_write(request):
+    request.state.session['last_write_at'] = time.time()
+
+
+async def user_exists(request, username):
+    """Проверка существования пользователя"""
+    try:
+        user = await database.run('fetchrow', SELECT_USER_BY_USERNAME, username,
+                                  readonly=not reads_must_use_primary(request))
+        return user is not None
+    except Exception as e:
+        app_logger.error(f"Ошибка проверки пользователя {username}: {e}")
+        return False
+
+
+async def register_user(request, username, password):
+    """Регистрация пользователя"""
+    with request_metrics.timed('hash'):
+        password_hash = await run_in_threadpool(generate_password_hash, password)
+    try:
+        await database.run('execute', INSERT_USER, username, password_hash)
+        app_logger.info(f"Успешная регистрация пользователя: {username}")
+        return True
+    except asyncpg.UniqueViolationError:
+        app_logger.warning(f"Попытка регистрации существующего пользователя: {username}")
+        flash(request, 'Пользователь с таким именем уже существует', 'error')
+        return False
+    except Exception as e:
+        app_logger.error(f"Ошибка регистрации пользователя {username}: {e}")
+        return False
+
+
+# Хэш случайного пароля: проверяется при входе несуществующего пользователя
+DUMMY_PASSWORD_HASH = generate_password_hash(os.urandom(16).hex())
+
+
+async def login_user(username, password):
+    """Вход пользователя с логированием"""
+    try:
+        user = await database.run('fetchrow', SELECT_USER_BY_USERNAME, username)
+    except Exception as e:
+        app_logger.error(f"Login error for user {username}: {e}")
+        return None
+
+    # Проверка хэша занимает CPU, выполняем ее вне event loop. Для несуществующего
+    # пользователя проверяется хэш случайного пароля: время ответа то же
+    with request_metrics.timed('hash'):
+        password_hash = user[2] if user is not None else DUMMY_PASSWORD_HASH
+        password_valid = await run_in_threadpool(check_password_hash, password_hash, password) and user is not None
+
+    if password_valid:
+        app_logger.info(f"Successful login for user: {username}")
+        return user
+
+    app_logger.warning(f"Failed login attempt for user: {username}")
+    return None
+
+
+# Последняя успешно прочитанная лента процесса: показывается, пока БД недоступна
+last_good_feed = {'notes': [], 'cursor': 0, 'fetched_at': None}
+
+
+async def get_all_notes(request):
+    """
+    Получение всех заметок и курсора ленты (номера последнего изменения).
+    Возвращает (заметки, курсор, stale); stale - БД недоступна и лента взята
+    из последнего успешного чтения (last_good_feed).
+    """
+    try:
+        rows = await database.run('fetch', SELECT_ALL_NOTES, readonly=not reads_must_use_primary(request))
+    except Exception as e:
+        app_logger.error(f"Ошибка получения всех заметок: {e}")
+        return last_good_feed['notes'], last_good_feed['cursor'], True
+    feed_cursor = rows[0][6] if rows else 0
+    notes = [row for row in rows if row[0] is not None]
+    last_good_feed.update(notes=notes, cursor=feed_cursor, fetched_at=datetime.now())
+    return notes, feed_cursor, False
+
+
+async def get_feed_delta(since):
+    """Изменения ленты после курсора (см. note_feed.build_delta)"""
+    # Чтение с primary: уведомление об изменении может прийти раньше,
+    # чем изменение появится на реплике
+    try:
+        bounds = await database.run('fetchrow', SELECT_NOTE_CHANGE_BOUNDS)
+        rows = await database.run('fetch', SELECT_FEED_DELTA,
+                                  *delta_range(since, FEED_DELTA_LIMIT, FEED_DELTA_OVERLAP))
+    except Exception as e:
+        app_logger.error(f"Ошибка получения изменений ленты: {e}")
+        return None
+    return build_delta(since, bounds, rows, FEED_DELTA_LIMIT + FEED_DELTA_OVERLAP)
+
+
+async def get_feed_cursor():
+    """Номер последнего изменения ленты (для потока изменений)"""
+    try:
+        return (await database.run('fetchrow', SELECT_NOTE_CHANGE_BOUNDS))[1]
+    except Exception as e:
+        app_logger.error(f"Ошибка получения курсора ленты: {e}")
+        return None
+
+
+async def purge_note_changes():
+    """Удаление старых записей журнала изменений ленты"""
+    try:
+        await database.run('execute', PURGE_NOTE_CHANGES, NOTE_CHANGES_KEEP)
+    except Exception as e:
+        app_logger.error(f"Ошибка очистки журнала изменений ленты: {e}")
+
+
+# Источник номеров изменений ленты: отдельное подключение asyncpg с LISTEN
+note_feed = AsyncNoteChangeFeed(
+    lambda: asyncpg.connect(timeout=database.connect_timeout, **asyncpg_config(DB_CONFIG)),
+    get_feed_cursor,
+    purge=purge_note_changes,
+    max_streams=NOTES_STREAM_MAX_CLIENTS
+)
+
+
+async def get_user_notes(request, user_id):
+    """Получение заметок пользователя"""
+    try:
+        return await database.run('fetch', SELECT_USER_NOTES, user_id,
+                                  readonly=not reads_must_use_primary(request))
+    except Exception as e:
+        app_logger.error(f"Ошибка получения заметок пользователя {user_id}: {e}")
+        return []
+
+
+async def add_note_to_db(request, title, content, user_id):
+    """Добавление заметки"""
+    try:
+        note_id = await database.run('fetchval', INSERT_NOTE, title, content, note_preview(content), user_id)
+        remember_write(request)
+        app_logger.info(f"Заметка добавлена пользователем {user_id}: {title}")
+        return note_id
+    except Exception as e:
+        app_logger.error(f"Ошибка добавления заметки пользователем {user_id}: {e}")
+        return None
+
+
+def affected_rows(status):
+    """Количество строк из статуса команды asyncpg ('UPDATE 1')"""
+    try:
+        return int(status.split()[-1])
+    except (AttributeError, ValueError, IndexError):
+        return 0
+
+
+async def update_note_in_db(request, note_id, title, content, user_id):
+    """Обновление заметки"""
+    try:
+        status = await database.run('execute', UPDATE_NOTE, title, content, note_preview(content),
+                                    note_id, user_id)
+    except Exception as e:
+        app_logger.error(f"Ошибка обновления заметки {note_id}: {e}")
+        return False
+
+    success = affected_rows(status) > 0
+    if success:
+        remember_write(request)
+        app_logger.info(f"Заметка {note_id} обновлена пользователем {user_id}")
+    else:
+        app_logger.warning(f"Попытка обновления чужой заметки {note_id} пользователем {user_id}")
+    return success
+
+
+async def delete_note_from_db(request, note_id, user_id):
+    """Удаление заметки"""
+    try:
+        status = await database.run('execute', DELETE_NOTE, note_id, user_id)
+    except Exception as e:
+        app_logger.error(f"Ошибка удаления заметки {note_id}: {e}")
+        return False
+
+    success = affected_rows(status) > 0
+    if success:
+        remember_write(request)
+        app_logger.info(f"Заметка {note_id} удалена пользователем {user_id}")
+    else:
+        app_logger.warning(f"Попытка удаления чужой заметки {note_id} пользователем {user_id}")
+    return success
+
+
+async def get_note_content(request, note_id):
+    """Полный текст заметки (лента показывает только превью)"""
+    try:
+        return await database.run('fetchval', SELECT_NOTE_CONTENT, note_id,
+                                  readonly=not reads_must_use_primary(request))
+    except Exception as e:
+        app_logger.error(f"Ошибка получения текста заметки {note_id}: {e}")
+        return None
+
+
+async def get_note_by_id(request, note_id, user_id):
+    """Получение заметки по ID"""
+    try:
+        return await database.run('fetchrow', SELECT_NOTE_BY_ID, note_id, user_id,
+                                  readonly=not reads_must_use_primary(request))
+    except Exception as e:
+        app_logger.error(f"Ошибка получения заметки {note_id}: {e}")
+        return None
+
+
+# ===== Сессии, CSRF и flash-сообщения (совместимы с Flask и Flask-WTF) =====
+
+def connect_session_store():
+    """Подключение psycopg2 для сессий; None (хранилище недоступно), пока цепь разомкнута"""
+    if database.breaker.retry_after():
+        return None
+    return database.primary.connect(database.connect_timeout)
+
+
+def create_session_interface(backend):
+    """Серверное хранилище сессий; режим cookie в async не поддерживается"""
+    if backend == 'postgres':
+        store = PostgresSessionStore(connect_session_store)
+    else:
+        if backend != 'sqlite':
+            app_logger.warning("SESSION_BACKEND=cookie не поддерживается в async режиме, используется sqlite")
+        store = SQLiteSessionStore(os.getenv('SESSION_SQLITE_PATH', 'data/sessions.sqlite3'))
+
+    cache = SessionCache(
+        max_entries=int(os.getenv('SESSION_CACHE_SIZE', '10000')),
+        # Не дольше ttl выход в одном процессе не виден другим (см. server_session.py)
+        ttl=float(os.getenv('SESSION_CACHE_TTL', '2'))
+    )
+    return ServerSideSessionInterface(
+        store,
+        cache=cache,
+        cleanup_interval=int(os.getenv('SESSION_CLEANUP_INTERVAL', '300'))
+    )
+
+
+session_interface = create_session_interface(os.getenv('SESSION_BACKEND', 'postgres').lower())
+csrf_serializer = URLSafeTimedSerializer(SECRET_KEY, salt='wtf-csrf-token')
+
+
+def generate_csrf(request):
+    """Токен CSRF в формате Flask-WTF"""
+    session = request.state.session
+    if 'csrf_token' not in session:
+        session['csrf_token'] = hashlib.sha1(os.urandom(64)).hexdigest()
+    return csrf_serializer.dumps(session['csrf_token'])
+
+
+def validate_csrf(request, form):
+    """Токен из поля формы или заголовка запроса, как в Flask-WTF"""
+    token = form.get('csrf_token')
+    if not token:
+        token = next((request.headers[name] for name in CSRF_HEADERS if name in request.headers), None)
+    raw_token = request.state.session.get('csrf_token')
+    if not token or not raw_token:
+        return False
+    try:
+        value = csrf_serializer.loads(token, max_age=3600)
+    except BadData:
+        return False
+    return hmac.compare_digest(value, raw_token)
+
+
+def flash(request, message, category='message'):
+    flashes = request.state.session.get('_flashes', [])
+    flashes.append((category, message))
+    request.state.session['_flashes'] = flashes
+
+
+def get_flashed_messages(request, with_categories=False):
+    flashes = request.state.session.pop('_flashes', [])
+    if with_categories:
+        return flashes
+    return [message for category, message in flashes]
+
+
+def session_cookie_expires(session):
+    """Срок cookie как в Flask: у постоянной сессии - время жизни, иначе cookie до закрытия браузера"""
+    if session.permanent:
+        # Число секунд от текущего момента (http.cookies переводит его в дату)
+        return int(SESSION_LIFETIME)
+    return None
+
+
+def needs_persist(session):
+    """Обращение к хранилищу нужно только при изменении или продлении сессии"""
+    if session.sid is None:
+        return bool(session)
+    if session.modified:
+        return True
+    return session.expires_at is None or session.expires_at - time.time() < SESSION_LIFETIME / 2
+
+
+def reject_write_while_unavailable(request):
+    """Пока цепь к БД разомкнута, запись отклоняется сразу с понятной ошибкой"""
+    # Все POST в приложении пишут в БД (вход - в таблицу сессий); форма
+    # редактирования и удаление открываются GET
+    if request.method != 'POST' and not request.url.path.startswith(('/edit/', '/delete/')):
+        return None
+    retry_after = database.breaker.retry_after()
+    if not retry_after:
+        return None
+
+    message = 'База данных временно недоступна, изменения не сохранены. Повторите попытку позже'
+    app_logger.warning(f"Запись отклонена: БД недоступна ({request.url.path})")
+    headers = {'Retry-After': str(math.ceil(retry_after))}
+    if wants_json(request):
+        return JSONResponse({'error': message}, status_code=503, headers=headers)
+    return PlainTextResponse(message, status_code=503, headers=headers)
+
+
+class SessionMiddleware(BaseHTTPMiddleware):
+    """Загрузка/сохранение сессии и лог запросов в формате Flask приложения"""
+
+    async def dispatch(self, request, call_next):
+        current_ip.set(request.client.host if request.client else 'N/A')
+        metrics = request_metrics.start_request(request.url.path)
+        is_static = request.url.path.startswith('/static/')
+
+        cookie_value = request.cookies.get(SESSION_COOKIE_NAME)
+        if cookie_value:
+            request.state.session = await run_in_threadpool(session_interface.load_session, SECRET_KEY, cookie_value)
+        else:
+            request.state.session = session_interface.load_session(SECRET_KEY, None)
+
+        response = reject_write_while_unavailable(request)
+        if response is None:
+            response = await call_next(request)
+
+        endpoint = request.scope.get('endpoint')
+        endpoint_name = getattr(endpoint, '__name__', None)
+        if not is_static:
+            status_code = response.status_code
+            rate = access_sampler.sample(endpoint_name, status_code, metrics.security_event)
+            if rate is not None:
+                detailed = status_code >= 400 or metrics.security_event
+                app_logger.info(format_access_record(
+                    request.method, request.url.path, status_code, endpoint_name, metrics, rate,
+                    query=request.url.query,
+                    user_agent=request.headers.get('user-agent', '') if detailed else None
+                ))
+            summary = access_sampler.pop_summary()
+            if summary:
+                app_logger.info(summary)
+        if SERVER_TIMING_HEADER and request_metrics.server_timing_allowed(
+                request.headers.get(request_metrics.SERVER_TIMING_TOKEN_HEADER), SERVER_TIMING_TOKEN):
+            response.headers['Server-Timing'] = metrics.server_timing()
+
+        session = request.state.session
+        if needs_persist(session):
+            sid = await run_in_threadpool(session_interface.persist_session, session, SESSION_LIFETIME)
+            if sid:
+                response.set_cookie(SESSION_COOKIE_NAME, session_interface.sign_sid(SECRET_KEY, sid),
+                                    expires=session_cookie_expires(session), path='/',
+                                    secure=SESSION_COOKIE_SECURE, httponly=True, samesite='lax')
+            elif sid == '':
+                response.delete_cookie(SESSION_COOKIE_NAME, path='/')
+        return response
+
+
+# ===== Шаблоны =====
+
+templates = Jinja2Templates(directory='templates')
+
+
+def template_context(request, context):
+    """Функции шаблонов Flask: url_for, csrf_token, get_flashed_messages"""
+    def url_for(endpoint, **values):
+        if endpoint == 'static':
+            values = {'path': values['filename']}
+        return str(request.app.url_path_for(endpoint, **values))
+
+    context.update(
+        url_for=url_for,
+        csrf_token=lambda: generate_csrf(request),
+        get_flashed_messages=lambda with_categories=False: get_flashed_messages(request, with_categories)
+    )
+    return context
+
+
+def render_template(request, name, status_code=200, **context):
+    with request_metrics.timed('render'):
+        return templates.TemplateResponse(request, name, template_context(request, context),
+                                          status_code=status_code)
+
+
+def render_fragment(request, name, **context):
+    """Фрагмент страницы (HTML строкой) для ответов скриптам"""
+    with request_metrics.timed('render'):
+        return templates.get_template(name).render(template_context(request, context))
+
+
+def wants_json(request):
+    """Запрос от скрипта страницы (fetch), а не переход браузера"""
+    accept = request.headers.get('accept', '')
+    return 'application/json' in accept and 'text/html' not in accept
+
+
+def redirect(request, endpoint, **values):
+    return RedirectResponse(str(request.app.url_path_for(endpoint, **values)), status_code=302)
+
+
+def forbidden():
+    return PlainTextResponse("Доступ запрещен!", status_code=403)
+
+
+async def read_form(request):
+    form = await request.form()
+    if not validate_csrf(request, form):
+        app_logger.warning("CSRF token missing or invalid")
+        return None
+    return form
+
+
+def csrf_failed():
+    return PlainTextResponse("The CSRF token is missing or invalid.", status_code=400)
+
+
+# ===== Маршруты =====
+
+async def index(request):
+    session = request.state.session
+    if not session.get('user_id'):
+        return redirect(request, 'login_route')
+
+    notes, feed_cursor, feed_stale = await get_all_notes(request)
+    if feed_stale:
+        # Заметки пользователя тоже недоступны: используются id из сессии
+        user_note_ids = session.get('note_ids', [])
+    else:
+        user_notes = await get_user_notes(request, session['user_id'])
+        user_note_ids = [note[0] for note in user_notes]
+        # Присваивание помечает сессию измененной и сохраняет ее в хранилище
+        if session.get('note_ids') != user_note_ids:
+            session['note_ids'] = user_note_ids
+
+    notes_formatted = [format_feed_note(note) for note in notes]
+
+    return render_template(request, 'index.html',
+                           notes=notes_formatted,
+                           user_note_ids=user_note_ids,
+                           feed_cursor=feed_cursor,
+                           feed_stale=feed_stale,
+                           feed_fetched_at=last_good_feed['fetched_at'],
+                           username=session.get('username'))
+
+
+async def notes_delta(request):
+    """Заметки, измененные и удаленные после курсора, в виде готовых карточек"""
+    session = request.state.session
+    if not session.get('user_id'):
+        return JSONResponse({'error': 'Требуется вход в систему'}, status_code=401)
+
+    try:
+        since = int(request.query_params.get('since', 0))
+    except ValueError:
+        since = 0
+    delta = await get_feed_delta(since)
+    if delta is None:
+        return JSONResponse({'error': 'Ошибка получения изменений'}, status_code=503)
+    notes, deleted, cursor, reset = delta
+
+    user_id = session['user_id']
+    changed = []
+    for row in notes:
+        note = format_feed_note(row)
+        own_ids = [note['id']] if note['user_id'] == user_id else []
+        changed.append({
+            'id': note['id'],
+            'html': render_fragment(request, '_note_card.html', note=note, user_note_ids=own_ids)
+        })
+
+    return JSONResponse({'cursor': cursor, 'reset': reset, 'notes': changed, 'deleted': deleted})
+
+
+async def notes_stream(request):
+    """Поток server-sent events: номер последнего изменения ленты"""
+    if not request.state.session.get('user_id'):
+        return JSONResponse({'error': 'Требуется вход в систему'}, status_code=401)
+
+    # При переподключении EventSource передает последний полученный номер
+    try:
+        cursor = int(request.headers.get('last-event-id') or request.query_params.get('cursor', 0))
+    except ValueError:
+        cursor = 0
+
+    slot = note_feed.open_stream()
+    if slot is None:
+        return JSONResponse({'error': 'Слишком много открытых потоков'}, status_code=503)
+
+    return StreamingResponse(
+        async_event_stream(note_feed, slot, cursor, max_seconds=NOTES_STREAM_MAX_SECONDS),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        # Место освобождается, даже если генератор не начал выполняться
+        background=BackgroundTask(slot.release)
+    )
+
+
+async def login_route(request):
+    session = request.state.session
+    if request.method == 'POST':
+        form = await read_form(request)
+        if form is None:
+            return csrf_failed()
+
+        username = form.get('username', '').strip()
+        password = form.get('password', '').strip()
+
+        if not username or not password:
+            app_logger.warning("Empty credentials in login attempt")
+            flash(request, 'Заполните все поля', 'error')
+            return render_template(request, 'login.html')
+
+        user_data = await login_user(username, password)
+
+        if user_data:
+            session['user_id'] = user_data[0]
+            session['username'] = user_data[1]
+            app_logger.info(f"User {username} successfully authenticated")
+            flash(request, 'Успешный вход в систему!', 'success')
+            return redirect(request, 'index')
+        else:
+            app_logger.warning(f"Failed authentication for user: {username}")
+            flash(request, 'Неверные учетные данные', 'error')
+
+    return render_template(request, 'login.html')
+
+
+async def register(request):
+    if request.method == 'POST':
+        form = await read_form(request)
+        if form is None:
+            return csrf_failed()
+
+        username = form.get('username', '').strip()
+        password = form.get('password', '')
+        confirm_password = form.get('confirm_password', '')
+
+        if not username or not password:
+            app_logger.warning("Empty registration data")
+            flash(request, 'Заполните все поля', 'error')
+            return render_template(request, 'register.html')
+
+        if password != confirm_password:
+            app_logger.warning(f"Password mismatch for user: {username}")
+            flash(request, 'Пароли не совпадают', 'error')
+            return render_template(request, 'register.html')
+
+        if len(username) < 3:
+            app_logger.warning(f"Too short username: {username}")
+            flash(request, 'Имя пользователя должно быть не менее 3 символов', 'error')
+            return render_template(request, 'register.html')
+
+        if len(password) < 6:
+            app_logger.warning(f"Too short password for user: {username}")
+            flash(request, 'Пароль должен быть не менее 6 символов', 'error')
+            return render_template(request, 'register.html')
+
+        if await user_exists(request, username):
+            app_logger.warning(f"User already exists: {username}")
+            flash(request, 'Пользователь с таким именем уже существует', 'error')
+            return render_template(request, 'register.html')
+
+        if await register_user(request, username, password):
+            flash(request, 'Регистрация успешна! Теперь войдите в систему.', 'success')
+            return redirect(request, 'login_route')
+        else:
+            app_logger.error(f"Registration failed for user: {username}")
+            flash(request, 'Ошибка регистрации', 'error')
+
+    return render_template(request, 'register.html')
+
+
+async def logout(request):
+    session = request.state.session
+    app_logger.info(f"User {session.get('username')} logged out")
+    session.clear()
+    flash(request, 'Вы вышли из системы', 'success')
+    return redirect(request, 'login_route')
+
+
+async def add_note(request):
+    session = request.state.session
+    if not session.get('user_id'):
+        app_logger.warning("Unauthorized add note attempt")
+        return redirect(request, 'login_route')
+
+    form = await read_form(request)
+    if form is None:
+        return csrf_failed()
+
+    title = form.get('title', '').strip()
+    content = form.get('content', '').strip()
+
+    if not title or not content:
+        app_logger.warning("Empty note data")
+        if wants_json(request):
+            return JSONResponse({'error': 'Заполните все поля'}, status_code=400)
+        flash(request, 'Заполните все поля', 'error')
+        return redirect(request, 'index')
+
+    note_id = await add_note_to_db(request, title, content, session['user_id'])
+
+    user_notes = await get_user_notes(request, session['user_id'])
+    session['note_ids'] = [note[0] for note in user_notes]
+
+    if wants_json(request):
+        # Карточку страница получит через /notes/delta
+        if note_id is None:
+            return JSONResponse({'error': 'Ошибка добавления заметки'}, status_code=500)
+        return JSONResponse({'id': note_id}, status_code=201)
+
+    flash(request, 'Заметка добавлена!', 'success')
+    return redirect(request, 'index')
+
+
+async def note_content(request):
+    """Полный текст заметки для раскрытия превью в ленте"""
+    note_id = request.path_params['note_id']
+    if not request.state.session.get('user_id'):
+        return JSONResponse({'error': 'Требуется вход в систему'}, status_code=401)
+
+    content = await get_note_content(request, note_id)
+    if content is None:
+        return JSONResponse({'error': 'Заметка не найдена'}, status_code=404)
+
+    return JSONResponse({'id': note_id, 'content': content})
+
+
+async def edit_note(request):
+    session = request.state.session
+    note_id = request.path_params['note_id']
+    if not session.get('user_id'):
+        app_logger.warning(f"Unauthorized edit attempt for note {note_id}")
+        return redirect(request, 'login_route')
+
+    note = await get_note_by_id(request, note_id, session['user_id'])
+    if not note:
+        app_logger.warning(f"Unauthorized access to note {note_id} by user {session['user_id']}")
+        return forbidden()
+
+    if request.method == 'POST':
+        form = await read_form(request)
+        if form is None:
+            return csrf_failed()
+
+        success = await update_note_in_db(request, note_id, form.get('title', ''),
+                                          form.get('content', ''), session['user_id'])
+        if success:
+            flash(request, 'Заметка обновлена!', 'success')
+            return redirect(request, 'index')
+        else:
+            app_logger.error(f"Failed to update note {note_id}")
+            flash(request, 'Ошибка обновления заметки', 'error')
+
+    note_formatted = {
+        'id': note[0],
+        'title': note[1],
+        'content': note[2],
+        'user_id': note[3],
+        'created_at': note[4]
+    }
+
+    return render_template(request, 'edit.html', note=note_formatted)
+
+
+async def delete_note(request):
+    session = request.state.session
+    note_id = request.path_params['note_id']
+    if not session.get('user_id'):
+        app_logger.warning(f"Unauthorized delete attempt for note {note_id}")
+        return redirect(request, 'login_route')
+
+    success = await delete_note_from_db(request, note_id, session['user_id'])
+    if not success:
+        app_logger.warning(f"Failed delete attempt for note {note_id} by user {session['user_id']}")
+        if wants_json(request):
+            return JSONResponse({'error': 'Доступ запрещен!'}, status_code=403)
+        return forbidden()
+
+    if note_id in session.get('note_ids', []):
+        session['note_ids'] = [existing for existing in session['note_ids'] if existing != note_id]
+
+    if wants_json(request):
+        return JSONResponse({'deleted': note_id})
+
+    flash(request, 'Заметка удалена!', 'success')
+    return redirect(request, 'index')
+
+
+# Специальные маршруты для тестирования SIEM (можно удалить в продакшене)
+async def admin_panel(request):
+    app_logger.warning(f"Access attempt to admin panel from {current_ip.get()}")
+    return forbidden()
+
+
+async def api_delete(request):
+    app_logger.warning(f"API delete attempt for note {request.path_params['note_id']} from {current_ip.get()}")
+    return forbidden()
+
+
+async def env_file(request):
+    app_logger.warning(f"Access attempt to .env from {current_ip.get()}")
+    return forbidden()
+
+
+async def config(request):
+    app_logger.warning(f"Access attempt to config from {current_ip.get()}")
+    return forbidden()
+
+
+async def backup(request):
+    app_logger.warning(f"Access attempt to backup from {current_ip.get()}")
+    return forbidden()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await database.start()
+    app_logger.info("Async режим: пул asyncpg создан")
+    note_feed.start()
+    yield
+    await note_feed.close()
+    await database.close()
+
+
+routes = [
+    Route('/', index, name='index'),
+    Route('/login', login_route, methods=['GET', 'POST'], name='login_route'),
+    Route('/register', register, methods=['GET', 'POST'], name='register'),
+    Route('/logout', logout, name='logout'),
+    Route('/add', add_note, methods=['POST'], name='add_note'),
+    Route('/note/{note_id:int}/content', note_content, name='note_content'),
+    Route('/notes/delta', notes_delta, name='notes_delta'),
+    Route('/notes/stream', notes_stream, name='notes_stream'),
+    Route('/edit/{note_id:int}', edit_note, methods=['GET', 'POST'], name='edit_note'),
+    Route('/delete/{note_id:int}', delete_note, name='delete_note'),
+    Route('/admin', admin_panel, name='admin_panel'),
+    Route('/api/delete/{note_id:int}', api_delete, name='api_delete'),
+    Route('/.env', env_file, name='env_file'),
+    Route('/config', config, name='config'),
+    Route('/backup', backup, name='backup'),
+    Mount('/static', StaticFiles(directory='static'), name='static'),
+]
+
+middleware = [Middleware(SessionMiddleware)]
+if os.getenv('IP_BLOCKLIST_ENABLED', '1') == '1':
+    # Заблокированные SIEM адреса отклоняются до загрузки сессии и логирования
+    middleware.insert(0, Middleware(IPBlocklistASGIMiddleware,
+                                    blocklist=IPBlocklist(os.getenv('IP_BLOCKLIST_PATH', 'data/ip_blocklist.bin'))))
+
+app = Starlette(routes=routes, middleware=middleware, lifespan=lifespan)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Сравнение режимов сервера: waitress (sync) и uvicorn + asyncpg (async).
+
+Для каждого режима запускает run_production.py, входит под тестовым
+пользователем в N параллельных клиентах и нагружает ленту заметок (/).
+Выводит запросы в секунду и p50/p99 задержки.
+
+Пример:
+    python benchmarks/bench_async.py --concurrency 200 --duration 30
+"""
+
+import argparse
+import http.client
+import os
+import threading
+import time
+
+from harness import Client, percentile, start_server, stop_server
+
+
+def run_load(host, port, concurrency, duration, username, password):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(concurrency + 1)
+    deadline = [0.0]
+
+    def worker():
+        client = Client(host, port)
+        local_latencies = []
+        local_errors = 0
+        try:
+            client.login(username, password)
+        except Exception:
+            local_errors += 1
+        start_barrier.wait()
+        while time.perf_counter() < deadline[0]:
+            started = time.perf_counter()
+            try:
+                status, _ = client.request('GET', '/')
+                if status != 200:
+                    local_errors += 1
+            except (OSError, http.client.HTTPException):
+                local_errors += 1
+                client.close()
+                client = Client(host, port)
+                continue
+            local_latencies.append(time.perf_counter() - started)
+        client.close()
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    deadline[0] = time.perf_counter() + duration
+    start_barrier.wait()
+    for thread in threads:
+        thread.join()
+
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'rps': len(latencies) / duration,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение sync и async режимов сервера')
+    parser.add_argument('--modes', default='sync,async')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5101)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--username', default='testuser')
+    parser.add_argument('--password', default=os.getenv('TEST_USER_PASSWORD', 'testpassword123'))
+    args = parser.parse_args()
+
+    results = {}
+    for offset, mode in enumerate(args.modes.split(',')):
+        port = args.port + offset
+        process = start_server(mode, args.host, port)
+        try:
+            print(f"[BENCH] {mode}: {args.concurrency} клиентов, {args.duration} с...")
+            results[mode] = run_load(args.host, port, args.concurrency, args.duration,
+                                     args.username, args.password)
+        finally:
+            stop_server(process)
+
+    print(f"\n{'Режим':<8} {'RPS':>10} {'p50, мс':>10} {'p99, мс':>10} {'Ошибки':>8}")
+    for mode, result in results.items():
+        print(f"{mode:<8} {result['rps']:>10.1f} {result['p50_ms']:>10.1f} "
+              f"{result['p99_ms']:>10.1f} {result['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()
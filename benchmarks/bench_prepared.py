@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Задержка частых запросов PostgreSQL: текст запроса против подготовленного выражения.
+
+Для каждого запроса из queries.PREPARED_STATEMENTS замеряются три варианта:
+- connect: новое подключение на каждый вызов (поведение до пула подключений);
+- text: долгоживущее подключение, запрос каждый раз отправляется текстом
+  (сервер разбирает и планирует его заново);
+- prepared: долгоживущее подключение, EXECUTE подготовленного выражения.
+
+Данные заполняются так же, как в load_test.py. Выводит p50/p99 в миллисекундах.
+
+Пример:
+    python benchmarks/bench_prepared.py --users 50 --notes-per-user 20 --iterations 1000
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+
+from bench_storage import measure
+from harness import ROOT
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Подготовленные выражения против текста запроса')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--notes-per-user', type=int, default=20)
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--connect-iterations', type=int, default=100,
+                        help='вызовов с новым подключением (0 - без этого замера)')
+    parser.add_argument('--output', help='JSON файл с результатами')
+    args = parser.parse_args()
+
+    os.environ['STORAGE_BACKEND'] = 'postgres'
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    from load_test import USER_PREFIX, seed_database
+
+    seed_database(args.users, args.notes_per_user)
+
+    import app
+    from prepared_statements import StatementRegistry
+    from queries import PREPARED_STATEMENTS, SELECT_USER_BY_USERNAME
+    app.app_logger.setLevel(logging.WARNING)
+
+    node = app.db_router.primary
+    conn = node.connect()
+    cursor = conn.cursor()
+    cursor.execute(SELECT_USER_BY_USERNAME, (f"{USER_PREFIX}0",))
+    user_id = cursor.fetchone()[0]
+    cursor.execute("SELECT id FROM notes WHERE user_id = %s LIMIT 1", (user_id,))
+    note_id = cursor.fetchone()[0]
+    conn.rollback()
+
+    params = {
+        'notes_feed': None,
+        'user_notes': (user_id,),
+        'note_by_id': (note_id, user_id),
+        'user_by_username': (f"{USER_PREFIX}0",),
+    }
+    registry = StatementRegistry(PREPARED_STATEMENTS)
+
+    def run_text(query, values):
+        cursor.execute(query, values)
+        cursor.fetchall()
+        conn.rollback()
+
+    def run_prepared(query, values):
+        registry.execute(cursor, query, values)
+        cursor.fetchall()
+        conn.rollback()
+
+    def run_connect(query, values):
+        fresh = node.connect()
+        fresh_cursor = fresh.cursor()
+        fresh_cursor.execute(query, values)
+        fresh_cursor.fetchall()
+        fresh.close()
+
+    results = {}
+    for name, query in PREPARED_STATEMENTS.items():
+        values = params[name]
+        # Прогрев: подготовка выражения и кэши сервера не входят в замер
+        run_text(query, values)
+        run_prepared(query, values)
+        results[name] = {
+            'text': measure(lambda: run_text(query, values), args.iterations),
+            'prepared': measure(lambda: run_prepared(query, values), args.iterations),
+        }
+        if args.connect_iterations:
+            results[name]['connect'] = measure(lambda: run_connect(query, values), args.connect_iterations)
+
+    cursor.close()
+    conn.close()
+
+    variants = ('connect', 'text', 'prepared') if args.connect_iterations else ('text', 'prepared')
+    print(f"{'Запрос':<18}" + ''.join(f"{variant + ' p50':>16}{variant + ' p99':>16}" for variant in variants)
+          + f"{'ускорение p50':>16}")
+    for name, stats in results.items():
+        row = f"{name:<18}"
+        for variant in variants:
+            row += f"{stats[variant]['p50_ms']:>16.3f}{stats[variant]['p99_ms']:>16.3f}"
+        speedup = stats['text']['p50_ms'] / stats['prepared']['p50_ms'] if stats['prepared']['p50_ms'] else 0
+        print(row + f"{speedup:>15.2f}x")
+    print("(значения в миллисекундах; ускорение - text против prepared)")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Производительность и точность SIEM на синтетическом потоке событий.
+
+1. Повторный разбор: поток из security_events.py (обычный трафик и
+   атаки с известными IP) прогоняется через SecurityMonitor.parse_flask_log
+   без пауз. Выводит строк в секунду, задержку обнаружения по времени
+   событий и precision/recall относительно внедренных атак.
+2. Реальное время: генератор пишет строки в файл с заданной частотой, монитор
+   читает его через tail_file, как в production. Выводит задержку от записи
+   первой строки атаки до оповещения.
+
+Пример:
+    python benchmarks/bench_siem.py --duration 3600 --rate 100 --live-seconds 30
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from harness import ROOT, percentile
+
+sys.path.insert(0, ROOT)
+from siem_monitor import SecurityMonitor  # noqa: E402
+from security_events import ATTACK_ALERTS, LogEventGenerator  # noqa: E402
+
+
+def create_monitor():
+    """SecurityMonitor с перехватом оповещений; вывод в консоль подавлен"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        monitor = SecurityMonitor()
+    alerts = []
+    monitor.alert_listeners.append(
+        lambda alert_type, ip, message, details: alerts.append((alert_type, ip, monitor.event_time, time.time()))
+    )
+    return monitor, alerts
+
+
+def evaluate(truth, alerts):
+    """Precision/recall по парам (IP, категория атаки) и время первого оповещения по атаке"""
+    category_of = {alert_type: category for category, types in ATTACK_ALERTS.items() for alert_type in types}
+    expected = {(attack['ip'], attack['category']): attack for attack in truth}
+
+    first_alert = {}
+    for alert_type, ip, event_time, wall_time in alerts:
+        key = (ip, category_of.get(alert_type, alert_type))
+        if key not in first_alert:
+            first_alert[key] = (event_time, wall_time)
+
+    detected = set(first_alert)
+    true_positive = detected & set(expected)
+    per_category = {}
+    for category in ATTACK_ALERTS:
+        category_expected = {key for key in expected if key[1] == category}
+        category_detected = {key for key in detected if key[1] == category}
+        hits = category_expected & category_detected
+        per_category[category] = {
+            'attacks': len(category_expected),
+            'detected': len(hits),
+            'false_alerts': len(category_detected - hits),
+            'recall': round(len(hits) / len(category_expected), 3) if category_expected else None,
+        }
+    return {
+        'precision': round(len(true_positive) / len(detected), 3) if detected else None,
+        'recall': round(len(true_positive) / len(expected), 3) if expected else None,
+        'categories': per_category,
+    }, {key: (first_alert[key], expected[key]['start']) for key in true_positive}
+
+
+def delays(matches, index):
+    values = defaultdict(list)
+    for (ip, category), (times, started) in matches.items():
+        values[category].append(max(times[index] - started, 0.0))
+    return {
+        category: {'p50_s': round(percentile(items, 50), 3), 'p95_s': round(percentile(items, 95), 3)}
+        for category, items in values.items()
+    }
+
+
+def run_replay(args):
+    generator = LogEventGenerator(args.rate, args.brute_force_every, args.sqli_every, args.scan_every,
+                                  seed=args.seed)
+    lines = [line for _, line, _, _ in generator.generate(args.duration, time.time() - args.duration)]
+    monitor, alerts = create_monitor()
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for line in lines:
+            monitor.parse_flask_log(line)
+    elapsed = time.perf_counter() - started
+
+    quality, matches = evaluate(generator.truth, alerts)
+    return {
+        'lines': len(lines),
+        'seconds': round(elapsed, 3),
+        'lines_per_second': round(len(lines) / elapsed),
+        'alerts': len(alerts),
+        # Задержка по времени событий: от первой строки атаки до строки, вызвавшей оповещение
+        'detection_delay_event_time': delays(matches, 0),
+        **quality,
+    }
+
+
+def run_live(args):
+    every = args.live_attack_every
+    generator = LogEventGenerator(args.live_rate, every, every, every, seed=args.seed)
+    monitor, alerts = create_monitor()
+    log_path = os.path.join(os.getcwd(), 'logs', 'live_bench.log')
+    open(log_path, 'w').close()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        threading.Thread(target=monitor.tail_file, args=(log_path, monitor.parse_flask_log), daemon=True).start()
+        time.sleep(0.5)  # tail_file начинает чтение с конца файла
+
+        written = 0
+        with open(log_path, 'a', encoding='utf-8') as f:
+            for at, line, _, _ in generator.generate(args.live_seconds, time.time()):
+                delay = at - time.time()
+                if delay > 0:
+                    f.flush()
+                    time.sleep(delay)
+                f.write(line + '\n')
+                written += 1
+        time.sleep(1.0)  # дочитывание хвоста
+
+    quality, matches = evaluate(generator.truth, alerts)
+    return {
+        'lines': written,
+        'lines_per_second': round(written / args.live_seconds),
+        'alerts': len(alerts),
+        # Задержка от записи первой строки атаки до оповещения (с учетом опроса файла)
+        'detection_latency_wall': delays(matches, 1),
+        **quality,
+    }
+
+
+def print_results(title, results):
+    print(f"\n{title}")
+    print(f"  Строк: {results['lines']}, строк/с: {results['lines_per_second']}, оповещений: {results['alerts']}")
+    print(f"  Precision: {results['precision']}, recall: {results['recall']}")
+    for category, stats in results['categories'].items():
+        print(f"  {category:<14} атак {stats['attacks']:>4}, обнаружено {stats['detected']:>4}, "
+              f"ложных {stats['false_alerts']:>4}, recall {stats['recall']}")
+    for key in ('detection_delay_event_time', 'detection_latency_wall'):
+        for category, stats in results.get(key, {}).items():
+            print(f"  задержка {category:<14} p50 {stats['p50_s']:.3f} с, p95 {stats['p95_s']:.3f} с")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Пропускная способность и точность SIEM')
+    parser.add_argument('--duration', type=float, default=3600, help='длительность потока для разбора, с')
+    parser.add_argument('--rate', type=float, default=50, help='обычных запросов в секунду в потоке')
+    parser.add_argument('--brute-force-every', type=float, default=60)
+    parser.add_argument('--sqli-every', type=float, default=90)
+    parser.add_argument('--scan-every', type=float, default=120)
+    parser.add_argument('--live-seconds', type=float, default=20, help='0 - без замера в реальном времени')
+    parser.add_argument('--live-rate', type=float, default=200)
+    parser.add_argument('--live-attack-every', type=float, default=5, help='интервал атак каждого типа в реальном времени, с')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='JSON файл с результатами')
+    args = parser.parse_args()
+
+    results = {}
+    # Оповещения SIEM пишутся в logs/ текущего каталога - используется временный каталог
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        results['replay'] = run_replay(args)
+        print_results("Повторный разбор", results['replay'])
+        if args.live_seconds > 0:
+            results['live'] = run_live(args)
+            print_results("Реальное время (tail_file)", results['live'])
+        os.chdir(ROOT)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Задержка функций слоя данных для разных хранилищ (PostgreSQL и SQLite).
+
+Каждое хранилище проверяется в отдельном процессе (конфигурация app.py
+читается при импорте): заполняются тестовые данные, затем каждая функция
+вызывается N раз напрямую, без HTTP. Выводит p50/p99 в миллисекундах.
+
+Пример:
+    python benchmarks/bench_storage.py --backends postgres,sqlite --iterations 500
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+from harness import ROOT, percentile
+
+OPERATIONS = (
+    'get_all_notes', 'get_user_notes', 'get_note_by_id', 'user_exists',
+    'add_note_to_db', 'update_note_in_db', 'delete_note_from_db',
+)
+
+
+def measure(function, iterations):
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - started)
+    return {
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def run_worker(args):
+    """Замеры в текущем процессе для хранилища из STORAGE_BACKEND"""
+    from load_test import USER_PREFIX, seed_database
+
+    seed_database(args.users, args.notes_per_user)
+
+    import app
+    app.app_logger.setLevel(logging.WARNING)
+
+    user_id = app.login_user(f"{USER_PREFIX}0", 'bench_password_123')[0]
+    note_id = app.get_user_notes(user_id)[0][0]
+    created = []
+
+    operations = {
+        'get_all_notes': lambda: app.get_all_notes(),
+        'get_user_notes': lambda: app.get_user_notes(user_id),
+        'get_note_by_id': lambda: app.get_note_by_id(note_id, user_id),
+        'user_exists': lambda: app.user_exists(f"{USER_PREFIX}0"),
+        'add_note_to_db': lambda: created.append(app.add_note_to_db('Замер', 'Текст замера', user_id)),
+        'update_note_in_db': lambda: app.update_note_in_db(note_id, 'Замер', 'Новый текст', user_id),
+        'delete_note_from_db': lambda: app.delete_note_from_db(created.pop(), user_id),
+    }
+
+    results = {name: measure(operations[name], args.iterations) for name in OPERATIONS}
+    print(json.dumps(results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Задержка слоя данных для разных хранилищ')
+    parser.add_argument('--backends', default='postgres,sqlite')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--notes-per-user', type=int, default=20)
+    parser.add_argument('--iterations', type=int, default=300)
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    results = {}
+    for backend in args.backends.split(','):
+        env = dict(os.environ, STORAGE_BACKEND=backend,
+                   SQLITE_DB_PATH=os.path.join(ROOT, 'data', 'bench_notes.sqlite3'))
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker',
+             '--users', str(args.users), '--notes-per-user', str(args.notes_per_user),
+             '--iterations', str(args.iterations)],
+            cwd=ROOT, env=env, capture_output=True, text=True
+        )
+        lines = [line for line in output.stdout.splitlines() if line.startswith('{')]
+        if output.returncode != 0 or not lines:
+            print(f"[ERROR] Замер {backend} не выполнен:\n{output.stderr[-2000:]}")
+            continue
+        results[backend] = json.loads(lines[-1])
+
+    backends = list(results)
+    header = f"{'Операция':<22}" + ''.join(f"{backend + ' p50':>16}{backend + ' p99':>16}" for backend in backends)
+    print(header)
+    for name in OPERATIONS:
+        row = f"{name:<22}"
+        for backend in backends:
+            row += f"{results[backend][name]['p50_ms']:>16.3f}{results[backend][name]['p99_ms']:>16.3f}"
+        print(row)
+    print("(значения в миллисекундах)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Общие инструменты нагрузочных тестов: HTTP клиент с сессией,
+запуск сервера через run_production.py и подсчет перцентилей.
+"""
+
+import http.client
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CSRF_RE = re.compile(r'name="csrf_token" value="([^"]+)"')
+
+
+class Client:
+    """HTTP клиент с keep-alive и cookie сессии"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.conn = http.client.HTTPConnection(host, port, timeout=30)
+        self.cookies = {}
+        self.csrf_token = None
+
+    def request(self, method, path, form=None, headers=None):
+        headers = dict(headers or {})
+        body = None
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f"{name}={value}" for name, value in self.cookies.items())
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            # Сервер закрыл keep-alive соединение: переподключаемся для следующего запроса
+            self.conn.close()
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            raise
+
+        for header in response.headers.get_all('Set-Cookie') or []:
+            name, _, rest = header.partition('=')
+            value = rest.split(';', 1)[0]
+            if value:
+                self.cookies[name] = value
+            else:
+                self.cookies.pop(name, None)
+
+        text = data.decode('utf-8', errors='ignore')
+        match = CSRF_RE.search(text)
+        if match:
+            self.csrf_token = match.group(1)
+        return response.status, text
+
+    def login(self, username, password):
+        status, _ = self.request('GET', '/login')
+        if not self.csrf_token:
+            raise RuntimeError(f"Не найден csrf_token на странице входа (HTTP {status})")
+        status, _ = self.request('POST', '/login', {
+            'csrf_token': self.csrf_token, 'username': username, 'password': password
+        })
+        if status != 302:
+            raise RuntimeError(f"Вход не выполнен (HTTP {status})")
+        return status
+
+    def close(self):
+        self.conn.close()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def wait_for_port(host, port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def start_server(mode, host, port, extra_env=None, log_path=None):
+    """Запуск run_production.py в отдельном процессе и ожидание порта"""
+    env = dict(os.environ, SERVER_MODE=mode, SERVER_HOST=host, SERVER_PORT=str(port))
+    env.update(extra_env or {})
+    output = open(log_path, 'w') if log_path else subprocess.DEVNULL
+    process = subprocess.Popen(
+        [sys.executable, 'run_production.py'],
+        cwd=ROOT, env=env, stdout=output, stderr=subprocess.STDOUT
+    )
+    if not wait_for_port(host, port):
+        stop_server(process)
+        raise RuntimeError(f"Сервер в режиме {mode} не запустился на порту {port}")
+    return process
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест приложения заметок.
+
+1. Запускает сервер (run_production.py в режиме SERVER_MODE) или использует уже запущенный.
+2. Заполняет хранилище (STORAGE_BACKEND) тестовыми пользователями и заметками.
+3. Много параллельных клиентов выполняют смесь действий: вход, лента,
+   добавление, редактирование и удаление заметок.
+4. Печатает пропускную способность и p50/p95/p99 по каждому эндпоинту,
+   сохраняет результат в JSON и сравнивает его с базовым (для CI).
+
+Пример:
+    python benchmarks/load_test.py --users 50 --notes-per-user 20 --clients 100 \\
+        --duration 60 --output logs/bench/result.json --baseline benchmarks/baseline.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from harness import ROOT, Client, percentile, start_server, stop_server
+
+USER_PREFIX = 'bench_user_'
+# Шаблон LIKE для тестовых пользователей: '_' экранируется, иначе он совпадает
+# с любым символом (например, с пользователем benchXuserY)
+USER_PATTERN = USER_PREFIX.replace('_', '\\_') + '%'
+BENCH_PASSWORD = 'bench_password_123'
+DEFAULT_MIX = 'feed=60,add=10,edit=10,delete=5,login=15'
+EDIT_LINK_RE = re.compile(r'/edit/(\d+)')
+
+
+def parse_mix(value):
+    """'feed=60,add=10' -> {'feed': 60.0, 'add': 10.0}"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ('feed', 'add', 'edit', 'delete', 'login'):
+            raise ValueError(f"Неизвестное действие в смеси нагрузки: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def seed_database(users, notes_per_user):
+    """Пересоздание тестовых пользователей и заметок в настроенном хранилище"""
+    sys.path.insert(0, ROOT)
+    from werkzeug.security import generate_password_hash
+    from app import get_db_connection, init_database, release_db_connection, storage
+    from queries import INSERT_USER, note_preview
+
+    init_database()
+    conn = get_db_connection()
+    if conn is None:
+        raise RuntimeError(f"Нет подключения к хранилищу {storage.name} для заполнения данными")
+
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    cursor = conn.cursor()
+    try:
+        storage.execute(cursor, "DELETE FROM users WHERE username LIKE %s ESCAPE '\\'", (USER_PATTERN,))
+        cursor.executemany(
+            storage.sql(INSERT_USER),
+            [(f"{USER_PREFIX}{index}", password_hash) for index in range(users)]
+        )
+        storage.execute(cursor, "SELECT id FROM users WHERE username LIKE %s ESCAPE '\\'", (USER_PATTERN,))
+        content = 'Текст тестовой заметки. ' * 20
+        notes = [
+            (f"Заметка {number} пользователя {user_id}", content, note_preview(content), user_id)
+            for (user_id,) in cursor.fetchall()
+            for number in range(notes_per_user)
+        ]
+        cursor.executemany(
+            storage.sql("INSERT INTO notes (title, content, preview, user_id) VALUES (%s, %s, %s, %s)"), notes
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+        release_db_connection(conn)
+
+    print(f"[SEED] {storage.name}: пользователей {users}, заметок {users * notes_per_user}")
+
+
+class ClientScenario:
+    """Поведение одного виртуального пользователя"""
+
+    def __init__(self, index, config, record):
+        self.username = f"{USER_PREFIX}{index % config['users']}"
+        self.client = Client(config['host'], config['port'])
+        self.random = random.Random(config['seed'] + index)
+        self.actions = list(config['mix'])
+        self.weights = [config['mix'][name] for name in self.actions]
+        self.record = record
+        self.own_note_ids = []
+        self.counter = 0
+
+    def timed(self, endpoint, method, path, form=None, expected=(200, 302)):
+        started = time.perf_counter()
+        try:
+            status, text = self.client.request(method, path, form)
+        except Exception:
+            self.record(endpoint, time.perf_counter() - started, False)
+            return None
+        self.record(endpoint, time.perf_counter() - started, status in expected)
+        return text
+
+    def login(self):
+        self.timed('login_form', 'GET', '/login')
+        self.timed('login', 'POST', '/login', {
+            'csrf_token': self.client.csrf_token or '',
+            'username': self.username,
+            'password': BENCH_PASSWORD
+        }, expected=(302,))
+
+    def feed(self):
+        text = self.timed('feed', 'GET', '/', expected=(200,))
+        if text is not None:
+            self.own_note_ids = [int(note_id) for note_id in EDIT_LINK_RE.findall(text)]
+
+    def add(self):
+        self.counter += 1
+        self.timed('add', 'POST', '/add', {
+            'csrf_token': self.client.csrf_token or '',
+            'title': f"Нагрузочная заметка {self.counter}",
+            'content': 'Текст заметки из нагрузочного теста'
+        }, expected=(302,))
+
+    def edit(self):
+        if not self.own_note_ids:
+            return self.add()
+        note_id = self.random.choice(self.own_note_ids)
+        self.timed('edit_form', 'GET', f"/edit/{note_id}", expected=(200, 403))
+        self.timed('edit', 'POST', f"/edit/{note_id}", {
+            'csrf_token': self.client.csrf_token or '',
+            'title': f"Отредактировано {self.counter}",
+            'content': 'Новый текст заметки'
+        }, expected=(302, 403))
+
+    def delete(self):
+        if not self.own_note_ids:
+            return self.add()
+        note_id = self.own_note_ids.pop(self.random.randrange(len(self.own_note_ids)))
+        # 403 возможен, если заметку уже удалил другой клиент этого пользователя
+        self.timed('delete', 'GET', f"/delete/{note_id}", expected=(302, 403))
+
+    def relogin(self):
+        try:
+            self.client.request('GET', '/logout')
+        except Exception:
+            pass
+        self.login()
+
+    def step(self):
+        action = self.random.choices(self.actions, self.weights)[0]
+        handler = self.relogin if action == 'login' else getattr(self, action)
+        handler()
+
+
+def run_process(client_indexes, config):
+    """Клиенты одного процесса; метрики записываются только после start_at"""
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+
+    def record(endpoint, latency, ok):
+        if time.time() < config['start_at']:
+            return
+        with lock:
+            latencies[endpoint].append(latency)
+            if not ok:
+                errors[endpoint] += 1
+
+    def worker(index):
+        scenario = ClientScenario(index, config, record)
+        try:
+            scenario.login()
+            scenario.feed()
+        except Exception:
+            pass
+        while time.time() < config['start_at'] + config['duration']:
+            scenario.step()
+        scenario.client.close()
+
+    threads = [threading.Thread(target=worker, args=(index,), daemon=True) for index in client_indexes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return dict(latencies), dict(errors)
+
+
+def summarize(latencies, errors, duration):
+    endpoints = {}
+    all_latencies = []
+    for endpoint in sorted(latencies):
+        values = latencies[endpoint]
+        all_latencies.extend(values)
+        endpoints[endpoint] = {
+            'requests': len(values),
+            'errors': errors.get(endpoint, 0),
+            'throughput_rps': round(len(values) / duration, 2),
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p95_ms': round(percentile(values, 95) * 1000, 2),
+            'p99_ms': round(percentile(values, 99) * 1000, 2),
+        }
+    total = {
+        'requests': len(all_latencies),
+        'errors': sum(errors.values()),
+        'throughput_rps': round(len(all_latencies) / duration, 2),
+        'p50_ms': round(percentile(all_latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(all_latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(all_latencies, 99) * 1000, 2),
+    }
+    return endpoints, total
+
+
+def compare_with_baseline(result, baseline, tolerance):
+    """Список регрессий: рост p95 или падение пропускной способности больше допуска"""
+    regressions = []
+    for endpoint, current in result['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(endpoint)
+        if not previous:
+            continue
+        if previous['p95_ms'] and current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{endpoint}: p95 {previous['p95_ms']} -> {current['p95_ms']} мс")
+        if previous['throughput_rps'] and current['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance):
+            regressions.append(
+                f"{endpoint}: throughput {previous['throughput_rps']} -> {current['throughput_rps']} rps"
+            )
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result):
+    print(f"\n{'Эндпоинт':<12} {'Запросы':>8} {'Ошибки':>7} {'RPS':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    rows = list(result['endpoints'].items()) + [('ВСЕГО', result['total'])]
+    for endpoint, stats in rows:
+        print(f"{endpoint:<12} {stats['requests']:>8} {stats['errors']:>7} {stats['throughput_rps']:>8.1f} "
+              f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест приложения заметок')
+    parser.add_argument('--server-mode', default=os.getenv('SERVER_MODE', 'sync'))
+    parser.add_argument('--storage', default=os.getenv('STORAGE_BACKEND', 'postgres'),
+                        help='хранилище данных: postgres или sqlite')
+    parser.add_argument('--no-server', action='store_true', help='использовать уже запущенный сервер')
+    parser.add_argument('--no-seed', action='store_true', help='не пересоздавать тестовые данные')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5201)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--notes-per-user', type=int, default=20)
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--processes', type=int, default=max(1, min(4, os.cpu_count() or 1)))
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--ramp', type=float, default=5, help='секунд на вход клиентов до начала замеров')
+    parser.add_argument('--mix', default=DEFAULT_MIX)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=f"logs/bench/load_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    parser.add_argument('--baseline', help='JSON с прошлым результатом для поиска регрессий')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='допустимое ухудшение (0.15 = 15%%)')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    # Сервер и заполнение данных должны использовать одно хранилище
+    os.environ['STORAGE_BACKEND'] = args.storage
+    os.environ.setdefault('SQLITE_DB_PATH', os.path.join(ROOT, 'data', 'notes.sqlite3'))
+
+    process = None
+    if not args.no_server:
+        process = start_server(args.server_mode, args.host, args.port,
+                               log_path=os.path.join(ROOT, 'logs', 'bench_server.log'))
+
+    try:
+        if not args.no_seed:
+            seed_database(args.users, args.notes_per_user)
+
+        config = {
+            'host': args.host,
+            'port': args.port,
+            'users': args.users,
+            'mix': mix,
+            'seed': args.seed,
+            'duration': args.duration,
+            'start_at': time.time() + args.ramp,
+        }
+        processes = max(1, min(args.processes, args.clients))
+        chunks = [list(range(index, args.clients, processes)) for index in range(processes)]
+        print(f"[BENCH] {args.clients} клиентов в {processes} процессах, {args.duration} с, смесь: {args.mix}")
+
+        with multiprocessing.Pool(processes) as pool:
+            parts = pool.starmap(run_process, [(chunk, config) for chunk in chunks])
+    finally:
+        if process is not None:
+            stop_server(process)
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    for part_latencies, part_errors in parts:
+        for endpoint, values in part_latencies.items():
+            latencies[endpoint].extend(values)
+        for endpoint, count in part_errors.items():
+            errors[endpoint] += count
+
+    endpoints, total = summarize(latencies, errors, args.duration)
+    result = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'server_mode': args.server_mode,
+            'storage': args.storage,
+            'clients': args.clients,
+            'duration': args.duration,
+            'users': args.users,
+            'notes_per_user': args.notes_per_user,
+            'mix': mix,
+        },
+        'endpoints': endpoints,
+        'total': total,
+    }
+    print_report(result)
+
+    output_dir = os.path.dirname(args.output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\n[BENCH] Результат сохранен: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(result, baseline, args.tolerance)
+        if regressions:
+            print("[REGRESSION] Ухудшение относительно базового результата:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print("[OK] Регрессий относительно базового результата нет")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Генератор событий безопасности для проверки SIEM
+
+Пишет строки в формате logs/flask_app.log (записи доступа формирует
+access_log.format_access_record, как в приложении): обычный трафик пользователей
+вперемешку с атаками (перебор паролей, SQL-инъекции, сканирование
+honeypot-эндпоинтов). Атаки идут с отдельных IP, их список с временем
+начала сохраняется как эталон для оценки точности (--truth).
+
+Примеры:
+    # Поток в реальном времени в лог приложения (запущенный siem_monitor.py его увидит)
+    python benchmarks/security_events.py --rate 50 --duration 120
+
+    # Сутки трафика с временем событий "в прошлом", без пауз
+    python benchmarks/security_events.py --batch --duration 86400 --output logs/synthetic.log --truth logs/truth.json
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import datetime
+from urllib.parse import urlencode
+
+from harness import ROOT
+
+sys.path.insert(0, ROOT)
+from access_log import format_access_record  # noqa: E402
+from request_metrics import RequestMetrics  # noqa: E402
+
+# Категории атак и типы оповещений SIEM, которые считаются их обнаружением
+ATTACK_ALERTS = {
+    'brute_force': {'BRUTE_FORCE'},
+    'sql_injection': {'SQL_INJECTION'},
+    'scan': {'SCAN', 'UNAUTHORIZED_ACCESS', 'SUSPICIOUS_ACTIVITY'},
+}
+
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 14_5) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Safari/605.1.15',
+    'Mozilla/5.0 (X11; Linux x86_64; rv:127.0) Gecko/20100101 Firefox/127.0',
+]
+ATTACK_USER_AGENTS = ['python-requests/2.31.0', 'sqlmap/1.8#stable', 'Nikto/2.5.0', 'curl/8.5.0']
+
+NOTE_TITLES = ['Покупки', 'План на неделю', 'Идеи', 'Встреча', 'Книги', 'Рецепт']
+
+SQL_PAYLOADS = [
+    "1' OR '1'='1",
+    "1' OR 1=1--",
+    "1 UNION SELECT username, password_hash FROM users",
+    "1; DROP TABLE notes",
+    "' UNION SELECT NULL, version()--",
+]
+
+# Ловушки приложения: путь -> (эндпоинт, текст предупреждения)
+HONEYPOTS = {
+    '/admin': ('admin_panel', 'admin panel'),
+    '/.env': ('env_file', '.env'),
+    '/config': ('config', 'config'),
+    '/backup': ('backup', 'backup'),
+}
+SCAN_PATHS = [
+    '/phpmyadmin', '/wp-login.php', '/wp-admin/', '/.git/config', '/server-status', '/actuator/health',
+    '/api/v1/users', '/db.sql', '/backup.zip', '/config.php', '/.aws/credentials', '/cgi-bin/test.cgi',
+    '/vendor/phpunit/phpunit/src/Util/PHP/eval-stdin.php', '/.DS_Store', '/solr/admin', '/console',
+    '/manager/html', '/xmlrpc.php', '/login.action', '/.svn/entries', '/owa/', '/jenkins/login',
+    '/debug/default/view', '/telescope/requests', '/_profiler/phpinfo', '/api/swagger.json',
+]
+
+
+def metrics(endpoint, queries=0, rows=0, render=True):
+    """Метрики запроса со случайными временами этапов"""
+    result = RequestMetrics(endpoint)
+    result.started_at = time.perf_counter() - random.uniform(0.8, 25.0) / 1000
+    result.queries = queries
+    result.rows = rows
+    if queries:
+        result.connect_time = random.uniform(0.1, 1.5) / 1000
+        result.query_time = random.uniform(0.2, 4.0) / 1000
+    if render:
+        result.add_timing('render', random.uniform(0.3, 3.0) / 1000)
+    return result
+
+
+class LogEventGenerator:
+    """Поток строк лога: (время записи, строка, категория атаки или None, IP)"""
+
+    def __init__(self, rate=100.0, brute_force_every=300, sqli_every=400, scan_every=500,
+                 users=300, seed=None):
+        self.rate = rate
+        self.intervals = {'brute_force': brute_force_every, 'sql_injection': sqli_every, 'scan': scan_every}
+        self.random = random.Random(seed)
+        self.users = [(f"user{i}", f"10.{i // 250}.{i % 250}.{self.random.randint(2, 250)}", i + 1)
+                      for i in range(users)]
+        self.attacker_seq = 0
+        self.truth = []  # атаки: категория, IP, время первой строки
+
+    @staticmethod
+    def format_line(timestamp, level, ip, message):
+        moment = datetime.fromtimestamp(timestamp)
+        return f"{moment:%Y-%m-%d %H:%M:%S},{moment.microsecond // 1000:03d} - flask_app - {level} - [{ip}] - {message}"
+
+    def access(self, method, path, status, endpoint, sample=1, queries=0, rows=0, render=True,
+               query=None, user_agent=None):
+        """Запись журнала доступа; query - параметры строки запроса (dict)"""
+        return format_access_record(method, path, status, endpoint, metrics(endpoint, queries, rows, render),
+                                    sample, query=urlencode(query) if query else '', user_agent=user_agent)
+
+    def next_attacker_ip(self):
+        # Уникальный адрес из 100.64.0.0/10, не пересекается с пользователями (10.x.x.x)
+        self.attacker_seq += 1
+        seq = self.attacker_seq
+        return f"100.{64 + seq // 65536 % 64}.{seq // 256 % 256}.{seq % 256}"
+
+    # ===== Обычный трафик =====
+
+    def normal_request(self):
+        """Строки одного обычного запроса: список (уровень, IP, сообщение)"""
+        rnd = self.random
+        username, ip, user_id = rnd.choice(self.users)
+        action = rnd.random()
+        if action < 0.55:
+            return [('INFO', ip, self.access('GET', '/', 200, 'index', queries=2, rows=rnd.randint(5, 60)))]
+        if action < 0.65:
+            return [('INFO', ip, self.access('GET', '/login', 200, 'login_route'))]
+        if action < 0.72:
+            return [
+                ('INFO', ip, f"Successful login for user: {username}"),
+                ('INFO', ip, f"User {username} successfully authenticated"),
+                ('INFO', ip, self.access('POST', '/login', 302, 'login_route', queries=1, rows=1, render=False)),
+            ]
+        if action < 0.82:
+            title = rnd.choice(NOTE_TITLES)
+            return [
+                ('INFO', ip, f"Заметка добавлена пользователем {user_id}: {title}"),
+                ('INFO', ip, self.access('POST', '/add', 302, 'add_note', queries=1, rows=1, render=False)),
+            ]
+        if action < 0.9:
+            note_id = rnd.randint(1, 5000)
+            return [('INFO', ip, self.access('GET', f'/edit/{note_id}', 200, 'edit_note', queries=1, rows=1))]
+        if action < 0.95:
+            note_id = rnd.randint(1, 5000)
+            return [
+                ('INFO', ip, f"Заметка {note_id} удалена пользователем {user_id}"),
+                ('INFO', ip, self.access('GET', f'/delete/{note_id}', 302, 'delete_note', queries=1, render=False)),
+            ]
+        if action < 0.98:
+            # Устаревшая ссылка
+            return [('INFO', ip, self.access('GET', f'/notes/{rnd.randint(1, 500)}', 404, None,
+                                             render=False, user_agent=rnd.choice(USER_AGENTS)))]
+        # Опечатка в пароле
+        return [
+            ('WARNING', ip, f"Failed login attempt for user: {username}"),
+            ('WARNING', ip, f"Failed authentication for user: {username}"),
+            ('INFO', ip, self.access('POST', '/login', 200, 'login_route', queries=1,
+                                     user_agent=rnd.choice(USER_AGENTS))),
+        ]
+
+    # ===== Атаки: список (смещение в секундах, уровень, сообщение) =====
+
+    def brute_force_burst(self):
+        rnd = self.random
+        target = rnd.choice(['admin', 'root', 'testuser', rnd.choice(self.users)[0]])
+        agent = rnd.choice(ATTACK_USER_AGENTS)
+        events, offset = [], 0.0
+        for _ in range(rnd.randint(8, 20)):
+            offset += rnd.uniform(0.5, 4.0)
+            events += [
+                (offset, 'WARNING', f"Failed login attempt for user: {target}"),
+                (offset, 'WARNING', f"Failed authentication for user: {target}"),
+                (offset, 'INFO', self.access('POST', '/login', 200, 'login_route', queries=1, user_agent=agent)),
+            ]
+        return events
+
+    def sql_injection_burst(self):
+        rnd = self.random
+        agent = rnd.choice(ATTACK_USER_AGENTS)
+        events, offset = [], 0.0
+        for _ in range(rnd.randint(2, 6)):
+            offset += rnd.uniform(0.2, 3.0)
+            payload = rnd.choice(SQL_PAYLOADS)
+            if rnd.random() < 0.5:
+                events.append((offset, 'INFO', self.access('GET', '/', 302, 'index', render=False,
+                                                           query={'q': payload}, user_agent=agent)))
+            else:
+                events += [
+                    (offset, 'WARNING', f"Failed login attempt for user: {payload}"),
+                    (offset, 'WARNING', f"Failed authentication for user: {payload}"),
+                    (offset, 'INFO', self.access('POST', '/login', 200, 'login_route', queries=1, user_agent=agent)),
+                ]
+        return events
+
+    def scan_burst(self):
+        rnd = self.random
+        agent = rnd.choice(ATTACK_USER_AGENTS)
+        paths = list(HONEYPOTS) + rnd.sample(SCAN_PATHS, rnd.randint(18, len(SCAN_PATHS)))
+        rnd.shuffle(paths)
+        events, offset = [], 0.0
+        for path in paths:
+            offset += rnd.uniform(0.05, 1.0)
+            if path in HONEYPOTS:
+                endpoint, target = HONEYPOTS[path]
+                events += [
+                    (offset, 'WARNING', f"Access attempt to {target} from {{ip}}"),
+                    (offset, 'INFO', self.access('GET', path, 403, endpoint, render=False, user_agent=agent)),
+                ]
+            else:
+                events.append((offset, 'INFO', self.access('GET', path, 404, None, render=False, user_agent=agent)))
+        return events
+
+    def generate(self, duration, start=None):
+        """Строки за duration секунд потока, начиная со start (unix time)"""
+        start = time.time() if start is None else start
+        end = start + duration
+        rnd = self.random
+        bursts = {'brute_force': self.brute_force_burst, 'sql_injection': self.sql_injection_burst,
+                  'scan': self.scan_burst}
+        # Время начала следующей атаки каждого типа
+        next_attack = {category: start + rnd.uniform(0.2, 1.0) * every
+                       for category, every in self.intervals.items() if every}
+        pending = []  # (время, уровень, IP, сообщение, категория)
+
+        now = start
+        while now < end:
+            now += rnd.expovariate(self.rate)
+            for category, at in list(next_attack.items()):
+                if at <= now:
+                    ip = self.next_attacker_ip()
+                    events = bursts[category]()
+                    self.truth.append({'category': category, 'ip': ip, 'start': at + events[0][0]})
+                    pending += [(at + offset, level, ip, message.replace('{ip}', ip), category)
+                                for offset, level, message in events]
+                    pending.sort(key=lambda event: event[0])
+                    next_attack[category] = at + rnd.uniform(0.5, 1.5) * self.intervals[category]
+
+            while pending and pending[0][0] <= now:
+                at, level, ip, message, category = pending.pop(0)
+                yield at, self.format_line(at, level, ip, message), category, ip
+            for level, ip, message in self.normal_request():
+                yield now, self.format_line(now, level, ip, message), None, ip
+
+        # Атаки, начатые до конца потока, дописываются целиком
+        for at, level, ip, message, category in pending:
+            yield at, self.format_line(at, level, ip, message), category, ip
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Генератор событий безопасности в формате логов приложения')
+    parser.add_argument('--output', default='logs/flask_app.log')
+    parser.add_argument('--truth', help='JSON файл с перечнем внедренных атак')
+    parser.add_argument('--rate', type=float, default=20, help='обычных запросов в секунду')
+    parser.add_argument('--duration', type=float, default=60, help='длительность потока, секунд')
+    parser.add_argument('--brute-force-every', type=float, default=30, help='средний интервал атак перебора, с')
+    parser.add_argument('--sqli-every', type=float, default=40, help='средний интервал SQL-инъекций, с')
+    parser.add_argument('--scan-every', type=float, default=50, help='средний интервал сканирований, с')
+    parser.add_argument('--batch', action='store_true', help='записать весь поток сразу, с временем в прошлом')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    generator = LogEventGenerator(args.rate, args.brute_force_every, args.sqli_every, args.scan_every,
+                                  seed=args.seed)
+    start = time.time() - args.duration if args.batch else time.time()
+    lines = 0
+    print(f"[GEN] Запись событий в {args.output} ({'пакетно' if args.batch else 'в реальном времени'})")
+    with open(args.output, 'a', encoding='utf-8') as f:
+        for at, line, category, ip in generator.generate(args.duration, start):
+            if not args.batch:
+                delay = at - time.time()
+                if delay > 0:
+                    f.flush()
+                    time.sleep(delay)
+            f.write(line + '\n')
+            lines += 1
+
+    print(f"[GEN] Записано строк: {lines}, атак: {len(generator.truth)}")
+    for category in ATTACK_ALERTS:
+        print(f"      {category}: {sum(1 for attack in generator.truth if attack['category'] == category)}")
+    if args.truth:
+        with open(args.truth, 'w', encoding='utf-8') as f:
+            json.dump(generator.truth, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
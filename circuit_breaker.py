@@ -0,0 +1,105 @@
+"""
+Автоматический выключатель (circuit breaker) для основного сервера БД.
+
+Пока PostgreSQL недоступен или не успевает отвечать, каждая попытка
+подключения занимает поток сервера на время таймаута. Выключатель считает
+ошибки подключения и выполнения запросов подряд и после порога размыкает цепь:
+следующие обращения сразу получают CircuitOpenError без обращения к БД.
+
+Состояния:
+- closed: обычная работа, считаются ошибки подряд;
+- open: обращения отклоняются до истечения паузы;
+- half-open: пауза истекла, пропускается одно пробное обращение. Успех
+  замыкает цепь, ошибка снова размыкает ее с удвоенной паузой (не больше
+  max_reset_timeout).
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger('flask_app')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(Exception):
+    """Цепь разомкнута: обращение к БД отклонено без попытки подключения"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name}: цепь разомкнута, повтор через {retry_after:.1f} с")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Счетчик ошибок подряд с паузой, растущей экспоненциально"""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=1.0, max_reset_timeout=60.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.current_timeout = reset_timeout
+        self.opened_until = 0.0
+        self.probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Можно ли обращаться к БД; в half-open пропускает одно пробное обращение"""
+        if self.state == CLOSED:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now < self.opened_until:
+                    return False
+                self.state = HALF_OPEN
+                logger.info(f"{self.name}: пробное обращение после паузы {self.current_timeout:.1f} с")
+            elif self.state == HALF_OPEN and now - self.probe_started < self.current_timeout:
+                # Пробное обращение уже выполняется (или завершилось без результата
+                # меньше паузы назад - тогда пропускается следующее)
+                return False
+            self.probe_started = now
+            return True
+
+    def retry_after(self):
+        """Через сколько секунд обращения снова будут пропускаться (0 - пропускаются сейчас)"""
+        if self.state == OPEN:
+            return max(self.opened_until - time.monotonic(), 0.0)
+        if self.state == HALF_OPEN:
+            return max(self.probe_started + self.current_timeout - time.monotonic(), 0.0)
+        return 0.0
+
+    def record_success(self):
+        if self.state == CLOSED and not self.failures:
+            return
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"{self.name}: цепь замкнута, БД снова доступна")
+            self.state = CLOSED
+            self.failures = 0
+            self.current_timeout = self.reset_timeout
+
+    def record_failure(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.state == HALF_OPEN:
+                # Пробное обращение не удалось: пауза удваивается
+                self.current_timeout = min(self.current_timeout * 2, self.max_reset_timeout)
+                self._open(now, 'пробное обращение не удалось')
+                return
+            if self.state == OPEN:
+                return
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.current_timeout = self.reset_timeout
+                self._open(now, f"ошибок подряд: {self.failures}")
+
+    def _open(self, now, reason):
+        self.state = OPEN
+        self.opened_until = now + self.current_timeout
+        logger.warning(f"{self.name}: цепь разомкнута ({reason}), пауза {self.current_timeout:.1f} с")
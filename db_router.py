@@ -0,0 +1,299 @@
+"""
+Маршрутизация подключений PostgreSQL между основным сервером и репликами.
+
+Запросы на запись всегда идут на primary. Чтение распределяется по репликам
+(round-robin); недоступные или отстающие реплики исключаются из ротации и
+периодически проверяются фоновым потоком. Свободные подключения каждого
+сервера хранятся в пуле процесса (DB_POOL_SIZE) и переиспользуются.
+
+Обращения к primary проходят через автоматический выключатель
+(circuit_breaker.py): подключение ограничено DB_CONNECT_TIMEOUT, запрос -
+DB_STATEMENT_TIMEOUT_MS, а после DB_BREAKER_FAILURES ошибок подряд обращения
+к primary отклоняются сразу, без ожидания таймаутов.
+"""
+
+import itertools
+import logging
+import os
+import threading
+import time
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, parse_dsn
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from prepared_statements import TrackedConnection
+
+logger = logging.getLogger('flask_app')
+
+
+def read_your_writes_window(configured, max_replica_lag, health_check_interval, has_replicas=True):
+    """
+    Сколько секунд после записи пользователь читает с primary.
+
+    Реплика остается в ротации, пока ее отставание не больше max_replica_lag,
+    а проверяется она раз в health_check_interval: окно короче их суммы
+    вернуло бы пользователя на реплику, еще не получившую его запись.
+    """
+    tolerated = max_replica_lag + health_check_interval
+    if has_replicas and health_check_interval <= 0:
+        logger.warning("Проверка отставания реплик отключена: чтение после записи может не видеть запись")
+    if configured is None:
+        return tolerated
+    window = float(configured)
+    if has_replicas and window < tolerated:
+        logger.warning(f"DB_READ_YOUR_WRITES_WINDOW={window:g} меньше допустимого отставания реплик "
+                       f"({max_replica_lag:g} + {health_check_interval:g} с), используется {tolerated:g}")
+        return tolerated
+    return window
+
+
+def build_node_config(base_config, dsn):
+    """Параметры подключения к реплике: DSN поверх базовой конфигурации"""
+    config = dict(base_config)
+    if 'database' in config:
+        config['dbname'] = config.pop('database')
+    config.update(parse_dsn(dsn))
+    return config
+
+
+class DatabaseNode:
+    """Один сервер БД, его состояние здоровья и пул свободных подключений"""
+
+    def __init__(self, name, config, pool_size=0):
+        self.name = name
+        self.config = config
+        self.healthy = True
+        self.failures = 0
+        self.ejected_until = 0.0
+        # Сколько свободных подключений хранить в процессе (0 - закрывать после запроса)
+        self.pool_size = pool_size
+        self._idle = []
+        self._pool_pid = os.getpid()
+        self._pool_lock = threading.Lock()
+        self._inherited = []
+
+    def connect(self, connect_timeout=None):
+        config = dict(self.config)
+        if connect_timeout is not None:
+            config.setdefault('connect_timeout', connect_timeout)
+        conn = psycopg2.connect(connection_factory=TrackedConnection, **config)
+        conn.node = self
+        return conn
+
+    def acquire(self, connect_timeout=None):
+        """Свободное подключение из пула или новое"""
+        with self._pool_lock:
+            if self._pool_pid != os.getpid():
+                # Подключения родителя после fork не используются и не закрываются:
+                # закрытие отправило бы Terminate в сокет, общий с родителем
+                self._inherited.extend(self._idle)
+                self._idle = []
+                self._pool_pid = os.getpid()
+            while self._idle:
+                conn = self._idle.pop()
+                if not conn.closed:
+                    return conn
+        return self.connect(connect_timeout)
+
+    def release(self, conn):
+        """Возврат подключения в пул (незавершенная транзакция откатывается)"""
+        if not conn.closed and conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                conn.close()
+        with self._pool_lock:
+            if not conn.closed and self._pool_pid == os.getpid() and len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def discard_idle(self):
+        """Закрытие свободных подключений (сервер был недоступен, они могли оборваться)"""
+        with self._pool_lock:
+            if self._pool_pid != os.getpid():
+                return
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def available(self, now):
+        return self.healthy or now >= self.ejected_until
+
+    def mark_failed(self, eject_seconds):
+        self.failures += 1
+        self.healthy = False
+        # Экспоненциальное увеличение времени исключения, но не более 10 интервалов
+        backoff = eject_seconds * min(2 ** (self.failures - 1), 10)
+        self.ejected_until = time.time() + backoff
+
+    def mark_healthy(self):
+        if not self.healthy:
+            logger.info(f"Реплика {self.name} возвращена в ротацию")
+        self.healthy = True
+        self.failures = 0
+        self.ejected_until = 0.0
+
+
+class DatabaseRouter:
+    """Выбор сервера БД для чтения и записи"""
+
+    lag_query = '''
+        SELECT CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END
+    '''
+
+    def __init__(self, primary_config, replica_dsns=(), eject_seconds=10,
+                 health_check_interval=5, max_replica_lag=10, connect_timeout=3, pool_size=0,
+                 statement_timeout=0, breaker=None):
+        primary_config = dict(primary_config)
+        if statement_timeout:
+            # Ограничение времени запроса задается при подключении и действует
+            # на всех серверах (DSN реплики может его переопределить)
+            primary_config.setdefault('options', f"-c statement_timeout={int(statement_timeout)}")
+        self.primary = DatabaseNode('primary', primary_config, pool_size)
+        self.replicas = [
+            DatabaseNode(f"replica-{index}", build_node_config(primary_config, dsn), pool_size)
+            for index, dsn in enumerate(replica_dsns, start=1)
+        ]
+        self.eject_seconds = eject_seconds
+        self.health_check_interval = health_check_interval
+        self.max_replica_lag = max_replica_lag
+        self.connect_timeout = connect_timeout
+        self.breaker = breaker if breaker is not None else CircuitBreaker('PostgreSQL primary')
+        self._round_robin = itertools.cycle(range(len(self.replicas))) if self.replicas else None
+        self._lock = threading.Lock()
+        self._health_pid = None
+
+    @classmethod
+    def from_env(cls, primary_config):
+        """Создание маршрутизатора по переменным окружения"""
+        replica_dsns = [dsn.strip() for dsn in os.getenv('DB_REPLICA_DSNS', '').split(';') if dsn.strip()]
+        return cls(
+            primary_config,
+            replica_dsns,
+            eject_seconds=float(os.getenv('DB_REPLICA_EJECT_SECONDS', '10')),
+            health_check_interval=float(os.getenv('DB_REPLICA_HEALTH_INTERVAL', '5')),
+            max_replica_lag=float(os.getenv('DB_REPLICA_MAX_LAG', '10')),
+            connect_timeout=int(os.getenv('DB_CONNECT_TIMEOUT', '3')),
+            # Долгоживущие подключения нужны для подготовленных выражений (prepared_statements.py)
+            pool_size=int(os.getenv('DB_POOL_SIZE', os.getenv('SERVER_THREADS', '4'))),
+            statement_timeout=int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '5000')),
+            breaker=CircuitBreaker(
+                'PostgreSQL primary',
+                failure_threshold=int(os.getenv('DB_BREAKER_FAILURES', '5')),
+                reset_timeout=float(os.getenv('DB_BREAKER_RESET_SECONDS', '1')),
+                max_reset_timeout=float(os.getenv('DB_BREAKER_MAX_RESET_SECONDS', '60'))
+            )
+        )
+
+    def _next_replicas(self):
+        """Реплики в порядке опроса, начиная со следующей по round-robin"""
+        with self._lock:
+            start = next(self._round_robin)
+        count = len(self.replicas)
+        return [self.replicas[(start + offset) % count] for offset in range(count)]
+
+    def connect(self, readonly=False):
+        """Подключение для записи (primary) или чтения (реплика, если доступна)"""
+        if readonly and self.replicas:
+            self._ensure_health_thread()
+            now = time.time()
+            for node in self._next_replicas():
+                if not node.available(now):
+                    continue
+                try:
+                    conn = node.acquire(self.connect_timeout)
+                    node.mark_healthy()
+                    return conn
+                except psycopg2.Error as e:
+                    node.mark_failed(self.eject_seconds)
+                    logger.warning(f"Реплика {node.name} исключена из ротации: {e}")
+
+        return self.connect_primary()
+
+    def connect_primary(self):
+        """Подключение к primary через выключатель (CircuitOpenError, пока цепь разомкнута)"""
+        if not self.breaker.allow():
+            raise CircuitOpenError(self.breaker.name, self.breaker.retry_after())
+        try:
+            return self.primary.acquire(self.connect_timeout)
+        except psycopg2.OperationalError:
+            self._primary_failed()
+            raise
+
+    def record_success(self, conn):
+        """Запрос на подключении выполнен: primary отвечает"""
+        if getattr(conn, 'node', None) is self.primary:
+            self.breaker.record_success()
+
+    def record_failure(self, conn):
+        """Ошибка подключения или таймаут запроса на primary"""
+        if getattr(conn, 'node', None) is self.primary:
+            self._primary_failed()
+
+    def _primary_failed(self):
+        self.breaker.record_failure()
+        if self.breaker.retry_after():
+            # Пробное обращение после паузы должно идти по новому подключению
+            self.primary.discard_idle()
+
+    def release(self, conn):
+        """Возврат подключения в пул узла, которому оно принадлежит"""
+        node = getattr(conn, 'node', None)
+        if node is None:
+            conn.close()
+        else:
+            node.release(conn)
+
+    def _ensure_health_thread(self):
+        """Фоновая проверка реплик (один поток на процесс)"""
+        if self._health_pid == os.getpid() or self.health_check_interval <= 0:
+            return
+        with self._lock:
+            if self._health_pid == os.getpid():
+                return
+            self._health_pid = os.getpid()
+            thread = threading.Thread(target=self._health_loop, name='db-replica-health', daemon=True)
+            thread.start()
+
+    def _health_loop(self):
+        while True:
+            for node in self.replicas:
+                self.check_replica(node)
+            time.sleep(self.health_check_interval)
+
+    def check_replica(self, node):
+        """Проверка доступности и отставания реплики"""
+        try:
+            conn = node.connect(self.connect_timeout)
+        except psycopg2.Error as e:
+            if node.healthy:
+                logger.warning(f"Реплика {node.name} недоступна: {e}")
+            node.mark_failed(self.eject_seconds)
+            return False
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.lag_query)
+            lag = float(cursor.fetchone()[0] or 0)
+            cursor.close()
+        except psycopg2.Error as e:
+            logger.warning(f"Ошибка проверки реплики {node.name}: {e}")
+            node.mark_failed(self.eject_seconds)
+            return False
+        finally:
+            conn.close()
+
+        if lag > self.max_replica_lag:
+            if node.healthy:
+                logger.warning(f"Реплика {node.name} отстает на {lag:.1f} с, исключена из ротации")
+            node.mark_failed(self.eject_seconds)
+            return False
+
+        node.mark_healthy()
+        return True
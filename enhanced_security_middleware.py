@@ -44,4 +44,51 @@ class EnhancedSecurityHeaders:
 
             return start_response(status, final_headers, exc_info)
 
-        return self.app(environ, custom_start_response)
\ No newline at end of file
+        return self.app(environ, custom_start_response)
+
+class IPBlocklistMiddleware:
+    """Отклоняет запросы IP из общего списка блокировок (ip_blocklist.py) до обработки приложением"""
+
+    body = "Доступ запрещен!".encode('utf-8')
+
+    def __init__(self, app, blocklist):
+        self.app = app
+        self.blocklist = blocklist
+        self.rejected = 0
+
+    def __call__(self, environ, start_response):
+        if self.blocklist.is_blocked(environ.get('REMOTE_ADDR', '')):
+            self.rejected += 1
+            start_response('403 Forbidden', [
+                ('Content-Type', 'text/plain; charset=utf-8'),
+                ('Content-Length', str(len(self.body))),
+            ])
+            return [self.body]
+        return self.app(environ, start_response)
+
+
+class IPBlocklistASGIMiddleware:
+    """То же для async режима (ASGI)"""
+
+    body = IPBlocklistMiddleware.body
+
+    def __init__(self, app, blocklist):
+        self.app = app
+        self.blocklist = blocklist
+        self.rejected = 0
+
+    async def __call__(self, scope, receive, send):
+        client = scope.get('client')
+        if scope['type'] == 'http' and client and self.blocklist.is_blocked(client[0]):
+            self.rejected += 1
+            await send({
+                'type': 'http.response.start',
+                'status': 403,
+                'headers': [
+                    (b'content-type', b'text/plain; charset=utf-8'),
+                    (b'content-length', str(len(self.body)).encode()),
+                ],
+            })
+            await send({'type': 'http.response.body', 'body': self.body})
+            return
+        await self.app(scope, receive, send)
@@ -0,0 +1,252 @@
+"""
+Общий список заблокированных IP в файле, отображаемом в память (mmap).
+
+SIEM (siem_monitor.py) блокирует IP с сигнатурами атак на заданное время,
+приложение отклоняет их запросы до обработки во Flask (см.
+enhanced_security_middleware.py). Автоблокировка выключена по умолчанию
+(SIEM_AUTO_BLOCK=1 включает ее); адреса обратного прокси и балансировщика
+перед приложением должны быть в SIEM_BLOCK_ALLOWLIST.
+
+Формат файла: заголовок и хэш-таблица с открытой адресацией (линейное
+пробирование), ключ - IPv6 адрес (IPv4 хранится как ::ffff:a.b.c.d),
+значение - время окончания блокировки. Проверка IP - O(1) чтение из общей
+памяти без блокировок и системных вызовов.
+
+Запись атомарная: таблица целиком пишется во временный файл и заменяет
+старый через os.replace, после чего в заголовке старого файла ставится
+флаг "устарел". Читатели во всех процессах видят флаг в своем отображении
+и переоткрывают файл при следующей проверке.
+
+Публикация переписывает всю таблицу, поэтому выполняется не чаще
+publish_interval: блокировки за интервал публикуются одним файлом. Повторная
+блокировка IP, у которого остается больше половины TTL, файл не меняет.
+"""
+
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+import zlib
+
+MAGIC = b'IPBL'
+VERSION = 1
+# magic, версия, флаг "устарел", емкость таблицы, число записей, время публикации
+HEADER = struct.Struct('<4sHBxIId')
+HEADER_SIZE = 32
+STALE_OFFSET = 6
+# адрес, время окончания блокировки (unix time, 0 - пустая ячейка)
+SLOT = struct.Struct('<16sI4x')
+
+
+def pack_ip(ip):
+    """Адрес в 16 байт; None для некорректной строки"""
+    try:
+        if ':' in ip:
+            return socket.inet_pton(socket.AF_INET6, ip)
+        return b'\x00' * 10 + b'\xff\xff' + socket.inet_aton(ip)
+    except (OSError, TypeError):
+        return None
+
+
+def _slot_index(key, capacity):
+    # Фибоначчиево хэширование поверх crc32: близкие адреса не образуют кластеров
+    return ((zlib.crc32(key) * 0x9E3779B1) & 0xFFFFFFFF) >> (33 - capacity.bit_length())
+
+
+def _capacity_for(count):
+    capacity = 1024
+    while capacity < count * 2:
+        capacity *= 2
+    return capacity
+
+
+class IPBlocklistWriter:
+    """Владелец списка (SIEM): блокировки с TTL и атомарная публикация файла"""
+
+    def __init__(self, path, publish_interval=1.0):
+        self.path = path
+        self.publish_interval = publish_interval
+        self.entries = {}  # IP -> время окончания блокировки
+        self._lock = threading.Lock()
+        self._dirty = False  # есть изменения, еще не попавшие в файл
+        self._published_at = 0.0
+        self._timer = None
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._load()
+
+    def _load(self):
+        # Блокировки переживают перезапуск SIEM; пустой файл создается сразу,
+        # чтобы читатели получили отображение до первой блокировки
+        reader = IPBlocklist(self.path)
+        self.entries = dict(reader.items())
+        reader.close()
+        self._publish()
+
+    def block(self, ip, ttl):
+        """Блокировка на ttl секунд; False, если IP уже заблокирован надолго"""
+        with self._lock:
+            now = time.time()
+            current = self.entries.get(ip, 0)
+            if current - now > ttl / 2:
+                return False
+            self.entries[ip] = max(current, int(now + ttl))
+            self._schedule()
+            return True
+
+    def unblock(self, ip):
+        with self._lock:
+            if self.entries.pop(ip, None) is not None:
+                self._schedule()
+
+    def flush(self):
+        """Публикация изменений, отложенных из-за publish_interval"""
+        with self._lock:
+            self._timer = None
+            if self._dirty:
+                self._publish()
+
+    def purge_expired(self):
+        with self._lock:
+            now = time.time()
+            expired = [ip for ip, expires_at in self.entries.items() if expires_at <= now]
+            for ip in expired:
+                del self.entries[ip]
+            if expired:
+                self._schedule()
+            return len(expired)
+
+    def _schedule(self):
+        # Вызывается под self._lock: публикация сразу или по таймеру в конце интервала
+        self._dirty = True
+        delay = self._published_at + self.publish_interval - time.monotonic()
+        if delay <= 0:
+            self._publish()
+        elif self._timer is None:
+            self._timer = threading.Timer(delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _publish(self):
+        self._dirty = False
+        self._published_at = time.monotonic()
+        now = time.time()
+        entries = [(pack_ip(ip), expires_at) for ip, expires_at in self.entries.items() if expires_at > now]
+        entries = [(key, expires_at) for key, expires_at in entries if key is not None]
+        capacity = _capacity_for(len(entries))
+
+        table = bytearray(HEADER_SIZE + capacity * SLOT.size)
+        HEADER.pack_into(table, 0, MAGIC, VERSION, 0, capacity, len(entries), now)
+        mask = capacity - 1
+        for key, expires_at in entries:
+            index = _slot_index(key, capacity)
+            while SLOT.unpack_from(table, HEADER_SIZE + index * SLOT.size)[1]:
+                index = (index + 1) & mask
+            SLOT.pack_into(table, HEADER_SIZE + index * SLOT.size, key, expires_at)
+
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(table)
+            f.flush()
+            os.fsync(f.fileno())
+
+        old = None
+        try:
+            old = open(self.path, 'r+b')
+        except FileNotFoundError:
+            pass
+        os.replace(tmp_path, self.path)
+        if old is not None:
+            # Читатели старого файла увидят флаг и откроют новый
+            with old:
+                old.seek(STALE_OFFSET)
+                old.write(b'\x01')
+
+
+class IPBlocklist:
+    """Читатель списка: проверка IP без блокировок"""
+
+    # Как часто проверять появление файла, если его еще нет (секунды)
+    retry_interval = 0.1
+
+    def __init__(self, path):
+        self.path = path
+        self._table = None  # (mmap, емкость) - заменяются вместе одним присваиванием
+        self._next_retry = 0.0
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        with self._lock:
+            try:
+                with open(self.path, 'rb') as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (FileNotFoundError, ValueError):
+                # Файла еще нет (или он пустой): блокировок нет
+                self._table = None
+                self._next_retry = time.monotonic() + self.retry_interval
+                return
+            magic, version, _, capacity, _, _ = HEADER.unpack_from(mm, 0)
+            if magic != MAGIC or version != VERSION or len(mm) < HEADER_SIZE + capacity * SLOT.size:
+                mm.close()
+                self._table = None
+                self._next_retry = time.monotonic() + self.retry_interval
+                return
+            # Старое отображение закрывается сборщиком мусора, когда его перестанут читать
+            self._table = (mm, capacity)
+
+    def _current(self):
+        table = self._table
+        if table is None:
+            if time.monotonic() < self._next_retry:
+                return None
+            self._open()
+            return self._table
+        if table[0][STALE_OFFSET]:
+            self._open()
+            return self._table
+        return table
+
+    def is_blocked(self, ip, now=None):
+        table = self._current()
+        if table is None:
+            return False
+        key = pack_ip(ip)
+        if key is None:
+            return False
+        mm, capacity = table
+        mask = capacity - 1
+        index = _slot_index(key, capacity)
+        while True:
+            offset = HEADER_SIZE + index * SLOT.size
+            slot_key, expires_at = SLOT.unpack_from(mm, offset)
+            if not expires_at:
+                return False
+            if slot_key == key:
+                return expires_at > (time.time() if now is None else now)
+            index = (index + 1) & mask
+
+    def items(self):
+        """Действующие блокировки: (IP, время окончания)"""
+        table = self._current()
+        if table is None:
+            return []
+        mm, capacity = table
+        now = time.time()
+        result = []
+        for index in range(capacity):
+            key, expires_at = SLOT.unpack_from(mm, HEADER_SIZE + index * SLOT.size)
+            if expires_at > now:
+                if key[:12] == b'\x00' * 10 + b'\xff\xff':
+                    result.append((socket.inet_ntoa(key[12:]), expires_at))
+                else:
+                    result.append((socket.inet_ntop(socket.AF_INET6, key), expires_at))
+        return result
+
+    def close(self):
+        if self._table is not None:
+            self._table[0].close()
+            self._table = None
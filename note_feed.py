@@ -0,0 +1,335 @@
+"""
+Инкрементальное обновление ленты заметок.
+
+Триггеры на таблице notes записывают каждое добавление, изменение и
+удаление в журнал note_changes (seq - номер изменения, удаления остаются в
+журнале как tombstone). Клиент хранит курсор - номер последнего
+примененного изменения - и запрашивает у /notes/delta только заметки,
+измененные после него.
+
+О новых изменениях клиент узнает из потока server-sent events
+(/notes/stream). Поток передает только номер последнего изменения, данные
+клиент получает через delta. Источник номеров - один фоновый поток (или
+задача asyncio) на процесс:
+
+- PostgreSQL: LISTEN notes_changed, триггер вызывает pg_notify;
+- SQLite: опрос максимального seq раз в poll_interval секунд.
+
+В PostgreSQL номера выдаются при записи, а видимыми становятся при фиксации,
+поэтому транзакция с меньшим номером может зафиксироваться позже клиентского
+курсора. Глобальной блокировки порядка фиксации нет (она выстроила бы в
+очередь все записи заметок): delta перечитывает окно из FEED_DELTA_OVERLAP
+номеров перед курсором (применение изменения повторно ничего не меняет), а
+уведомление о таком изменении будит потоки, даже если его номер не больше
+последнего известного.
+"""
+
+import asyncio
+import logging
+import os
+import select
+import threading
+import time
+
+logger = logging.getLogger('flask_app')
+
+
+def sse_event(cursor):
+    """Событие потока: номер последнего изменения ленты"""
+    return f"id: {cursor}\nevent: notes\ndata: {cursor}\n\n"
+
+
+def delta_range(since, limit, overlap):
+    """Параметры SELECT_FEED_DELTA для курсора since: (номер, после которого читать, LIMIT)"""
+    return max(since - overlap, 0), limit + overlap + 1
+
+
+def build_delta(since, bounds, rows, limit):
+    """
+    Изменения ленты после курсора since.
+
+    bounds - (минимальный, максимальный) номер в журнале, rows - строки
+    SELECT_FEED_DELTA с параметрами delta_range (limit здесь включает окно). Возвращает (заметки, id удаленных,
+    новый курсор, reset); reset - клиенту нужно перезагрузить ленту целиком:
+    нужная часть журнала уже удалена, журнал пересоздан или изменений слишком много.
+    """
+    oldest, newest = bounds
+    if since > newest or (oldest and since < oldest - 1) or len(rows) > limit:
+        return [], [], newest, True
+    notes, deleted = [], []
+    cursor = since
+    for row in rows:
+        if row[1] is None:
+            deleted.append(row[0])
+        else:
+            notes.append(row)
+        cursor = max(cursor, row[-1])
+    return notes, deleted, cursor, False
+
+
+class StreamSlot:
+    """
+    Место открытого потока событий. release() можно вызывать повторно: место
+    освобождают и генератор потока, и закрытие ответа - генератор, который
+    так и не начал выполняться (клиент отключился раньше), finally не выполняет.
+    """
+
+    def __init__(self, feed):
+        self.feed = feed
+        self.released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self.released:
+                return
+            self.released = True
+        self.feed.close_stream()
+
+
+class ChangeFeedBase:
+    """Последний известный номер изменения и учет открытых потоков"""
+
+    def __init__(self, max_streams=0):
+        self.latest = 0
+        self.ready = False  # номер получен из БД хотя бы один раз
+        self.version = 0  # растет при каждом изменении, в том числе зафиксированном не по порядку номеров
+        self.max_streams = max_streams
+        self.streams = 0
+        self._streams_lock = threading.Lock()
+
+    def open_stream(self):
+        """Занять место для потока (StreamSlot); None - лимит потоков исчерпан"""
+        with self._streams_lock:
+            if self.max_streams and self.streams >= self.max_streams:
+                return None
+            self.streams += 1
+        return StreamSlot(self)
+
+    def close_stream(self):
+        with self._streams_lock:
+            self.streams -= 1
+
+    def changed_since(self, cursor, version=None):
+        # Номер меньше курсора клиента тоже изменение: журнал пересоздан
+        return self.ready and (self.latest != cursor or (version is not None and version != self.version))
+
+    def _update(self, cursor, exact):
+        """Новый номер изменения; True - ожидающих нужно разбудить"""
+        if cursor is None:
+            return False
+        # Уведомления могут прийти не по порядку номеров - по ним номер только
+        # растет, но каждое уведомление - новое изменение; прочитанный из журнала
+        # номер может уменьшиться, если журнал пересоздан
+        if exact or not self.ready:
+            latest = cursor
+        else:
+            latest = max(cursor, self.latest)
+        if self.ready and latest == self.latest and exact:
+            return False
+        self.latest = latest
+        self.ready = True
+        self.version += 1
+        return True
+
+
+class NoteChangeFeed(ChangeFeedBase):
+    """Ожидание изменений для синхронного приложения (поток на процесс)"""
+
+    def __init__(self, poll, listen=None, channel='notes_changed', poll_interval=2.0,
+                 heartbeat_interval=30.0, purge=None, purge_interval=3600, max_streams=0):
+        super().__init__(max_streams)
+        self.poll = poll  # () -> номер последнего изменения или None при ошибке
+        self.listen = listen  # () -> подключение psycopg2 для LISTEN (None - опрос)
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.purge = purge
+        self.purge_interval = purge_interval
+        self._condition = threading.Condition()
+        self._pid = None
+        self._next_purge = 0.0
+
+    def _ensure_started(self):
+        # Поток создается в каждом процессе после fork при первом обращении
+        if self._pid == os.getpid():
+            return
+        with self._condition:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            thread = threading.Thread(target=self._run, name='notes-change-feed', daemon=True)
+            thread.start()
+
+    def publish(self, cursor, exact=False):
+        """Новый номер изменения; exact - значение прочитано из журнала, а не из уведомления"""
+        with self._condition:
+            if self._update(cursor, exact):
+                self._condition.notify_all()
+
+    def wait(self, cursor, version, timeout):
+        """Ожидание изменения после курсора и версии; возвращает (номер, версия)"""
+        self._ensure_started()
+        with self._condition:
+            self._condition.wait_for(lambda: self.changed_since(cursor, version), timeout)
+            return self.latest, self.version
+
+    def _maybe_purge(self):
+        if self.purge is None or time.monotonic() < self._next_purge:
+            return
+        self._next_purge = time.monotonic() + self.purge_interval
+        self.purge()
+
+    def _run(self):
+        while True:
+            try:
+                if self.listen is not None:
+                    self._listen_loop()
+                else:
+                    self._poll_loop()
+            except Exception as e:
+                logger.error(f"Ошибка потока изменений ленты: {e}")
+            time.sleep(self.poll_interval)
+
+    def _poll_loop(self):
+        while True:
+            self._maybe_purge()
+            self.publish(self.poll(), exact=True)
+            time.sleep(self.poll_interval)
+
+    def _listen_loop(self):
+        conn = self.listen()
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {self.channel}")
+            # Изменения, сделанные до LISTEN (в том числе пока не было подключения)
+            self.publish(self.poll(), exact=True)
+            while True:
+                self._maybe_purge()
+                if select.select([conn], [], [], self.heartbeat_interval) == ([], [], []):
+                    # Проверка, что подключение живо
+                    with conn.cursor() as cursor:
+                        cursor.execute('SELECT 1')
+                conn.poll()
+                latest = None
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    latest = max(latest or 0, int(notify.payload))
+                self.publish(latest)
+        finally:
+            conn.close()
+
+
+class AsyncNoteChangeFeed(ChangeFeedBase):
+    """Ожидание изменений для async приложения (задача asyncio, LISTEN через asyncpg)"""
+
+    def __init__(self, connect, poll, channel='notes_changed', reconnect_interval=2.0,
+                 heartbeat_interval=30.0, purge=None, purge_interval=3600, max_streams=0):
+        super().__init__(max_streams)
+        self.connect = connect  # корутина -> подключение asyncpg для LISTEN
+        self.poll = poll  # корутина -> номер последнего изменения или None
+        self.channel = channel
+        self.reconnect_interval = reconnect_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.purge = purge
+        self.purge_interval = purge_interval
+        self._changed = asyncio.Event()
+        self._task = None
+        self._next_purge = 0.0
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def publish(self, cursor, exact=False):
+        if self._update(cursor, exact):
+            # Будим всех ожидающих и заводим событие для следующего изменения
+            self._changed.set()
+            self._changed = asyncio.Event()
+
+    async def wait(self, cursor, version, timeout):
+        deadline = time.monotonic() + timeout
+        while not self.changed_since(cursor, version):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        return self.latest, self.version
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.publish(int(payload))
+
+    async def _maybe_purge(self):
+        if self.purge is None or time.monotonic() < self._next_purge:
+            return
+        self._next_purge = time.monotonic() + self.purge_interval
+        await self.purge()
+
+    async def _run(self):
+        while True:
+            conn = None
+            try:
+                conn = await self.connect()
+                await conn.add_listener(self.channel, self._on_notify)
+                self.publish(await self.poll(), exact=True)
+                while True:
+                    await self._maybe_purge()
+                    await asyncio.sleep(self.heartbeat_interval)
+                    await conn.execute('SELECT 1')
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка потока изменений ленты: {e}")
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            await asyncio.sleep(self.reconnect_interval)
+
+
+def event_stream(feed, slot, cursor, keepalive=15.0, max_seconds=300.0):
+    """Тело ответа text/event-stream для синхронного приложения (slot - из open_stream)"""
+    deadline = time.monotonic() + max_seconds
+    # Событие - при номере, отличном от курсора клиента, и при каждом новом изменении
+    # (изменения до открытия потока клиент получает запросом delta при подключении)
+    version = feed.version
+    try:
+        yield 'retry: 3000\n\n'
+        while time.monotonic() < deadline:
+            latest, latest_version = feed.wait(cursor, version, min(keepalive, max(deadline - time.monotonic(), 0)))
+            if feed.changed_since(cursor, version):
+                cursor, version = latest, latest_version
+                yield sse_event(cursor)
+            else:
+                # Комментарий SSE: держит соединение и выявляет отключившихся клиентов
+                yield ': keepalive\n\n'
+    finally:
+        slot.release()
+
+
+async def async_event_stream(feed, slot, cursor, keepalive=15.0, max_seconds=300.0):
+    """Тело ответа text/event-stream для async приложения (slot - из open_stream)"""
+    deadline = time.monotonic() + max_seconds
+    version = feed.version
+    try:
+        yield 'retry: 3000\n\n'
+        while time.monotonic() < deadline:
+            latest, latest_version = await feed.wait(cursor, version,
+                                                     min(keepalive, max(deadline - time.monotonic(), 0)))
+            if feed.changed_since(cursor, version):
+                cursor, version = latest, latest_version
+                yield sse_event(cursor)
+            else:
+                yield ': keepalive\n\n'
+    finally:
+        slot.release()
@@ -0,0 +1,40 @@
+#!/usr/bin/env bash
+# Локальный стенд для проверки разделения чтения/записи:
+# primary на порту 5432 и реплика с потоковой репликацией на порту 5433.
+#
+# Использование:
+#   ./postgresql_portable/setup_replica.sh /tmp/pg_primary /tmp/pg_replica
+#   export DB_REPLICA_DSNS="host=localhost port=5433"
+#   python run_production.py
+set -euo pipefail
+
+PRIMARY_DIR=${1:-./pg_primary}
+REPLICA_DIR=${2:-./pg_replica}
+PRIMARY_PORT=${PRIMARY_PORT:-5432}
+REPLICA_PORT=${REPLICA_PORT:-5433}
+REPL_PASSWORD=${REPL_PASSWORD:-replicator_password}
+
+# 1. Primary
+initdb -D "$PRIMARY_DIR" -U postgres --auth=trust
+cat >> "$PRIMARY_DIR/postgresql.conf" <<EOF
+port = $PRIMARY_PORT
+wal_level = replica
+max_wal_senders = 5
+hot_standby = on
+EOF
+echo "host replication replicator 127.0.0.1/32 md5" >> "$PRIMARY_DIR/pg_hba.conf"
+pg_ctl -D "$PRIMARY_DIR" -l "$PRIMARY_DIR/server.log" start
+
+psql -p "$PRIMARY_PORT" -U postgres -c "CREATE ROLE replicator WITH REPLICATION LOGIN PASSWORD '$REPL_PASSWORD'"
+psql -p "$PRIMARY_PORT" -U postgres -c "CREATE ROLE app_user WITH LOGIN PASSWORD '${DB_PASSWORD:-secure_password_123}'"
+psql -p "$PRIMARY_PORT" -U postgres -c "CREATE DATABASE notes_app_db OWNER app_user"
+
+# 2. Реплика из базовой копии primary (-R создает standby.signal и primary_conninfo)
+PGPASSWORD="$REPL_PASSWORD" pg_basebackup -h 127.0.0.1 -p "$PRIMARY_PORT" -U replicator \
+    -D "$REPLICA_DIR" -Fp -Xs -P -R
+echo "port = $REPLICA_PORT" >> "$REPLICA_DIR/postgresql.conf"
+pg_ctl -D "$REPLICA_DIR" -l "$REPLICA_DIR/server.log" start
+
+# 3. Проверка: на реплике pg_is_in_recovery() = true
+psql -p "$REPLICA_PORT" -U postgres -c "SELECT pg_is_in_recovery()"
+echo "Готово: DB_REPLICA_DSNS=\"host=localhost port=$REPLICA_PORT\""
@@ -0,0 +1,281 @@
+"""
+Многопроцессный запуск waitress (pre-fork).
+
+Главный процесс открывает слушающий сокет и запускает N рабочих процессов,
+каждый со своим пулом потоков waitress. Все процессы принимают соединения
+с общего сокета (или, при SERVER_REUSE_PORT=1, каждый со своего сокета с
+SO_REUSEPORT и балансировкой на стороне ядра), поэтому CPU-нагрузка
+(хэширование паролей, шаблоны, middleware) распределяется по ядрам.
+
+Управление главным процессом:
+- SIGHUP: плавный перезапуск по одному процессу (новый процесс готов ->
+  старый дорабатывает текущие запросы и завершается); код приложения
+  импортируется в рабочем процессе, поэтому перезапуск подхватывает изменения;
+- SIGTERM / SIGINT: плавная остановка всех процессов.
+
+Рабочий процесс завершается сам после max_requests запросов (со случайным
+разбросом, чтобы процессы не перезапускались одновременно) и будет заменен
+новым; упавший процесс также перезапускается.
+"""
+
+import errno
+import logging
+import os
+import random
+import select
+import signal
+import socket
+import threading
+import time
+
+logger = logging.getLogger('prefork')
+
+
+class RequestCounter:
+    """WSGI обертка: вызывает on_limit после заданного числа запросов"""
+
+    def __init__(self, app, limit, on_limit):
+        self.app = app
+        self.limit = limit
+        self.on_limit = on_limit
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.count += 1
+            reached = self.limit and self.count == self.limit
+        if reached:
+            self.on_limit()
+        return self.app(environ, start_response)
+
+
+class Worker:
+    """Рабочий процесс: waitress на общем сокете до сигнала остановки"""
+
+    def __init__(self, app_factory, sock, threads, max_requests, graceful_timeout, ready_fd):
+        self.app_factory = app_factory
+        self.sock = sock
+        self.threads = threads
+        self.max_requests = max_requests
+        self.graceful_timeout = graceful_timeout
+        self.ready_fd = ready_fd
+        self.stopping = False
+
+    def stop(self, *_):
+        self.stopping = True
+
+    def run(self):
+        from waitress.server import create_server
+        from waitress import wasyncore
+
+        signal.signal(signal.SIGTERM, self.stop)
+        # Ctrl+C в терминале получает вся группа процессов; остановкой управляет главный процесс
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+        app = RequestCounter(self.app_factory(), self.max_requests, self.stop)
+        server = create_server(app, sockets=[self.sock], threads=self.threads, ident=None)
+        os.write(self.ready_fd, b'1')
+        os.close(self.ready_fd)
+
+        while not self.stopping:
+            wasyncore.loop(timeout=1.0, map=server._map, use_poll=server.adj.asyncore_use_poll, count=1)
+
+        # Перестаем принимать соединения, дожидаемся ответов на начатые запросы
+        server.accepting = False
+        server.del_channel()
+        self.sock.close()
+        deadline = time.monotonic() + self.graceful_timeout
+        while time.monotonic() < deadline:
+            # Простаивающие keep-alive соединения закрываются, активные дорабатывают
+            for channel in list(server.active_channels.values()):
+                if not channel.requests:
+                    channel.will_close = True
+            if not server.active_channels:
+                break
+            wasyncore.loop(timeout=0.2, map=server._map, use_poll=server.adj.asyncore_use_poll, count=1)
+        server.task_dispatcher.shutdown(timeout=max(deadline - time.monotonic(), 0))
+
+
+class PreforkServer:
+    """Главный процесс: запуск, перезапуск и остановка рабочих процессов"""
+
+    def __init__(self, app_factory, host='127.0.0.1', port=5001, workers=None, threads=4,
+                 max_requests=0, max_requests_jitter=0, graceful_timeout=30, reuse_port=False,
+                 backlog=1024):
+        self.app_factory = app_factory
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.threads = threads
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.reuse_port = reuse_port
+        self.backlog = backlog
+        self.sock = None
+        self.children = {}  # pid -> время запуска
+        self._stopping = False
+        self._reload = False
+        self._failures = 0
+
+    @staticmethod
+    def supported():
+        return hasattr(os, 'fork') and hasattr(signal, 'SIGHUP')
+
+    def _bind(self):
+        family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(self.backlog)
+        sock.setblocking(False)
+        return sock
+
+    def _worker_max_requests(self):
+        if not self.max_requests:
+            return 0
+        return self.max_requests + random.randint(0, self.max_requests_jitter)
+
+    def spawn(self):
+        """Запуск рабочего процесса; возвращает pid и дескриптор сигнала готовности"""
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            code = 0
+            try:
+                # С SO_REUSEPORT у каждого процесса свой сокет, ядро распределяет соединения
+                sock = self._bind() if self.reuse_port else self.sock
+                Worker(self.app_factory, sock, self.threads, self._worker_max_requests(),
+                       self.graceful_timeout, ready_w).run()
+            except Exception:
+                logger.exception("Рабочий процесс %s завершился с ошибкой", os.getpid())
+                code = 1
+            finally:
+                os._exit(code)
+        os.close(ready_w)
+        self.children[pid] = time.monotonic()
+        return pid, ready_r
+
+    def _wait_ready(self, pid, ready_fd, timeout):
+        try:
+            readable, _, _ = select.select([ready_fd], [], [], timeout)
+            return bool(readable) and os.read(ready_fd, 1) == b'1'
+        finally:
+            os.close(ready_fd)
+
+    def _start_worker(self):
+        pid, ready_fd = self.spawn()
+        if self._wait_ready(pid, ready_fd, self.graceful_timeout):
+            return pid
+        logger.error("Рабочий процесс %s не запустился", pid)
+        self._kill(pid, signal.SIGKILL)
+        return None
+
+    def _kill(self, pid, sig):
+        try:
+            os.kill(pid, sig)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+
+    def reap(self):
+        """Сбор завершившихся процессов; возвращает список (pid, код завершения)"""
+        exited = []
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            started = self.children.pop(pid, None)
+            if started is None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            exited.append((pid, code))
+            if code != 0:
+                logger.warning("Рабочий процесс %s завершился с кодом %s", pid, code)
+                # Процесс, падающий сразу после запуска, перезапускается с задержкой
+                if time.monotonic() - started < 5:
+                    self._failures += 1
+                else:
+                    self._failures = 0
+        return exited
+
+    def _wait_exit(self, pid, timeout):
+        deadline = time.monotonic() + timeout
+        while pid in self.children and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.05)
+        if pid in self.children:
+            self._kill(pid, signal.SIGKILL)
+            while pid in self.children:
+                self.reap()
+                time.sleep(0.05)
+
+    def rolling_restart(self):
+        """Замена процессов по одному без остановки приема соединений"""
+        logger.info("Плавный перезапуск %s рабочих процессов", len(self.children))
+        for old_pid in list(self.children):
+            if self._stopping:
+                return
+            if self._start_worker() is None:
+                # Новый код не запускается: старые процессы продолжают работать
+                logger.error("Перезапуск прерван, текущие процессы сохранены")
+                return
+            self._kill(old_pid, signal.SIGTERM)
+            self._wait_exit(old_pid, self.graceful_timeout + 5)
+
+    def _handle_stop(self, *_):
+        self._stopping = True
+
+    def _handle_reload(self, *_):
+        self._reload = True
+
+    def run(self):
+        if not self.reuse_port:
+            self.sock = self._bind()
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+
+        for _ in range(self.workers):
+            self._start_worker()
+
+        while not self._stopping:
+            self.reap()
+            if self._reload:
+                self._reload = False
+                self.rolling_restart()
+                continue
+            if len(self.children) < self.workers:
+                if self._failures:
+                    time.sleep(min(2 ** self._failures, 30))
+                    if self._stopping:
+                        break
+                self._start_worker()
+                continue
+            time.sleep(0.5)
+
+        self.stop()
+
+    def stop(self):
+        """Плавная остановка: SIGTERM всем процессам, SIGKILL по истечении таймаута"""
+        for pid in list(self.children):
+            self._kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while self.children and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.children):
+            self._kill(pid, signal.SIGKILL)
+        while self.children:
+            self.reap()
+            time.sleep(0.05)
+        if self.sock is not None:
+            self.sock.close()
@@ -0,0 +1,110 @@
+"""
+Подготовленные выражения PostgreSQL для частых запросов.
+
+Частые запросы (лента, заметки пользователя, заметка по id, поиск
+пользователя при входе) подготавливаются один раз на подключение командой
+PREPARE и затем выполняются по имени (EXECUTE): сервер не разбирает и не
+планирует их текст заново при каждом вызове. Выигрыш есть только на
+долгоживущих подключениях, поэтому подключения переиспользуются пулом узла
+(см. db_router.DatabaseNode).
+
+Подготовленные выражения живут в сессии PostgreSQL, поэтому подключение
+(TrackedConnection) хранит имена своих выражений:
+- новое подключение (в том числе после переподключения) начинает с пустого
+  набора и подготавливает выражения при первом использовании;
+- после изменения схемы приложением (init_database) поколение реестра
+  увеличивается, и выражения подготавливаются заново;
+- если схему изменили извне и сервер отказывается выполнять выражение
+  ("cached plan must not change result type") или выражение пропало
+  (DISCARD ALL в пулере), оно подготавливается заново и запрос повторяется.
+
+PREPARE и DEALLOCATE выполняются мимо учета запросов (InstrumentedCursor.raw),
+а EXECUTE учитывается и попадает в лог медленных запросов с текстом исходного
+запроса, а не с именем выражения.
+"""
+
+import re
+import threading
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+
+# Ошибки выполнения, после которых выражение нужно подготовить заново
+_REPREPARE_ERRORS = (psycopg2.errors.FeatureNotSupported, psycopg2.errors.InvalidSqlStatementName)
+
+
+class TrackedConnection(psycopg2.extensions.connection):
+    """Подключение psycopg2 с учетом подготовленных выражений и узла-владельца"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = {}  # имя выражения -> поколение реестра, в котором оно подготовлено
+        self.node = None  # DatabaseNode, в пул которого подключение возвращается
+
+
+def to_positional(query):
+    """Параметры %s в $1, $2, ... для PREPARE; возвращает (SQL, число параметров)"""
+    count = query.count('%s')
+    counter = iter(range(1, count + 1))
+    return re.sub(r'%s', lambda match: f"${next(counter)}", query), count
+
+
+class StatementRegistry:
+    """Реестр частых запросов: текст запроса -> имя подготовленного выражения"""
+
+    def __init__(self, statements=None):
+        self.statements = {}  # имя -> (PREPARE, EXECUTE)
+        self.names = {}  # текст запроса -> имя
+        self.generation = 0
+        self._lock = threading.Lock()
+        for name, query in (statements or {}).items():
+            self.register(name, query)
+
+    def register(self, name, query):
+        sql, count = to_positional(query)
+        placeholders = f" ({', '.join(['%s'] * count)})" if count else ''
+        self.statements[name] = (f"PREPARE {name} AS {sql}", f"EXECUTE {name}{placeholders}")
+        self.names[query] = name
+
+    def invalidate(self):
+        """Схема изменилась: выражения на всех подключениях будут подготовлены заново"""
+        with self._lock:
+            self.generation += 1
+
+    def execute(self, cursor, query, params=None):
+        """Выполнение запроса: по имени, если он в реестре, иначе обычным текстом"""
+        name = self.names.get(query)
+        conn = cursor.connection
+        if name is None or not isinstance(conn, TrackedConnection):
+            if params is None:
+                return cursor.execute(query)
+            return cursor.execute(query, params)
+
+        # Повтор возможен, только если транзакция еще не начата:
+        # откат после ошибки не должен отменить предыдущие команды
+        idle = conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        try:
+            return self._execute_prepared(cursor, conn, name, query, params)
+        except _REPREPARE_ERRORS:
+            if not idle:
+                raise
+            conn.rollback()
+            # Выражения могли остаться на сервере с прежним типом результата
+            getattr(cursor, 'raw', cursor).execute("DEALLOCATE ALL")
+            conn.prepared.clear()
+            return self._execute_prepared(cursor, conn, name, query, params)
+
+    def _execute_prepared(self, cursor, conn, name, query, params):
+        prepare_sql, execute_sql = self.statements[name]
+        raw = getattr(cursor, 'raw', cursor)
+        generation = self.generation
+        prepared = conn.prepared.get(name)
+        if prepared != generation:
+            if prepared is not None:
+                raw.execute(f"DEALLOCATE {name}")
+            raw.execute(prepare_sql)
+            conn.prepared[name] = generation
+        if raw is cursor:
+            return cursor.execute(execute_sql, params or ())
+        return cursor.execute(execute_sql, params or (), label=query)
@@ -0,0 +1,114 @@
+"""
+SQL-запросы приложения.
+
+Используются и синхронным слоем данных (psycopg2, параметры %s),
+и асинхронным (asyncpg, параметры $1, $2, ...).
+"""
+
+import re
+from functools import lru_cache
+
+# Длина превью заметки в ленте; полный текст загружается по запросу
+NOTE_PREVIEW_LENGTH = 300
+
+
+def note_preview(content):
+    """Превью заметки: первые NOTE_PREVIEW_LENGTH символов, с многоточием, если текст длиннее"""
+    if len(content) <= NOTE_PREVIEW_LENGTH:
+        return content
+    return content[:NOTE_PREVIEW_LENGTH] + '…'
+
+
+def is_truncated(preview):
+    return preview is not None and len(preview) > NOTE_PREVIEW_LENGTH
+
+
+def format_feed_note(row):
+    """Строка SELECT_ALL_NOTES / SELECT_FEED_DELTA -> заметка для шаблона"""
+    return {
+        'id': row[0],
+        'title': row[1],
+        'preview': row[2],
+        'truncated': is_truncated(row[2]),
+        'user_id': row[3],
+        'created_at': row[4],
+        'username': row[5]
+    }
+
+
+SELECT_USER_BY_USERNAME = "SELECT * FROM users WHERE username = %s"
+
+INSERT_USER = "INSERT INTO users (username, password_hash) VALUES (%s, %s)"
+
+# Лента читает только превью: полный текст (TEXT без ограничения длины) не
+# передается для каждой заметки при каждом открытии страницы. Курсор ленты
+# (последний номер из журнала note_changes) читается тем же запросом, то есть
+# из того же снимка БД, что и заметки; при пустой ленте - одна строка без заметки
+SELECT_ALL_NOTES = """
+    SELECT feed.id, feed.title, feed.preview, feed.user_id, feed.created_at, feed.username, changes.seq
+    FROM (SELECT COALESCE(MAX(seq), 0) AS seq FROM note_changes) AS changes
+    LEFT JOIN (
+        SELECT notes.id, notes.title, notes.preview, notes.user_id, notes.created_at, users.username
+        FROM notes
+        JOIN users ON notes.user_id = users.id
+    ) AS feed ON 1 = 1
+    ORDER BY feed.created_at DESC
+"""
+
+SELECT_USER_NOTES = "SELECT * FROM notes WHERE user_id = %s ORDER BY created_at DESC"
+
+SELECT_NOTE_BY_ID = "SELECT * FROM notes WHERE id = %s AND user_id = %s"
+
+SELECT_NOTE_CONTENT = "SELECT content FROM notes WHERE id = %s"
+
+INSERT_NOTE = "INSERT INTO notes (title, content, preview, user_id) VALUES (%s, %s, %s, %s) RETURNING id"
+
+UPDATE_NOTE = "UPDATE notes SET title = %s, content = %s, preview = %s WHERE id = %s AND user_id = %s"
+
+DELETE_NOTE = "DELETE FROM notes WHERE id = %s AND user_id = %s"
+
+# Журнал изменений ленты (см. note_feed.py)
+SELECT_NOTE_CHANGE_BOUNDS = "SELECT COALESCE(MIN(seq), 0), COALESCE(MAX(seq), 0) FROM note_changes"
+
+# Последнее изменение каждой заметки после курсора; для удаленных заметок
+# (tombstone) колонки notes пустые
+SELECT_FEED_DELTA = """
+    SELECT changes.note_id, notes.title, notes.preview, notes.user_id, notes.created_at, users.username,
+           changes.seq
+    FROM (
+        SELECT note_id, MAX(seq) AS seq FROM note_changes WHERE seq > %s GROUP BY note_id
+    ) AS changes
+    LEFT JOIN notes ON notes.id = changes.note_id
+    LEFT JOIN users ON users.id = notes.user_id
+    ORDER BY changes.seq
+    LIMIT %s
+"""
+
+# В журнале остаются последние N изменений (и всегда последнее - источник курсора)
+PURGE_NOTE_CHANGES = "DELETE FROM note_changes WHERE seq <= (SELECT MAX(seq) FROM note_changes) - %s"
+
+# Заполнение превью у заметок, созданных до появления колонки
+BACKFILL_NOTE_PREVIEWS = f"""
+    UPDATE notes SET preview = CASE
+        WHEN length(content) > {NOTE_PREVIEW_LENGTH} THEN substr(content, 1, {NOTE_PREVIEW_LENGTH}) || '…'
+        ELSE content
+    END
+    WHERE preview IS NULL
+"""
+
+
+# Частые запросы, которые PostgreSQL выполняет как подготовленные выражения
+# (см. prepared_statements.py): имя выражения -> запрос
+PREPARED_STATEMENTS = {
+    'notes_feed': SELECT_ALL_NOTES,
+    'user_notes': SELECT_USER_NOTES,
+    'note_by_id': SELECT_NOTE_BY_ID,
+    'user_by_username': SELECT_USER_BY_USERNAME,
+}
+
+
+@lru_cache(maxsize=None)
+def to_asyncpg(query):
+    """Перевод параметров %s в нумерованные $1, $2, ... для asyncpg"""
+    counter = iter(range(1, query.count('%s') + 1))
+    return re.sub(r'%s', lambda match: f"${next(counter)}", query)
@@ -0,0 +1,241 @@
+"""
+Метрики запроса: сколько запросов к БД выполнено, сколько времени ушло на
+получение подключения, выполнение SQL, хэширование паролей и рендеринг шаблонов.
+
+Метрики хранятся в ContextVar, поэтому работают и в потоках waitress,
+и в async режиме. Медленные запросы пишутся в logs/slow_queries.log
+отдельным потоком через очередь, не задерживая обработку запроса.
+"""
+
+import hmac
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+_current = ContextVar('request_metrics', default=None)
+
+# Заголовок запроса с токеном SERVER_TIMING_TOKEN: Server-Timing отдается только ему
+SERVER_TIMING_TOKEN_HEADER = 'X-Server-Timing-Token'
+# Этапы, которые не попадают в Server-Timing: время хэширования пароля показывает,
+# существует ли пользователь, для которого выполнен вход
+PRIVATE_TIMINGS = ('hash',)
+
+
+def server_timing_allowed(supplied, token):
+    """Вызывающий знает токен (без настроенного токена заголовок не отдается никому)"""
+    return bool(token) and supplied is not None and hmac.compare_digest(supplied.encode(), token.encode())
+
+
+class RequestMetrics:
+    """Счетчики одного HTTP запроса"""
+
+    __slots__ = ('endpoint', 'started_at', 'queries', 'rows', 'connect_time', 'query_time', 'timings',
+                 'security_event')
+
+    def __init__(self, endpoint=None):
+        self.endpoint = endpoint
+        self.started_at = time.perf_counter()
+        self.queries = 0
+        self.rows = 0
+        self.connect_time = 0.0
+        self.query_time = 0.0
+        self.timings = {}  # hash, render, ...
+        self.security_event = False  # в запросе записано предупреждение/ошибка
+
+    def add_timing(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def total_time(self):
+        return time.perf_counter() - self.started_at
+
+    def server_timing(self):
+        """Значение заголовка Server-Timing (без числа строк и PRIVATE_TIMINGS, они есть в логе)"""
+        parts = [
+            f'db-connect;dur={self.connect_time * 1000:.2f}',
+            f'db-query;dur={self.query_time * 1000:.2f};desc="{self.queries} queries"',
+        ]
+        for name, seconds in self.timings.items():
+            if name not in PRIVATE_TIMINGS:
+                parts.append(f'{name};dur={seconds * 1000:.2f}')
+        parts.append(f'total;dur={self.total_time() * 1000:.2f}')
+        return ', '.join(parts)
+
+    def summary(self):
+        """Краткая сводка для лога доступа"""
+        timings = ''.join(f", {name} {seconds * 1000:.1f}ms" for name, seconds in self.timings.items())
+        return (
+            f"Duration: {self.total_time() * 1000:.1f}ms - "
+            f"DB: {self.queries} queries, {self.rows} rows, "
+            f"connect {self.connect_time * 1000:.1f}ms, query {self.query_time * 1000:.1f}ms"
+            f"{timings}"
+        )
+
+
+def start_request(endpoint=None):
+    metrics = RequestMetrics(endpoint)
+    _current.set(metrics)
+    return metrics
+
+
+def current():
+    return _current.get()
+
+
+def finish_request():
+    metrics = _current.get()
+    _current.set(None)
+    return metrics
+
+
+def record_connect(seconds):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.connect_time += seconds
+
+
+def record_query(sql, seconds, rows):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.queries += 1
+        metrics.query_time += seconds
+        metrics.rows += max(rows, 0)
+    slow_query_log.check(sql, seconds, rows, metrics.endpoint if metrics is not None else None)
+
+
+@contextmanager
+def timed(name):
+    """Замер произвольного участка (hash, render, ...) в текущем запросе"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.add_timing(name, time.perf_counter() - started)
+
+
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s|\$\d+|\?")
+_SPACE_RE = re.compile(r'\s+')
+
+
+def normalize_sql(sql):
+    """SQL без литералов и лишних пробелов: одинаковые запросы группируются в логе"""
+    return _SPACE_RE.sub(' ', _LITERAL_RE.sub('?', sql)).strip()
+
+
+class SlowQueryLog:
+    """Лог медленных запросов; запись в файл выполняется фоновым потоком"""
+
+    def __init__(self, threshold_ms=200, path='logs/slow_queries.log'):
+        self.threshold = threshold_ms / 1000
+        self.path = path
+        self.logger = logging.getLogger('slow_queries')
+        self.logger.setLevel(logging.WARNING)
+        self.logger.propagate = False
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Поток-писатель запускается в каждом процессе (в т.ч. после fork)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+
+            file_handler = RotatingFileHandler(self.path, maxBytes=1024 * 1024, backupCount=5, encoding='utf-8')
+            file_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+
+            log_queue = queue.SimpleQueue()
+            for handler in list(self.logger.handlers):
+                self.logger.removeHandler(handler)
+            self.logger.addHandler(QueueHandler(log_queue))
+            QueueListener(log_queue, file_handler).start()
+            self._pid = os.getpid()
+
+    def check(self, sql, seconds, rows, endpoint=None):
+        if self.threshold <= 0 or seconds < self.threshold:
+            return
+        self._ensure_started()
+        self.logger.warning(
+            f"Slow query - Duration: {seconds * 1000:.1f}ms - Rows: {rows} - "
+            f"Endpoint: {endpoint} - SQL: {normalize_sql(sql)}"
+        )
+
+
+slow_query_log = SlowQueryLog(float(os.getenv('SLOW_QUERY_THRESHOLD_MS', '200')))
+
+
+class InstrumentedCursor:
+    """Курсор DB-API, который считает время выполнения и полученные строки"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._sql = None
+        self._elapsed = 0.0
+        self._rows = 0
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    @property
+    def raw(self):
+        """Курсор без учета: служебные команды (PREPARE, DEALLOCATE) не считаются запросами"""
+        return self._cursor
+
+    def _flush(self):
+        if self._sql is not None:
+            rows = self._rows if self._rows else self._cursor.rowcount
+            record_query(self._sql, self._elapsed, rows)
+            self._sql = None
+
+    def execute(self, sql, params=None, label=None):
+        """label - текст запроса для метрик и лога, если выполняется не он сам (EXECUTE <имя>)"""
+        self._flush()
+        self._sql = label or sql
+        self._rows = 0
+        started = time.perf_counter()
+        try:
+            if params is None:
+                return self._cursor.execute(sql)
+            return self._cursor.execute(sql, params)
+        finally:
+            self._elapsed = time.perf_counter() - started
+
+    def executemany(self, sql, seq_of_params):
+        self._flush()
+        self._sql = sql
+        self._rows = 0
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(sql, seq_of_params)
+        finally:
+            self._elapsed = time.perf_counter() - started
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._elapsed += time.perf_counter() - started
+        if row is not None:
+            self._rows += 1
+        return row
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._elapsed += time.perf_counter() - started
+        self._rows += len(rows)
+        return rows
+
+    def close(self):
+        self._flush()
+        self._cursor.close()
@@ -0,0 +1,189 @@
+"""
+Выборочный профайлер запросов для production.
+
+WSGI middleware профилирует заданную долю запросов или запросы с заголовком
+X-Profile-Token (значение должно совпадать с PROFILING_TOKEN). Пока запрос
+обрабатывается, отдельный поток снимает стек потока-обработчика с заданным
+интервалом. Результат сохраняется в формате "folded stacks" (flamegraph.pl,
+speedscope, inferno) в logs/profiles; хранятся только последние N файлов.
+Запись файла и удаление старых профилей выполняет фоновый поток, поток
+запроса только ставит результат в очередь.
+
+Когда профилирование выключено, middleware не подключается вовсе.
+"""
+
+import hmac
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+
+class StackSampler:
+    """Периодический снимок стека одного потока"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    @staticmethod
+    def _label(code):
+        filename = os.path.basename(code.co_filename)
+        return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(';', ':')
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[';'.join(stack)] += 1
+            self.samples += 1
+
+
+class ProfiledResponse:
+    """Тело ответа: профилирование завершается после отдачи последнего байта"""
+
+    def __init__(self, iterable, on_close):
+        self.iterable = iterable
+        self.on_close = on_close
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self.on_close()
+
+
+class ProfilingMiddleware:
+    """WSGI middleware выборочного профилирования запросов"""
+
+    header = 'HTTP_X_PROFILE_TOKEN'
+
+    def __init__(self, app, output_dir='logs/profiles', sample_rate=0.0, token='',
+                 interval=0.005, max_files=200, max_concurrent=4):
+        self.app = app
+        self.output_dir = output_dir
+        self.sample_rate = sample_rate
+        self.token = token
+        self.interval = interval
+        self.max_files = max_files
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._queue = queue.SimpleQueue()
+        self._writer_pid = None
+        self._writer_lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, app):
+        return cls(
+            app,
+            output_dir=os.getenv('PROFILING_DIR', 'logs/profiles'),
+            sample_rate=float(os.getenv('PROFILING_SAMPLE_RATE', '0')),
+            token=os.getenv('PROFILING_TOKEN', ''),
+            interval=float(os.getenv('PROFILING_INTERVAL_MS', '5')) / 1000,
+            max_files=int(os.getenv('PROFILING_MAX_FILES', '200')),
+            max_concurrent=int(os.getenv('PROFILING_MAX_CONCURRENT', '4'))
+        )
+
+    def _should_profile(self, environ):
+        supplied = environ.get(self.header)
+        if supplied is not None:
+            # Профиль по запросу только для вызывающих, знающих токен
+            return bool(self.token) and hmac.compare_digest(supplied.encode(), self.token.encode())
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def __call__(self, environ, start_response):
+        if not self._should_profile(environ) or not self._slots.acquire(blocking=False):
+            return self.app(environ, start_response)
+
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        started = time.perf_counter()
+        sampler.start()
+
+        def finish():
+            sampler.stop()
+            self._slots.release()
+            self._submit(environ, sampler, time.perf_counter() - started)
+
+        try:
+            result = self.app(environ, start_response)
+        except Exception:
+            finish()
+            raise
+        return ProfiledResponse(result, finish)
+
+    def _submit(self, environ, sampler, duration):
+        """Профиль в очередь записи; имя файла фиксируется по времени завершения запроса"""
+        if not sampler.samples:
+            return
+        path = re.sub(r'[^A-Za-z0-9]+', '_', environ.get('PATH_INFO', '/')).strip('_') or 'root'
+        filename = (
+            f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_"
+            f"{environ.get('REQUEST_METHOD', 'GET')}_{path[:40]}_{duration * 1000:.0f}ms.folded"
+        )
+        self._ensure_writer()
+        self._queue.put((filename, sampler.stacks))
+
+    def _ensure_writer(self):
+        # Поток записи запускается в каждом процессе (в т.ч. после fork)
+        if self._writer_pid == os.getpid():
+            return
+        with self._writer_lock:
+            if self._writer_pid == os.getpid():
+                return
+            # Очередь родителя после fork не используется: ее профили записывает он сам
+            self._queue = queue.SimpleQueue()
+            thread = threading.Thread(target=self._writer_loop, name='profile-writer', daemon=True)
+            thread.start()
+            self._writer_pid = os.getpid()
+
+    def _writer_loop(self):
+        while True:
+            filename, stacks = self._queue.get()
+            try:
+                self._write(filename, stacks)
+            except OSError:
+                pass
+
+    def _write(self, filename, stacks):
+        with open(os.path.join(self.output_dir, filename), 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        self._enforce_retention()
+
+    def _enforce_retention(self):
+        """Удаление самых старых профилей сверх лимита"""
+        files = sorted(
+            (entry for entry in os.scandir(self.output_dir) if entry.name.endswith('.folded')),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in files[:max(0, len(files) - self.max_files)]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
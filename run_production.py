@@ -1,16 +1,117 @@
-from waitress import serve
-from app import app
+import os
+
+# Режим сервера: sync (waitress + Flask) или async (uvicorn + asyncpg)
+SERVER_MODE = os.getenv('SERVER_MODE', 'sync').lower()
+HOST = os.getenv('SERVER_HOST', '127.0.0.1')
+PORT = int(os.getenv('SERVER_PORT', '5001'))
+THREADS = int(os.getenv('SERVER_THREADS', '4'))
+# Число процессов (0 - один процесс без fork). Каждый процесс держит к каждому
+# серверу БД до DB_POOL_SIZE подключений (по умолчанию SERVER_THREADS; в async
+# режиме - ASYNC_DB_POOL_MAX) и одно подключение LISTEN для ленты, то есть всего
+# SERVER_WORKERS * (DB_POOL_SIZE + 1). Это должно помещаться в max_connections
+# PostgreSQL (DB_MAX_CONNECTIONS, по умолчанию 100 как в PostgreSQL), поэтому
+# по умолчанию процессов по числу ядер, но не больше 4
+WORKERS = int(os.getenv('SERVER_WORKERS', str(min(os.cpu_count() or 1, 4))))
+DB_MAX_CONNECTIONS = int(os.getenv('DB_MAX_CONNECTIONS', '100'))
+# Перезапуск процесса после N запросов (0 - без ограничения) и разброс, чтобы процессы не перезапускались разом
+MAX_REQUESTS = int(os.getenv('SERVER_MAX_REQUESTS', '0'))
+MAX_REQUESTS_JITTER = int(os.getenv('SERVER_MAX_REQUESTS_JITTER', '0'))
+GRACEFUL_TIMEOUT = float(os.getenv('SERVER_GRACEFUL_TIMEOUT', '30'))
+# Отдельный сокет в каждом процессе с SO_REUSEPORT вместо общего сокета
+REUSE_PORT = os.getenv('SERVER_REUSE_PORT', '0') == '1'
+# Выборочное профилирование запросов (см. request_profiler.py)
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '0') == '1'
+# Список IP, заблокированных SIEM (см. ip_blocklist.py)
+IP_BLOCKLIST_ENABLED = os.getenv('IP_BLOCKLIST_ENABLED', '1') == '1'
+IP_BLOCKLIST_PATH = os.getenv('IP_BLOCKLIST_PATH', 'data/ip_blocklist.bin')
+
+
+def build_wsgi_app():
+    """Flask приложение и WSGI middleware вокруг него"""
+    from app import app
+
+    wsgi_app = app
+    if PROFILING_ENABLED:
+        from request_profiler import ProfilingMiddleware
+        # Внешний слой: в профиль попадает вся обработка запроса
+        wsgi_app = ProfilingMiddleware.from_env(wsgi_app)
+    if IP_BLOCKLIST_ENABLED:
+        from enhanced_security_middleware import IPBlocklistMiddleware
+        from ip_blocklist import IPBlocklist
+        # Самый внешний слой: заблокированные IP отклоняются до любой обработки
+        wsgi_app = IPBlocklistMiddleware(wsgi_app, IPBlocklist(IP_BLOCKLIST_PATH))
+    return wsgi_app
+
+
+def estimated_db_connections():
+    """Подключений к одному серверу PostgreSQL при полной нагрузке всех процессов"""
+    if SERVER_MODE == 'async':
+        pool_size = int(os.getenv('ASYNC_DB_POOL_MAX', '20'))
+    else:
+        pool_size = int(os.getenv('DB_POOL_SIZE', str(THREADS)))
+    return max(WORKERS, 1) * (pool_size + 1)
+
+
+def serve_sync():
+    from waitress import serve
+
+    serve(
+        build_wsgi_app(),
+        host=HOST,
+        port=PORT,
+        threads=THREADS,
+        ident=None
+    )
+
+
+def serve_prefork():
+    from prefork import PreforkServer
+
+    PreforkServer(
+        build_wsgi_app,
+        host=HOST,
+        port=PORT,
+        workers=WORKERS,
+        threads=THREADS,
+        max_requests=MAX_REQUESTS,
+        max_requests_jitter=MAX_REQUESTS_JITTER,
+        graceful_timeout=GRACEFUL_TIMEOUT,
+        reuse_port=REUSE_PORT
+    ).run()
+
+
+def serve_async():
+    import uvicorn
+
+    uvicorn.run(
+        'async_app:app',
+        host=HOST,
+        port=PORT,
+        log_level='warning',
+        server_header=False,
+        workers=max(WORKERS, 1)
+    )
+
 
 if __name__ == "__main__":
-    print("🚀 Production сервер запущен на http://127.0.0.1:5001")
+    from prefork import PreforkServer
+
+    use_prefork = SERVER_MODE != 'async' and WORKERS > 0 and PreforkServer.supported()
+    print(f"🚀 Production сервер ({SERVER_MODE}) запущен на http://{HOST}:{PORT}")
+    if use_prefork:
+        print(f"⚙️  Процессов: {WORKERS}, потоков в процессе: {THREADS} (SIGHUP - плавный перезапуск)")
     print("🛡️  Все security headers активированы")
     print("⚠️  Для HSTS нужен HTTPS в production")
     print("⏹️  Остановка: Ctrl+C")
+    if os.getenv('STORAGE_BACKEND', 'postgres').lower() == 'postgres':
+        connections = estimated_db_connections()
+        if connections > DB_MAX_CONNECTIONS:
+            print(f"⚠️  До {connections} подключений к PostgreSQL больше DB_MAX_CONNECTIONS={DB_MAX_CONNECTIONS}: "
+                  f"уменьшите SERVER_WORKERS или DB_POOL_SIZE")
 
-    serve(
-        app,
-        host='127.0.0.1',
-        port=5001,
-        threads=4,
-        ident=None
-    )
\ No newline at end of file
+    if SERVER_MODE == 'async':
+        serve_async()
+    elif use_prefork:
+        serve_prefork()
+    else:
+        serve_sync()
@@ -0,0 +1,425 @@
+"""
+Серверное хранилище сессий для Flask.
+
+В cookie хранится только подписанный непрозрачный идентификатор сессии,
+сами данные лежат в PostgreSQL или в локальном файле SQLite.
+Горячие сессии кэшируются в памяти процесса (LRU с TTL), запись в хранилище
+выполняется только при реальном изменении данных.
+
+Идентификатор сессии меняется только при смене пользователя (вход, выход):
+параллельные запросы со старой cookie (другая вкладка, запросы скриптов
+страницы) продолжают работать с той же сессией.
+
+Кэш у каждого процесса свой: выход или смена идентификатора в одном процессе
+удаляет сессию из хранилища, но другие процессы отдают свою копию, пока она
+моложе ttl кэша (SESSION_CACHE_TTL). Поэтому ttl по умолчанию - 2 секунды:
+после этого каждый процесс заново читает сессию из хранилища и узнает о
+выходе. Кэш при этом снимает чтения хранилища для серии запросов одной
+страницы (сама страница, скрипты, запросы ленты). Пока хранилище недоступно,
+копии из кэша отдаются и после ttl.
+"""
+
+import hashlib
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+logger = logging.getLogger('flask_app')
+
+
+class SessionCache:
+    """Потокобезопасный LRU-кэш сессий с ограничением по времени жизни"""
+
+    def __init__(self, max_entries=10000, ttl=2):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # sid -> (payload, digest, expires_at, cached_at); хранится сериализованная
+        # сессия, чтобы изменения вложенных списков запроса не меняли запись кэша
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid, allow_stale=False):
+        """
+        Сессия из кэша. Запись старше ttl не возвращается, но остается в кэше
+        до истечения самой сессии: allow_stale=True отдает ее, пока хранилище
+        недоступно.
+        """
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            if entry[2] <= time.time():
+                del self._entries[sid]
+                return None
+            if not allow_stale and time.monotonic() - entry[3] > self.ttl:
+                return None
+            self._entries.move_to_end(sid)
+            return entry[:3]
+
+    def put(self, sid, payload, digest, expires_at):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[sid] = (payload, digest, expires_at, time.monotonic())
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def purge_expired(self):
+        """Удаление записей истекших сессий, возвращает количество удаленных"""
+        now = time.time()
+        with self._lock:
+            stale = [sid for sid, entry in self._entries.items() if entry[2] <= now]
+            for sid in stale:
+                del self._entries[sid]
+        return len(stale)
+
+
+class BaseSessionStore:
+    """Общая логика SQL-хранилищ сессий"""
+
+    placeholder = '%s'
+
+    create_table_sql = '''
+        CREATE TABLE IF NOT EXISTS sessions (
+            sid VARCHAR(64) PRIMARY KEY,
+            data TEXT NOT NULL,
+            expires_at DOUBLE PRECISION NOT NULL
+        )
+    '''
+    create_index_sql = 'CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at)'
+
+    def __init__(self):
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def _connect(self):
+        raise NotImplementedError
+
+    def _release(self, conn):
+        raise NotImplementedError
+
+    def _sql(self, query):
+        return query.replace('%s', self.placeholder)
+
+    def _execute(self, query, params=(), fetch=False):
+        if not self._schema_ready:
+            self.ensure_schema()
+
+        conn = self._connect()
+        if conn is None:
+            raise RuntimeError('Хранилище сессий недоступно')
+        cursor = conn.cursor()
+        try:
+            cursor.execute(self._sql(query), params)
+            result = cursor.fetchone() if fetch else cursor.rowcount
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            self._release(conn)
+
+    def ensure_schema(self):
+        """Создание таблицы сессий при первом обращении"""
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            conn = self._connect()
+            if conn is None:
+                raise RuntimeError('Хранилище сессий недоступно')
+            cursor = conn.cursor()
+            try:
+                cursor.execute(self.create_table_sql)
+                cursor.execute(self.create_index_sql)
+                conn.commit()
+                self._schema_ready = True
+            finally:
+                cursor.close()
+                self._release(conn)
+
+    def load(self, sid):
+        """Возвращает (data, expires_at) или None"""
+        row = self._execute(
+            "SELECT data, expires_at FROM sessions WHERE sid = %s AND expires_at > %s",
+            (sid, time.time()),
+            fetch=True
+        )
+        return row
+
+    def save(self, sid, data, expires_at):
+        self._execute(
+            "INSERT INTO sessions (sid, data, expires_at) VALUES (%s, %s, %s) "
+            "ON CONFLICT (sid) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at",
+            (sid, data, expires_at)
+        )
+
+    def delete(self, sid):
+        self._execute("DELETE FROM sessions WHERE sid = %s", (sid,))
+
+    def purge_expired(self):
+        """Удаление истекших сессий, возвращает количество удаленных строк"""
+        return self._execute("DELETE FROM sessions WHERE expires_at <= %s", (time.time(),))
+
+
+class PostgresSessionStore(BaseSessionStore):
+    """Хранилище сессий в таблице PostgreSQL"""
+
+    def __init__(self, connect, release=None):
+        super().__init__()
+        self.connect = connect
+        self.release = release  # возврат подключения в пул (None - закрыть)
+
+    def _connect(self):
+        return self.connect()
+
+    def _release(self, conn):
+        if self.release is None:
+            conn.close()
+        else:
+            self.release(conn)
+
+
+class SQLiteSessionStore(BaseSessionStore):
+    """Хранилище сессий в локальном файле SQLite (для одного узла)"""
+
+    placeholder = '?'
+
+    create_table_sql = '''
+        CREATE TABLE IF NOT EXISTS sessions (
+            sid TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    '''
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def _connect(self):
+        # Одно подключение на поток; после fork создаем новое
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _release(self, conn):
+        pass
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Сессия, данные которой хранятся на сервере"""
+
+    def __init__(self, initial=None, sid=None, new=False, digest=None, expires_at=None, owner=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.digest = digest
+        self.expires_at = expires_at
+        self.owner = owner  # пользователь на момент загрузки (см. persist_session)
+        self.modified = False
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Flask SessionInterface с серверным хранилищем и кэшем в памяти"""
+
+    serializer = TaggedJSONSerializer()
+    session_class = ServerSideSession
+    salt = 'server-side-session'
+    # Ключ сессии, смена которого меняет идентификатор сессии (защита от фиксации)
+    owner_key = 'user_id'
+
+    def __init__(self, store, cache=None, cleanup_interval=300):
+        self.store = store
+        self.cache = cache if cache is not None else SessionCache()
+        self.cleanup_interval = cleanup_interval
+        self._cleanup_pid = None
+        self._cleanup_lock = threading.Lock()
+
+    def _get_signer(self, secret_key):
+        return Signer(secret_key, salt=self.salt, key_derivation='hmac', digest_method=hashlib.sha256)
+
+    @staticmethod
+    def _digest(payload):
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def sign_sid(self, secret_key, sid):
+        return self._get_signer(secret_key).sign(sid.encode('utf-8')).decode('utf-8')
+
+    def _ensure_cleanup_thread(self):
+        """Фоновая очистка истекших сессий (запускается один раз в каждом процессе)"""
+        if self._cleanup_pid == os.getpid() or self.cleanup_interval <= 0:
+            return
+        with self._cleanup_lock:
+            if self._cleanup_pid == os.getpid():
+                return
+            self._cleanup_pid = os.getpid()
+            thread = threading.Thread(target=self._cleanup_loop, name='session-cleanup', daemon=True)
+            thread.start()
+
+    def _cleanup_loop(self):
+        while True:
+            time.sleep(self.cleanup_interval)
+            try:
+                removed = self.store.purge_expired()
+                self.cache.purge_expired()
+                if removed:
+                    logger.info(f"Удалено истекших сессий: {removed}")
+            except Exception as e:
+                logger.error(f"Ошибка очистки истекших сессий: {e}")
+
+    def load_session(self, secret_key, cookie_value):
+        """Загрузка сессии по значению cookie (не зависит от веб-фреймворка)"""
+        self._ensure_cleanup_thread()
+
+        if not cookie_value:
+            return self.session_class(new=True)
+
+        try:
+            sid = self._get_signer(secret_key).unsign(cookie_value).decode('utf-8')
+        except BadSignature:
+            return self.session_class(new=True)
+
+        cached = self.cache.get(sid)
+        if cached is not None:
+            payload, digest, expires_at = cached
+            return self._session(sid, payload, digest, expires_at)
+
+        try:
+            row = self.store.load(sid)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки сессии: {e}")
+            # Хранилище недоступно: пользователь остается в системе по копии
+            # сессии в кэше, даже если ее ttl истек
+            cached = self.cache.get(sid, allow_stale=True)
+            if cached is not None:
+                payload, digest, expires_at = cached
+                return self._session(sid, payload, digest, expires_at)
+            row = None
+
+        if row is None:
+            return self.session_class(new=True)
+
+        payload, expires_at = row
+        digest = self._digest(payload)
+        session = self._session(sid, payload, digest, expires_at)
+        if not session.new:
+            self.cache.put(sid, payload, digest, expires_at)
+        return session
+
+    def _session(self, sid, payload, digest, expires_at):
+        try:
+            data = self.serializer.loads(payload)
+        except ValueError:
+            return self.session_class(new=True)
+        return self.session_class(data, sid=sid, digest=digest, expires_at=expires_at,
+                                  owner=data.get(self.owner_key))
+
+    def persist_session(self, session, lifetime):
+        """
+        Сохранение сессии при изменении данных.
+        Возвращает новый sid, если cookie нужно выставить, пустую строку,
+        если cookie нужно удалить, и None, если cookie не меняется.
+        """
+        if not session:
+            # Пустая сессия: удаляем запись и cookie, если они были
+            if session.sid is not None:
+                self._discard(session.sid)
+                return ''
+            return None
+
+        payload = self.serializer.dumps(dict(session))
+        digest = self._digest(payload)
+        now = time.time()
+
+        changed = session.sid is None or digest != session.digest
+        # Продлеваем срок жизни без изменения данных только когда прошла половина TTL
+        needs_refresh = session.expires_at is None or session.expires_at - now < lifetime / 2
+
+        if not changed and not needs_refresh:
+            return None
+
+        sid = session.sid
+        # Новый идентификатор только для новой сессии и при смене пользователя:
+        # вход не допускает фиксации сессии, а прочие изменения сохраняются под
+        # прежним sid, и параллельные запросы со старой cookie их не теряют
+        rotate = sid is None or session.get(self.owner_key) != session.owner
+        if rotate:
+            sid = secrets.token_urlsafe(32)
+
+        expires_at = now + lifetime
+        try:
+            self.store.save(sid, payload, expires_at)
+        except Exception as e:
+            # Прежняя сессия остается действительной (в том числе в кэше)
+            logger.error(f"Ошибка сохранения сессии: {e}")
+            return None
+
+        if rotate and session.sid is not None:
+            self._discard(session.sid)
+        self.cache.put(sid, payload, digest, expires_at)
+        return sid if rotate else None
+
+    def open_session(self, app, request):
+        return self.load_session(app.secret_key, request.cookies.get(self.get_cookie_name(app)))
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session:
+            response.vary.add('Cookie')
+
+        sid = self.persist_session(session, app.permanent_session_lifetime.total_seconds())
+        if sid is None:
+            return
+
+        if not sid:
+            response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        response.set_cookie(
+            name,
+            self.sign_sid(app.secret_key, sid),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+    def _discard(self, sid):
+        self.cache.pop(sid)
+        try:
+            self.store.delete(sid)
+        except Exception as e:
+            logger.error(f"Ошибка удаления сессии: {e}")
@@ -0,0 +1,266 @@
+"""
+Хранение оповещений SIEM в PostgreSQL.
+
+Оповещения накапливаются в памяти и записываются фоновым потоком пачками
+через COPY (одна команда на пачку вместо INSERT на оповещение). Таблица
+security_alerts секционирована по дням (RANGE по ts, UTC); индексы
+(ts, type) и (ip, ts) создаются на родительской таблице и наследуются
+секциями. Секции старше срока хранения удаляются целиком (DROP TABLE).
+
+Расследования выполняются запросами к таблице, например:
+    SELECT * FROM security_alerts WHERE ip = '203.0.113.7' AND ts > now() - interval '7 days';
+"""
+
+import io
+import ipaddress
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+import psycopg2
+
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def copy_value(value):
+    """Значение в текстовом формате COPY (NULL -> \\N)"""
+    if value is None:
+        return '\\N'
+    return str(value).translate(_COPY_ESCAPES)
+
+
+class PostgresAlertSink:
+    """Буфер оповещений с пакетной записью через COPY в секционированную таблицу"""
+
+    columns = ('ts', 'type', 'ip', 'message', 'details')
+
+    def __init__(self, connect, table='security_alerts', batch_size=500, flush_interval=2.0,
+                 retention_days=90, max_buffer=100000):
+        self.connect = connect
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self.max_buffer = max_buffer
+        self.buffer = deque()
+        self.dropped = 0  # не записанные оповещения (переполнение буфера, некорректные данные)
+        self.written = 0
+        self._partitions = set()
+        self._conn = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._next_retention = 0.0
+        self._thread = threading.Thread(target=self._run, name='alert-sink', daemon=True)
+
+    @classmethod
+    def from_dsn(cls, dsn, **kwargs):
+        return cls(lambda: psycopg2.connect(dsn), **kwargs)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def write(self, alert_type, ip, message, details='', timestamp=None):
+        """Постановка оповещения в очередь (без обращения к БД)"""
+        if len(self.buffer) >= self.max_buffer:
+            self.dropped += 1
+            return
+        ts = datetime.fromtimestamp(time.time() if timestamp is None else timestamp, timezone.utc)
+        self.buffer.append((ts, alert_type, self._inet(ip), message, details or None))
+        if len(self.buffer) >= self.batch_size:
+            self._wake.set()
+
+    @staticmethod
+    def _inet(ip):
+        # Некорректный адрес в колонке INET сорвал бы COPY всей пачки
+        try:
+            return str(ipaddress.ip_address(ip))
+        except ValueError:
+            return None
+
+    # ===== Схема и секции =====
+
+    def _connection(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = self.connect()
+            self._partitions.clear()
+            try:
+                self.ensure_schema()
+            except psycopg2.Error:
+                self._reset_connection()
+                raise
+        return self._conn
+
+    def ensure_schema(self):
+        conn = self._conn
+        with conn.cursor() as cursor:
+            cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    ts TIMESTAMPTZ NOT NULL,
+                    type VARCHAR(50) NOT NULL,
+                    ip INET,
+                    message TEXT NOT NULL,
+                    details TEXT
+                ) PARTITION BY RANGE (ts)
+            ''')
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.table}_ts_type ON {self.table} (ts, type)')
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.table}_ip_ts ON {self.table} (ip, ts)')
+        conn.commit()
+        # Секции на сегодня и завтра создаются заранее
+        today = datetime.now(timezone.utc).date()
+        self.ensure_partition(today)
+        self.ensure_partition(today + timedelta(days=1))
+
+    def partition_name(self, day):
+        return f"{self.table}_p{day:%Y%m%d}"
+
+    def ensure_partition(self, day):
+        if day in self._partitions:
+            return
+        conn = self._conn
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.partition_name(day)} PARTITION OF {self.table} "
+                f"FOR VALUES FROM ('{day:%Y-%m-%d} 00:00:00+00') TO ('{day + timedelta(days=1):%Y-%m-%d} 00:00:00+00')"
+            )
+        conn.commit()
+        self._partitions.add(day)
+
+    def drop_expired_partitions(self):
+        """Удаление секций старше retention_days; возвращает имена удаленных"""
+        conn = self._connection()
+        cutoff = datetime.now(timezone.utc).date() - timedelta(days=self.retention_days)
+        pattern = re.compile(rf'^{self.table}_p(\d{{8}})$')
+        dropped = []
+        with conn.cursor() as cursor:
+            cursor.execute(
+                '''
+                SELECT child.relname
+                FROM pg_inherits
+                JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+                JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                WHERE parent.relname = %s
+                ''',
+                (self.table,)
+            )
+            for (name,) in cursor.fetchall():
+                match = pattern.match(name)
+                if not match:
+                    continue
+                day = datetime.strptime(match.group(1), '%Y%m%d').date()
+                if day < cutoff:
+                    cursor.execute(f'DROP TABLE IF EXISTS {name}')
+                    self._partitions.discard(day)
+                    dropped.append(name)
+        conn.commit()
+        return dropped
+
+    # ===== Запись =====
+
+    def flush(self):
+        """Запись накопленных оповещений одной командой COPY"""
+        with self._flush_lock:
+            batch = []
+            while self.buffer:
+                batch.append(self.buffer.popleft())
+            if not batch:
+                return 0
+            try:
+                conn = self._connection()
+                for day in {row[0].date() for row in batch}:
+                    self.ensure_partition(day)
+                data = io.StringIO()
+                for row in batch:
+                    data.write('\t'.join(copy_value(value) for value in row))
+                    data.write('\n')
+                data.seek(0)
+                with conn.cursor() as cursor:
+                    cursor.copy_expert(f"COPY {self.table} ({', '.join(self.columns)}) FROM STDIN", data)
+                conn.commit()
+            except psycopg2.DataError as e:
+                # Повтор не поможет: пачка с некорректными данными отбрасывается
+                print(f"[ERROR] Оповещения отброшены ({len(batch)}): {e}")
+                self._reset_connection()
+                self.dropped += len(batch)
+                return 0
+            except psycopg2.Error as e:
+                print(f"[ERROR] Не удалось сохранить {len(batch)} оповещений в БД: {e}")
+                self._reset_connection()
+                # Пачка возвращается в начало очереди и будет записана при следующей попытке
+                overflow = max(0, len(batch) + len(self.buffer) - self.max_buffer)
+                self.dropped += overflow
+                self.buffer.extendleft(reversed(batch[:len(batch) - overflow]))
+                return 0
+            self.written += len(batch)
+            return len(batch)
+
+    def _reset_connection(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except psycopg2.Error:
+                pass
+        self._conn = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+            if time.time() >= self._next_retention:
+                self._maintain_partitions()
+
+    def _maintain_partitions(self):
+        # Проверка срока хранения раз в час, заодно создается секция на завтра
+        with self._flush_lock:
+            try:
+                dropped = self.drop_expired_partitions()
+                if dropped:
+                    print(f"[INFO] Удалены секции оповещений: {', '.join(dropped)}")
+                self.ensure_partition(datetime.now(timezone.utc).date() + timedelta(days=1))
+                self._next_retention = time.time() + 3600
+            except psycopg2.Error as e:
+                print(f"[ERROR] Обслуживание секций оповещений: {e}")
+                self._reset_connection()
+                self._next_retention = time.time() + 60
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=10)
+        self.flush()
+        self._reset_connection()
+
+    # ===== Расследования =====
+
+    def query(self, ip=None, alert_type=None, since=None, until=None, limit=1000):
+        """Оповещения за период (datetime) по IP и/или типу; использует индексы (ip, ts) и (ts, type)"""
+        conditions, params = [], []
+        if ip is not None:
+            conditions.append('ip = %s')
+            params.append(ip)
+        if alert_type is not None:
+            conditions.append('type = %s')
+            params.append(alert_type)
+        if since is not None:
+            conditions.append('ts >= %s')
+            params.append(since)
+        if until is not None:
+            conditions.append('ts < %s')
+            params.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        with self._flush_lock:
+            conn = self._connection()
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT ts, type, host(ip), message, details FROM {self.table} {where} "
+                    f"ORDER BY ts DESC LIMIT %s",
+                    (*params, limit)
+                )
+                rows = cursor.fetchall()
+            conn.commit()
+        return rows
@@ -13,6 +13,15 @@ from collections import defaultdict, deque
 import threading
 from pathlib import Path
 
+from ip_blocklist import IPBlocklistWriter
+from siem_sketches import IncidentStore, ScanDetector
+
+# Строка журнала доступа приложения (access_log.py)
+ACCESS_RE = re.compile(r'Access - Method: \S+ - Path: (\S+) - Status: (\d{3}) - .*? - Sample: ([\d.e-]+)')
+# IP в формате логов приложения: "2024-01-01 12:00:00,123 - flask_app - INFO - [127.0.0.1] - ...".
+# Берется только из поля записи в начале строки, а не из текста сообщения
+IP_RE = re.compile(r'\S+ \S+ - \S+ - [A-Z]+ - \[([0-9A-Fa-f.:]+)\] - ')
+
 
 class SecurityMonitor:
     def __init__(self):
@@ -23,6 +32,57 @@ class SecurityMonitor:
         # Хранилище для обнаружения атак
         self.failed_logins = defaultdict(lambda: deque(maxlen=10))  # IP -> timestamps
         self.suspicious_ips = set()
+        # IP, которые будут заблокированы по ближайшей записи журнала доступа
+        self.pending_blocks = set()
+
+        # Автоматическая блокировка IP в приложении (общий файл, см. ip_blocklist.py).
+        # Включается явно (SIEM_AUTO_BLOCK=1) и срабатывает только на сигнатуры атак:
+        # сканирование, перебор паролей, SQL-инъекции. Превышение частоты запросов
+        # только отмечается оповещением: за NAT или корпоративным прокси с одного
+        # адреса работает много пользователей. Адреса обратного прокси и
+        # балансировщика перед приложением нужно добавить в SIEM_BLOCK_ALLOWLIST
+        # (через запятую), иначе блокировка отключит всех клиентов за ними
+        self.block_ttl = int(os.getenv('SIEM_BLOCK_TTL', '3600'))
+        self.block_allowlist = {
+            ip.strip() for ip in os.getenv('SIEM_BLOCK_ALLOWLIST', '127.0.0.1,::1').split(',') if ip.strip()
+        }
+        self.blocklist = None
+        if os.getenv('SIEM_AUTO_BLOCK', '0') == '1':
+            self.blocklist = IPBlocklistWriter(
+                os.getenv('IP_BLOCKLIST_PATH', 'data/ip_blocklist.bin'),
+                publish_interval=float(os.getenv('SIEM_BLOCK_PUBLISH_INTERVAL', '1'))
+            )
+
+        # Время события из строки лога (для повторного разбора старых логов)
+        self.event_time = None
+        self._time_cache = (None, None)
+        # Подписчики на оповещения: callback(alert_type, ip, message, details)
+        self.alert_listeners = []
+
+        # Пакетная запись оповещений в PostgreSQL (секционированная таблица security_alerts)
+        self.alert_sink = None
+        alerts_dsn = os.getenv('SIEM_ALERTS_DSN')
+        if alerts_dsn:
+            from siem_alert_store import PostgresAlertSink
+            self.alert_sink = PostgresAlertSink.from_dsn(
+                alerts_dsn,
+                retention_days=int(os.getenv('SIEM_ALERTS_RETENTION_DAYS', '90'))
+            ).start()
+            self.alert_listeners.append(
+                lambda alert_type, ip, message, details:
+                    self.alert_sink.write(alert_type, ip, message, details, self.event_time)
+            )
+
+        # Окна по IP: различные пути (HyperLogLog), доля ошибок и частота запросов
+        self.scan_detector = ScanDetector(
+            window_seconds=int(os.getenv('SIEM_SCAN_WINDOW', '60')),
+            min_distinct=int(os.getenv('SIEM_SCAN_MIN_DISTINCT', '15')),
+            min_error_ratio=float(os.getenv('SIEM_SCAN_MIN_ERROR_RATIO', '0.5')),
+            max_rate=float(os.getenv('SIEM_SCAN_MAX_RATE', '50')),
+            max_ips=int(os.getenv('SIEM_SCAN_MAX_IPS', '50000'))
+        )
+        # Поминутная статистика за последние сутки для отчетов (top IP/путей, тренды)
+        self.incident_store = IncidentStore(minutes=int(os.getenv('SIEM_HISTORY_MINUTES', str(24 * 60))))
 
         # Паттерны для обнаружения атак
         self.sql_injection_patterns = [
@@ -66,14 +126,16 @@ class SecurityMonitor:
             "BRUTE_FORCE": "",  # Красный текст
             "SQL_INJECTION": "",  # Желтый текст
             "UNAUTHORIZED_ACCESS": "",  # Фиолетовый текст
-            "SUSPICIOUS_ACTIVITY": ""  # Голубой текст
+            "SUSPICIOUS_ACTIVITY": "",  # Голубой текст
+            "SCAN": ""
         }
 
         color_prefix = {
             "BRUTE_FORCE": "[BRUTE]",
             "SQL_INJECTION": "[SQL-INJ]",
             "UNAUTHORIZED_ACCESS": "[UNAUTH]",
-            "SUSPICIOUS_ACTIVITY": "[SUSP]"
+            "SUSPICIOUS_ACTIVITY": "[SUSP]",
+            "SCAN": "[SCAN]"
         }
 
         prefix = color_prefix.get(alert_type, "[ALERT]")
@@ -81,6 +143,20 @@ class SecurityMonitor:
 
         self.alert_count += 1
         self.incident_types[alert_type] += 1
+        self.incident_store.record_alert(alert_type, ip, self.event_time)
+
+        for listener in self.alert_listeners:
+            listener(alert_type, ip, message, details)
+
+    def mark_suspicious(self, ip, block=True):
+        """
+        IP в списке подозрительных; при block (сигнатура атаки) и включенной
+        автоблокировке приложение отклоняет его запросы в течение block_ttl секунд
+        """
+        self.suspicious_ips.add(ip)
+        if block and self.blocklist is not None and ip != "N/A" and ip not in self.block_allowlist:
+            # Блокировка выполняется по записи журнала доступа этого IP (см. parse_flask_log)
+            self.pending_blocks.add(ip)
 
     def detect_brute_force(self, ip, timestamp):
         """Обнаружение множественных неудачных попыток входа"""
@@ -92,7 +168,7 @@ class SecurityMonitor:
 
         if len(recent_failures) >= 5:  # 5+ неудачных попыток за минуту
             if ip not in self.suspicious_ips:
-                self.suspicious_ips.add(ip)
+                self.mark_suspicious(ip)
                 self.log_alert(
                     "BRUTE_FORCE",
                     f"Обнаружена атака перебора паролей",
@@ -104,6 +180,7 @@ class SecurityMonitor:
         """Обнаружение попыток SQL инъекций"""
         for pattern in self.sql_injection_patterns:
             if re.search(pattern, log_line, re.IGNORECASE):
+                self.mark_suspicious(ip)
                 self.log_alert(
                     "SQL_INJECTION",
                     f"Обнаружена попытка SQL инъекции",
@@ -138,23 +215,76 @@ class SecurityMonitor:
 
         return False
 
+    def detect_scan(self, ip, path, status_code, sample_rate=1.0, timestamp=None):
+        """Оконная агрегация по IP: одно оповещение на сканирование вместо оповещения на каждый 403/404"""
+        weight = max(1, round(1 / sample_rate)) if sample_rate > 0 else 1
+        window = self.scan_detector.observe(ip, path, status_code, timestamp, weight)
+        if window is None:
+            return False
+        # Одна лишь частота запросов - не повод блокировать (NAT, прокси)
+        self.mark_suspicious(ip, block=window['reason'] == 'scan')
+        reason = ("Обнаружено сканирование ресурсов" if window['reason'] == 'scan'
+                  else "Аномально высокая частота запросов")
+        self.log_alert(
+            "SCAN",
+            reason,
+            ip,
+            f"{window['distinct_paths']} различных путей, {window['requests']} запросов, "
+            f"ошибок {window['error_ratio']:.0%}, {window['rate']:.1f} запр/с "
+            f"за {self.scan_detector.window_seconds} с"
+        )
+        return True
+
+    def line_time(self, line):
+        """Время записи из начала строки лога ("2024-01-01 12:00:00,123 - ..."); кэш на одну секунду"""
+        text = line[:19]
+        cached_text, cached_time = self._time_cache
+        if text == cached_text:
+            return cached_time
+        try:
+            value = datetime.strptime(text, "%Y-%m-%d %H:%M:%S").timestamp()
+        except ValueError:
+            return time.time()
+        self._time_cache = (text, value)
+        return value
+
     def parse_flask_log(self, line):
         """Анализ логов Flask - улучшенная версия"""
         try:
             # Упрощенный парсинг - ищем ключевые фразы
-            ip_match = re.search(r'IP: \[([\d\.]+)\]', line)
+            ip_match = IP_RE.match(line)
             ip = ip_match.group(1) if ip_match else "N/A"
+            event_time = self.event_time = self.line_time(line)
+
+            # Оконная агрегация запросов по IP
+            access_match = ACCESS_RE.search(line)
+            if access_match and ip != "N/A":
+                path, status, sample = access_match.groups()
+                status_code, sample_rate = int(status), float(sample)
+                weight = max(1, round(1 / sample_rate)) if sample_rate > 0 else 1
+                self.incident_store.record_request(ip, path, status_code, event_time, weight)
+                self.detect_scan(ip, path, status_code, sample_rate, event_time)
 
             # Обнаружение неудачных входов
             if "Failed login attempt" in line:
-                self.detect_brute_force(ip, datetime.now())
+                self.detect_brute_force(ip, datetime.fromtimestamp(event_time))
 
             # Обнаружение SQL инъекций в параметрах запроса
             if any(pattern in line for pattern in [" OR ", "UNION", "DROP", "INSERT", "SELECT"]):
                 if any(sql_pattern in line for sql_pattern in ["' OR", "UNION SELECT", "DROP TABLE"]):
                     self.detect_sql_injection(line, ip)
 
+            # Блокируется только IP из записи журнала доступа: строки с
+            # произвольным текстом (имя пользователя, заголовок заметки) лишь
+            # отмечают IP, запись о том же запросе следует за ними
+            if access_match and ip in self.pending_blocks:
+                self.pending_blocks.discard(ip)
+                self.blocklist.block(ip, self.block_ttl)
+
             # Обнаружение доступа к защищенным эндпоинтам
+            # (для IP с оповещением о сканировании отдельные обращения уже учтены в нем)
+            if self.scan_detector.is_flagged(ip, event_time):
+                return
             for endpoint in self.sensitive_endpoints:
                 if endpoint in line:
                     status_match = re.search(r'Status: (\d{3})', line)
@@ -184,6 +314,57 @@ class SecurityMonitor:
         except Exception as e:
             print(f"[ERROR] Ошибка чтения файла {filename}: {e}")
 
+    def format_period_report(self, start, end, top_n=10):
+        """Top-N IP и путей и почасовой тренд за произвольный период (unix time)"""
+        report = self.incident_store.report(start, end, top_n)
+
+        def fmt(timestamp):
+            return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
+
+        top_ips = "\n".join(
+            f"- {ip}: ~{count} инцидентов" for ip, count in report['top_ips']
+        ) or "Не обнаружено"
+        top_endpoints = "\n".join(
+            f"- {path}: ~{count} ошибок" for path, count in report['top_endpoints']
+        ) or "Не обнаружено"
+        hourly = "\n".join(
+            f"{fmt(hour):<18}{requests:>12}{errors:>10}{alerts:>12}"
+            for hour, requests, errors, alerts in report['hourly']
+        ) or "Нет данных"
+        alerts = "\n".join(
+            f"- {alert_type}: {count}" for alert_type, count in report['alerts'].most_common()
+        ) or "Нет"
+
+        return f"""
+ПЕРИОД: {fmt(start)} - {fmt(end)}
+----------------------
+Запросов: {report['requests']}, ошибок: {report['errors']}
+
+Оповещения за период:
+{alerts}
+
+ТОП-{top_n} АТАКУЮЩИХ IP (ошибки и оповещения):
+{top_ips}
+
+ТОП-{top_n} ПУТЕЙ С ОШИБКАМИ:
+{top_endpoints}
+
+ТРЕНД ПО ЧАСАМ:
+{'Час':<18}{'Запросов':>12}{'Ошибок':>10}{'Оповещений':>12}
+{hourly}
+"""
+
+    def top_attackers(self, seconds=3600, n=5):
+        """Самые активные атакующие IP за последние seconds секунд"""
+        now = time.time()
+        return self.incident_store.report(now - seconds, now, n)['top_ips']
+
+    def generate_report(self, start, end, filename):
+        """Отчет за произвольный период по поминутной статистике (без повторного чтения логов)"""
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(self.format_period_report(start, end))
+        print(f"[REPORT] Отчет за период сохранен: {filename}")
+
     def generate_daily_report(self):
         """Генерация ежедневного отчета"""
         report_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -203,7 +384,10 @@ class SecurityMonitor:
 - SQL инъекции: {self.incident_types['SQL_INJECTION']}
 - Несанкционированный доступ: {self.incident_types['UNAUTHORIZED_ACCESS']}
 - Подозрительная активность: {self.incident_types['SUSPICIOUS_ACTIVITY']}
+- Сканирование: {self.incident_types['SCAN']}
 
+ПОСЛЕДНИЕ 24 ЧАСА:
+{self.format_period_report(time.time() - 86400, time.time())}
 ПОДОЗРИТЕЛЬНЫЕ IP-АДРЕСА:
 -------------------------
 {chr(10).join(f"- {ip}" for ip in self.suspicious_ips) if self.suspicious_ips else "Не обнаружено"}
@@ -236,6 +420,9 @@ class SecurityMonitor:
             recommendations.append("• Усилить мониторинг чувствительных эндпоинтов")
             recommendations.append("• Рассмотреть внедрение двухфакторной аутентификации")
 
+        if self.incident_types['SCAN'] > 0:
+            recommendations.append("• Ограничить частоту запросов и блокировать сканирующие IP")
+
         if not recommendations:
             recommendations.append("• Критических проблем не обнаружено. Продолжайте мониторинг")
 
@@ -255,7 +442,7 @@ class SecurityMonitor:
         flask_thread.start()
 
         print("[OK] Мониторинг запущен. Ожидание событий...")
-        print("[INFO] Для тестирования запустите test_security_events.py в отдельном терминале")
+        print("[INFO] Для тестирования запустите benchmarks/security_events.py в отдельном терминале")
 
         # Главный цикл
         last_report_time = datetime.now()
@@ -263,6 +450,9 @@ class SecurityMonitor:
             while True:
                 time.sleep(10)  # Проверка каждые 10 секунд
 
+                if self.blocklist is not None:
+                    self.blocklist.purge_expired()
+
                 # Автоматическая генерация отчета каждые 24 часа
                 current_time = datetime.now()
                 if (current_time - last_report_time).total_seconds() >= 86400:  # 24 часа
@@ -273,10 +463,17 @@ class SecurityMonitor:
                 if int(time.time()) % 30 == 0:
                     print(
                         f"[STATUS] Обнаружено {self.alert_count} инцидентов, {len(self.suspicious_ips)} подозрительных IP")
+                    top = self.top_attackers()
+                    if top:
+                        print("[STATUS] Топ IP за час: " + ", ".join(f"{ip} (~{count})" for ip, count in top))
 
         except KeyboardInterrupt:
             print("\n[STOP] Остановка мониторинга...")
             self.generate_daily_report()  # Финальный отчет при остановке
+            if self.blocklist is not None:
+                self.blocklist.flush()  # Блокировки, ожидающие публикации
+            if self.alert_sink is not None:
+                self.alert_sink.close()  # Запись оставшихся в буфере оповещений
 
 
 def main():
@@ -0,0 +1,370 @@
+"""
+Вероятностные структуры для SIEM: агрегация событий с фиксированной памятью.
+
+- HyperLogLog: приближенное число различных значений (эндпоинтов на IP);
+- ScanDetector: скользящее окно по каждому IP (кольцо из нескольких
+  интервалов) с числом запросов, ошибок и HyperLogLog эндпоинтов; число
+  отслеживаемых IP ограничено, давно не активные вытесняются (LRU);
+- CountMinSketch и TopK: частоты ключей и самые частые ключи;
+- IncidentStore: кольцо поминутных интервалов (запросы, ошибки, оповещения,
+  частоты IP и эндпоинтов) для отчетов за произвольный период.
+"""
+
+import heapq
+import math
+import time
+from array import array
+from collections import Counter, OrderedDict
+
+_HASH_BITS = 64
+_HASH_MASK = (1 << _HASH_BITS) - 1
+
+
+def hash64(value):
+    """64-битный хэш строки (hash() строки кэшируется интерпретатором)"""
+    return hash(value) & _HASH_MASK
+
+
+def _alpha(m):
+    if m == 16:
+        return 0.673
+    if m == 32:
+        return 0.697
+    if m == 64:
+        return 0.709
+    return 0.7213 / (1 + 1.079 / m)
+
+
+def hll_add(registers, offset, p, h):
+    """Добавление хэша в регистры registers[offset:offset + 2**p]"""
+    index = h & ((1 << p) - 1)
+    rank = _HASH_BITS - p - (h >> p).bit_length() + 1
+    if rank > registers[offset + index]:
+        registers[offset + index] = rank
+
+
+def hll_estimate(registers, m):
+    """Оценка мощности по регистрам с поправкой для малых значений"""
+    estimate = _alpha(m) * m * m / sum(2.0 ** -r for r in registers)
+    if estimate <= 2.5 * m:
+        zeros = registers.count(0)
+        if zeros:
+            return m * math.log(m / zeros)
+    return estimate
+
+
+class HyperLogLog:
+    """Приближенный подсчет различных значений; ошибка ~1.04/sqrt(2**p)"""
+
+    __slots__ = ('p', 'm', 'registers')
+
+    def __init__(self, p=10):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+    def add(self, value):
+        hll_add(self.registers, 0, self.p, hash64(value))
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        return hll_estimate(self.registers, self.m)
+
+
+class WindowedIPStats:
+    """Скользящее окно одного IP: кольцо интервалов с запросами, ошибками и HLL"""
+
+    __slots__ = ('epochs', 'requests', 'errors', 'registers', 'events', 'alerted_until')
+
+    def __init__(self, buckets, m):
+        self.epochs = [-1] * buckets
+        self.requests = [0] * buckets
+        self.errors = [0] * buckets
+        self.registers = bytearray(buckets * m)
+        self.events = 0
+        self.alerted_until = 0.0
+
+
+class ScanDetector:
+    """
+    Обнаружение сканирования по IP в скользящем окне.
+
+    Оповещение формируется, когда за окно IP обратился к min_distinct и более
+    различным путям и доля ошибок (4xx/5xx) не меньше min_error_ratio, либо
+    когда частота запросов превысила max_rate. После оповещения IP не
+    проверяется в течение cooldown секунд.
+    """
+
+    def __init__(self, window_seconds=60, buckets=6, precision=6, max_ips=50000,
+                 min_requests=20, min_distinct=15, min_error_ratio=0.5, max_rate=50.0,
+                 cooldown=300, check_every=8):
+        self.window_seconds = window_seconds
+        self.buckets = buckets
+        self.bucket_seconds = window_seconds / buckets
+        self.p = precision
+        self.m = 1 << precision
+        self.max_ips = max_ips
+        self.min_requests = min_requests
+        self.min_distinct = min_distinct
+        self.min_error_ratio = min_error_ratio
+        self.max_rate = max_rate
+        self.cooldown = cooldown
+        self.check_every = check_every
+        self.ips = OrderedDict()
+        self.evicted = 0
+
+    def memory_bytes(self):
+        """Оценка памяти регистров и счетчиков (без накладных расходов Python)"""
+        return len(self.ips) * self.buckets * (self.m + 3 * 8)
+
+    def _stats(self, ip):
+        stats = self.ips.get(ip)
+        if stats is None:
+            if len(self.ips) >= self.max_ips:
+                self.ips.popitem(last=False)
+                self.evicted += 1
+            stats = WindowedIPStats(self.buckets, self.m)
+            self.ips[ip] = stats
+        else:
+            self.ips.move_to_end(ip)
+        return stats
+
+    def observe(self, ip, path, status_code, timestamp=None, weight=1):
+        """
+        Учет одного запроса. weight - число запросов, которое представляет
+        запись (1/Sample для выборочного журнала доступа).
+        Возвращает словарь с показателями окна, если нужно оповещение.
+        """
+        now = time.time() if timestamp is None else timestamp
+        stats = self._stats(ip)
+
+        epoch = int(now // self.bucket_seconds)
+        slot = epoch % self.buckets
+        if stats.epochs[slot] != epoch:
+            stats.epochs[slot] = epoch
+            stats.requests[slot] = 0
+            stats.errors[slot] = 0
+            offset = slot * self.m
+            stats.registers[offset:offset + self.m] = bytes(self.m)
+
+        stats.requests[slot] += weight
+        if status_code >= 400:
+            stats.errors[slot] += 1
+        hll_add(stats.registers, slot * self.m, self.p, hash64(path))
+
+        stats.events += 1
+        if stats.events % self.check_every or now < stats.alerted_until:
+            return None
+        return self._check(stats, epoch, now)
+
+    def is_flagged(self, ip, timestamp=None):
+        """IP уже получил оповещение о сканировании и находится в периоде cooldown"""
+        stats = self.ips.get(ip)
+        now = time.time() if timestamp is None else timestamp
+        return stats is not None and now < stats.alerted_until
+
+    def window(self, ip, timestamp=None):
+        """Показатели окна для IP: запросы, ошибки, различные пути, частота"""
+        stats = self.ips.get(ip)
+        if stats is None:
+            return None
+        now = time.time() if timestamp is None else timestamp
+        return self._window(stats, int(now // self.bucket_seconds))
+
+    def _window(self, stats, epoch):
+        requests = errors = 0
+        merged = bytearray(self.m)
+        for slot in range(self.buckets):
+            # Интервалы старше окна не учитываются
+            if epoch - stats.epochs[slot] >= self.buckets:
+                continue
+            requests += stats.requests[slot]
+            errors += stats.errors[slot]
+            offset = slot * self.m
+            merged = bytearray(map(max, merged, stats.registers[offset:offset + self.m]))
+        return {
+            'requests': requests,
+            'errors': errors,
+            'error_ratio': errors / requests if requests else 0.0,
+            'distinct_paths': round(hll_estimate(merged, self.m)),
+            'rate': requests / self.window_seconds,
+        }
+
+    def _check(self, stats, epoch, now):
+        window = self._window(stats, epoch)
+        if window['requests'] < self.min_requests:
+            return None
+        scanning = window['distinct_paths'] >= self.min_distinct and window['error_ratio'] >= self.min_error_ratio
+        flooding = self.max_rate and window['rate'] >= self.max_rate
+        if not (scanning or flooding):
+            return None
+        stats.alerted_until = now + self.cooldown
+        window['reason'] = 'scan' if scanning else 'rate'
+        return window
+
+
+class CountMinSketch:
+    """Оценка частоты ключа сверху; ошибка не больше ~2N/width с вероятностью 1 - 2**-depth"""
+
+    __slots__ = ('width', 'depth', 'counts', 'total')
+
+    def __init__(self, width=256, depth=4):
+        self.width = width
+        self.depth = depth
+        self.counts = array('I', bytes(4 * width * depth))
+        self.total = 0
+
+    def _indexes(self, key):
+        # depth хэш-функций из одного 64-битного хэша (Kirsch-Mitzenmacher)
+        h = hash64(key)
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        width = self.width
+        return [row * width + (h1 + row * h2) % width for row in range(self.depth)]
+
+    def add(self, key, count=1):
+        counts = self.counts
+        estimate = None
+        for index in self._indexes(key):
+            value = counts[index] + count
+            counts[index] = value
+            if estimate is None or value < estimate:
+                estimate = value
+        self.total += count
+        return estimate
+
+    def estimate(self, key):
+        counts = self.counts
+        return min(counts[index] for index in self._indexes(key))
+
+    def merge(self, other):
+        self.counts = array('I', map(int.__add__, self.counts, other.counts))
+        self.total += other.total
+
+
+class TopK:
+    """Самые частые ключи по оценкам count-min sketch (min-heap с ленивым удалением)"""
+
+    __slots__ = ('k', 'counts', 'heap')
+
+    def __init__(self, k=20):
+        self.k = k
+        self.counts = {}
+        self.heap = []
+
+    def update(self, key, estimate):
+        counts = self.counts
+        if key not in counts and len(counts) >= self.k:
+            self._drop_stale()
+            if estimate <= self.heap[0][0]:
+                return
+            _, evicted = heapq.heappop(self.heap)
+            del counts[evicted]
+        counts[key] = estimate
+        heapq.heappush(self.heap, (estimate, key))
+        if len(self.heap) > 4 * self.k:
+            self.heap = [(count, key) for key, count in counts.items()]
+            heapq.heapify(self.heap)
+
+    def _drop_stale(self):
+        heap, counts = self.heap, self.counts
+        while heap and counts.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+
+    def items(self):
+        return sorted(self.counts.items(), key=lambda item: -item[1])
+
+
+class MinuteBucket:
+    """События одной минуты"""
+
+    __slots__ = ('minute', 'requests', 'errors', 'alerts', 'ips', 'ip_top', 'endpoints', 'endpoint_top')
+
+    def __init__(self, minute, width, depth, k):
+        self.minute = minute
+        self.requests = 0
+        self.errors = 0
+        self.alerts = Counter()  # тип оповещения -> число
+        self.ips = CountMinSketch(width, depth)  # инциденты по IP: ошибки и оповещения
+        self.ip_top = TopK(k)
+        self.endpoints = CountMinSketch(width, depth)  # ошибки по путям
+        self.endpoint_top = TopK(k)
+
+
+class IncidentStore:
+    """
+    Кольцо поминутных интервалов фиксированного размера.
+
+    Память не зависит от числа IP и путей: интервал содержит счетчики и два
+    count-min sketch с top-K. Интервалы создаются только для минут с событиями.
+    """
+
+    def __init__(self, minutes=24 * 60, width=512, depth=4, k=20):
+        self.minutes = minutes
+        self.width = width
+        self.depth = depth
+        self.k = k
+        self.buckets = [None] * minutes
+
+    def _bucket(self, timestamp):
+        minute = int(timestamp // 60)
+        slot = minute % self.minutes
+        bucket = self.buckets[slot]
+        if bucket is None or bucket.minute != minute:
+            bucket = MinuteBucket(minute, self.width, self.depth, self.k)
+            self.buckets[slot] = bucket
+        return bucket
+
+    def record_request(self, ip, path, status_code, timestamp=None, weight=1):
+        bucket = self._bucket(time.time() if timestamp is None else timestamp)
+        bucket.requests += weight
+        if status_code >= 400:
+            bucket.errors += 1
+            bucket.ip_top.update(ip, bucket.ips.add(ip))
+            bucket.endpoint_top.update(path, bucket.endpoints.add(path))
+
+    def record_alert(self, alert_type, ip, timestamp=None):
+        bucket = self._bucket(time.time() if timestamp is None else timestamp)
+        bucket.alerts[alert_type] += 1
+        if ip and ip != 'N/A':
+            bucket.ip_top.update(ip, bucket.ips.add(ip))
+
+    def range_buckets(self, start, end):
+        """Интервалы с событиями за период start..end (unix time)"""
+        first, last = int(start // 60), int(end // 60)
+        return sorted(
+            (bucket for bucket in self.buckets if bucket is not None and first <= bucket.minute <= last),
+            key=lambda bucket: bucket.minute
+        )
+
+    def _top(self, buckets, sketch_name, top_name, n):
+        merged = CountMinSketch(self.width, self.depth)
+        candidates = set()
+        for bucket in buckets:
+            merged.merge(getattr(bucket, sketch_name))
+            candidates.update(getattr(bucket, top_name).counts)
+        return sorted(((key, merged.estimate(key)) for key in candidates), key=lambda item: -item[1])[:n]
+
+    def report(self, start, end, top_n=10):
+        """Сводка за период: итоги, top-N IP и путей, тренд по часам"""
+        buckets = self.range_buckets(start, end)
+        alerts = Counter()
+        hourly = {}
+        for bucket in buckets:
+            alerts.update(bucket.alerts)
+            hour = bucket.minute // 60 * 3600
+            row = hourly.setdefault(hour, [0, 0, 0])
+            row[0] += bucket.requests
+            row[1] += bucket.errors
+            row[2] += sum(bucket.alerts.values())
+        return {
+            'start': start,
+            'end': end,
+            'requests': sum(bucket.requests for bucket in buckets),
+            'errors': sum(bucket.errors for bucket in buckets),
+            'alerts': alerts,
+            'top_ips': self._top(buckets, 'ips', 'ip_top', top_n),
+            'top_endpoints': self._top(buckets, 'endpoints', 'endpoint_top', top_n),
+            'hourly': sorted((hour, *row) for hour, row in hourly.items()),
+        }
@@ -7,48 +7,229 @@ document.addEventListener('DOMContentLoaded', function() {
     const cancelBtn = document.getElementById('cancelDelete');
     let deleteUrl = '';
 
-    // Обработчики для ссылок удаления (если есть на странице)
-    if (document.querySelectorAll('.delete-link').length > 0) {
-        document.querySelectorAll('.delete-link').forEach(link => {
-            link.addEventListener('click', function(e) {
-                e.preventDefault();
-                deleteUrl = this.href;
-                if (modal) {
-                    modal.style.display = 'block';
-                }
-            });
+    // ===== ОБНОВЛЕНИЕ ЛЕНТЫ НА МЕСТЕ =====
+    // Страница хранит курсор (номер последнего изменения) и запрашивает только
+    // изменения после него; о новых изменениях сообщает поток /notes/stream
+    const feed = document.getElementById('notesFeed');
+    let feedCursor = feed ? parseInt(feed.dataset.cursor, 10) || 0 : 0;
+    let deltaRequest = null;
+    let deltaPending = false;
+
+    const jsonRequest = (url, options = {}) => fetch(url, {
+        credentials: 'same-origin',
+        ...options,
+        headers: { 'Accept': 'application/json' }
+    }).then(response => {
+        const isJson = (response.headers.get('Content-Type') || '').includes('application/json');
+        if (!isJson || response.status === 401) {
+            // Сессия истекла (перенаправление на вход или 401) - обычная загрузка страницы
+            window.location.reload();
+            throw new Error('not json');
+        }
+        return response.json().then(data => {
+            if (!response.ok) {
+                throw new Error(data.error || response.status);
+            }
+            return data;
         });
+    });
+
+    const updateCounters = () => {
+        const total = feed.querySelectorAll('.note-card').length;
+        document.querySelectorAll('.notes-count').forEach(counter => { counter.textContent = total; });
+        const own = document.getElementById('ownNotesCount');
+        if (own) {
+            own.textContent = feed.querySelectorAll('.note-card.own-note').length;
+        }
+        const emptyState = document.getElementById('emptyState');
+        if (emptyState) {
+            emptyState.hidden = total > 0;
+        }
+    };
 
-        // Подтверждение удаления
-        if (confirmBtn) {
-            confirmBtn.addEventListener('click', function() {
-                if (deleteUrl) {
-                    window.location.href = deleteUrl;
+    const applyDelta = data => {
+        if (data.reset) {
+            window.location.reload();
+            return;
+        }
+        data.deleted.forEach(id => {
+            const card = document.getElementById('note-' + id);
+            if (card) {
+                card.remove();
+            }
+        });
+        // Изменения идут по возрастанию номера: новые заметки по очереди встают в начало
+        data.notes.forEach(note => {
+            const template = document.createElement('template');
+            template.innerHTML = note.html.trim();
+            const card = template.content.firstElementChild;
+            const existing = document.getElementById('note-' + note.id);
+            if (existing) {
+                existing.replaceWith(card);
+            } else {
+                feed.prepend(card);
+            }
+        });
+        feedCursor = Math.max(feedCursor, data.cursor);
+        updateCounters();
+        // Изменения получены - БД снова доступна, лента актуальна
+        const staleBanner = document.getElementById('staleBanner');
+        if (staleBanner) {
+            staleBanner.remove();
+        }
+    };
+
+    const fetchDelta = () => {
+        if (!feed) {
+            return Promise.resolve();
+        }
+        if (deltaRequest) {
+            // Запрос уже идет: повторить после него, чтобы не пропустить новое изменение
+            deltaPending = true;
+            return deltaRequest;
+        }
+        deltaRequest = jsonRequest(feed.dataset.deltaUrl + '?since=' + feedCursor)
+            .then(applyDelta)
+            .catch(() => {})
+            .finally(() => {
+                deltaRequest = null;
+                if (deltaPending) {
+                    deltaPending = false;
+                    fetchDelta();
                 }
             });
-        }
+        return deltaRequest;
+    };
 
-        // Отмена удаления
-        if (cancelBtn) {
-            cancelBtn.addEventListener('click', function() {
-                if (modal) {
-                    modal.style.display = 'none';
+    if (feed) {
+        let pollTimer = null;
+        const startPolling = () => {
+            if (!pollTimer) {
+                pollTimer = setInterval(fetchDelta, 15000);
+            }
+        };
+
+        if (window.EventSource) {
+            const stream = new EventSource(feed.dataset.streamUrl + '?cursor=' + feedCursor);
+            // Событие приходит и с прежним номером: изменение с меньшим номером
+            // зафиксировано позже (delta перечитывает окно перед курсором)
+            stream.addEventListener('notes', fetchDelta);
+            stream.addEventListener('open', fetchDelta);
+            stream.addEventListener('error', function() {
+                // Сервер отказал в потоке (лимит потоков) - периодические запросы изменений
+                if (stream.readyState === EventSource.CLOSED) {
+                    startPolling();
                 }
-                deleteUrl = '';
             });
+        } else {
+            startPolling();
         }
+    }
 
-        // Закрытие модального окна при клике вне его
+    // Удаление заметки после подтверждения (обработчик на документе: карточки
+    // добавляются в ленту без перезагрузки страницы)
+    document.addEventListener('click', function(e) {
+        const link = e.target.closest('.delete-link');
+        if (!link) {
+            return;
+        }
+        e.preventDefault();
+        deleteUrl = link.href;
         if (modal) {
-            window.addEventListener('click', function(e) {
-                if (e.target === modal) {
-                    modal.style.display = 'none';
-                    deleteUrl = '';
-                }
-            });
+            modal.style.display = 'block';
+        }
+    });
+
+    const closeModal = () => {
+        if (modal) {
+            modal.style.display = 'none';
         }
+        deleteUrl = '';
+    };
+
+    // Подтверждение удаления
+    if (confirmBtn) {
+        confirmBtn.addEventListener('click', function() {
+            if (!deleteUrl) {
+                return;
+            }
+            const url = deleteUrl;
+            closeModal();
+            if (!feed) {
+                window.location.href = url;
+                return;
+            }
+            jsonRequest(url)
+                .then(data => {
+                    const card = document.getElementById('note-' + data.deleted);
+                    if (card) {
+                        card.remove();
+                    }
+                    updateCounters();
+                    fetchDelta();
+                })
+                .catch(error => {
+                    if (error.message !== 'not json') {
+                        alert(error.message);
+                    }
+                });
+        });
+    }
+
+    // Отмена удаления
+    if (cancelBtn) {
+        cancelBtn.addEventListener('click', closeModal);
     }
 
+    // Закрытие модального окна при клике вне его
+    if (modal) {
+        window.addEventListener('click', function(e) {
+            if (e.target === modal) {
+                closeModal();
+            }
+        });
+    }
+
+    // ===== РАСКРЫТИЕ ПРЕВЬЮ ЗАМЕТКИ =====
+    // Лента содержит только начало длинных заметок, полный текст загружается по клику
+    document.addEventListener('click', function(e) {
+        const button = e.target.closest('.note-expand');
+        if (!button) {
+            return;
+        }
+        const body = button.closest('.note-card').querySelector('.note-content');
+
+        if (button.dataset.expanded === '1') {
+            body.textContent = button.dataset.preview;
+            button.dataset.expanded = '0';
+            button.textContent = 'Показать полностью';
+            return;
+        }
+
+        const show = content => {
+            button.dataset.preview = button.dataset.preview || body.textContent;
+            button.dataset.content = content;
+            body.textContent = content;
+            button.dataset.expanded = '1';
+            button.textContent = 'Свернуть';
+        };
+
+        if (button.dataset.content !== undefined) {
+            show(button.dataset.content);
+            return;
+        }
+
+        button.disabled = true;
+        jsonRequest(button.dataset.contentUrl)
+            .then(data => show(data.content))
+            .catch(error => {
+                if (error.message !== 'not json') {
+                    alert('Не удалось загрузить заметку');
+                }
+            })
+            .finally(() => { button.disabled = false; });
+    });
+
     // ===== ВАЛИДАЦИЯ ФОРМЫ ДОБАВЛЕНИЯ ЗАМЕТКИ =====
     const addNoteForm = document.getElementById('addNoteForm');
     if (addNoteForm) {
@@ -70,6 +251,29 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    // Отправка новой заметки без перезагрузки: карточка придет через /notes/delta
+    if (addNoteForm && feed) {
+        addNoteForm.addEventListener('submit', function(e) {
+            if (e.defaultPrevented) {
+                return;
+            }
+            e.preventDefault();
+            const submitButton = this.querySelector('button[type="submit"]');
+            submitButton.disabled = true;
+            jsonRequest(this.action, { method: 'POST', body: new FormData(this) })
+                .then(() => {
+                    this.reset();
+                    return fetchDelta();
+                })
+                .catch(error => {
+                    if (error.message !== 'not json') {
+                        alert(error.message);
+                    }
+                })
+                .finally(() => { submitButton.disabled = false; });
+        });
+    }
+
     // ===== ВАЛИДАЦИЯ ФОРМЫ РЕДАКТИРОВАНИЯ ЗАМЕТКИ =====
     const editNoteForm = document.getElementById('editNoteForm');
     if (editNoteForm) {
@@ -0,0 +1,310 @@
+"""
+Хранилища данных приложения.
+
+Функции работы с пользователями и заметками в app.py обращаются к БД только
+через интерфейс StorageBackend: получение/возврат подключения, выполнение
+запроса и схема таблиц. Реализации:
+
+- PostgresBackend: PostgreSQL через psycopg2 с маршрутизацией чтения на реплики,
+  пулом подключений и подготовленными выражениями для частых запросов;
+- SQLiteBackend: встроенная БД в одном файле (WAL, подключение на поток,
+  кэш подготовленных выражений) для небольших установок на одном узле.
+"""
+
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+import psycopg2
+from psycopg2.extensions import TransactionRollbackError
+
+from prepared_statements import StatementRegistry
+from queries import PREPARED_STATEMENTS
+from request_metrics import InstrumentedCursor
+
+
+class StorageBackend:
+    """Интерфейс хранилища: подключения, выполнение SQL и схема"""
+
+    name = 'base'
+    Error = Exception
+    IntegrityError = Exception
+
+    # Команды создания таблиц (выполняются при инициализации)
+    schema = ()
+
+    # Колонки, добавленные в существующие таблицы после их создания:
+    # (таблица, колонка, определение)
+    added_columns = (
+        ('notes', 'preview', 'TEXT'),
+    )
+
+    def connect(self, readonly=False):
+        raise NotImplementedError
+
+    def release(self, conn):
+        raise NotImplementedError
+
+    def unavailable(self):
+        """Сколько секунд хранилище будет отклонять обращения (0 - доступно)"""
+        return 0
+
+    def cursor(self, conn):
+        """Курсор с учетом времени запросов и строк в метриках запроса"""
+        return InstrumentedCursor(conn.cursor())
+
+    def sql(self, query):
+        """SQL в диалекте хранилища (запросы пишутся с параметрами %s)"""
+        return query
+
+    def execute(self, cursor, query, params=None):
+        if params is None:
+            cursor.execute(self.sql(query))
+        else:
+            cursor.execute(self.sql(query), params)
+        return cursor
+
+    def has_column(self, cursor, table, column):
+        raise NotImplementedError
+
+    def upgrade_schema(self, cursor):
+        """Добавление новых колонок в таблицы, созданные прежней версией схемы"""
+        for table, column, definition in self.added_columns:
+            if not self.has_column(cursor, table, column):
+                self.execute(cursor, f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+class PostgresBackend(StorageBackend):
+    """PostgreSQL: запись на primary, чтение через маршрутизатор на реплики"""
+
+    name = 'postgres'
+    Error = psycopg2.Error
+    IntegrityError = psycopg2.IntegrityError
+
+    schema = (
+        # Ожидание блокировки и миграции больших таблиц не ограничиваются
+        # DB_STATEMENT_TIMEOUT_MS (действует до конца транзакции инициализации)
+        "SET LOCAL statement_timeout = 0",
+        # Процессы prefork инициализируют схему одновременно: транзакция
+        # инициализации выполняется под блокировкой, по одному процессу
+        "SELECT pg_advisory_xact_lock(hashtext('notes_app_schema'))",
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(50) UNIQUE NOT NULL,
+            password_hash VARCHAR(255) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS notes (
+            id SERIAL PRIMARY KEY,
+            title VARCHAR(255) NOT NULL,
+            content TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            preview TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+        ''',
+        # Журнал изменений ленты: запись на каждое изменение заметки, удаления
+        # остаются в журнале (tombstone); новые номера передаются через NOTIFY
+        '''
+        CREATE TABLE IF NOT EXISTS note_changes (
+            seq BIGSERIAL PRIMARY KEY,
+            note_id INTEGER NOT NULL,
+            op VARCHAR(10) NOT NULL,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE OR REPLACE FUNCTION log_note_change() RETURNS trigger AS $$
+        DECLARE
+            change_seq BIGINT;
+        BEGIN
+            -- Номера выдаются при записи, а не при фиксации: изменение с меньшим
+            -- номером может стать видимым позже (см. note_feed.py, FEED_DELTA_OVERLAP)
+            IF TG_OP = 'DELETE' THEN
+                INSERT INTO note_changes (note_id, op) VALUES (OLD.id, 'delete') RETURNING seq INTO change_seq;
+            ELSE
+                INSERT INTO note_changes (note_id, op) VALUES (NEW.id, lower(TG_OP)) RETURNING seq INTO change_seq;
+            END IF;
+            PERFORM pg_notify('notes_changed', change_seq::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        ''',
+        '''
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'notes_change_log') THEN
+                CREATE TRIGGER notes_change_log AFTER INSERT OR UPDATE OR DELETE ON notes
+                    FOR EACH ROW EXECUTE FUNCTION log_note_change();
+            END IF;
+        END
+        $$
+        ''',
+    )
+
+    def __init__(self, router, statements=None):
+        self.router = router
+        self.statements = StatementRegistry(PREPARED_STATEMENTS) if statements is None else statements
+
+    def connect(self, readonly=False):
+        return self.router.connect(readonly=readonly)
+
+    def release(self, conn):
+        self.router.release(conn)
+
+    def unavailable(self):
+        return self.router.breaker.retry_after()
+
+    def execute(self, cursor, query, params=None):
+        # Частые запросы выполняются по имени подготовленного выражения
+        try:
+            self.statements.execute(cursor, query, params)
+        except TransactionRollbackError:
+            # Конфликт транзакций, а не недоступность сервера
+            raise
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # Обрыв подключения или таймаут запроса (statement_timeout)
+            self.router.record_failure(cursor.connection)
+            raise
+        self.router.record_success(cursor.connection)
+        return cursor
+
+    def upgrade_schema(self, cursor):
+        super().upgrade_schema(cursor)
+        # Типы результатов SELECT * могли измениться
+        self.statements.invalidate()
+
+    def has_column(self, cursor, table, column):
+        self.execute(
+            cursor,
+            "SELECT 1 FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s",
+            (table, column)
+        )
+        return cursor.fetchone() is not None
+
+
+def _convert_timestamp(value):
+    return datetime.fromisoformat(value.decode('utf-8'))
+
+
+sqlite3.register_converter('TIMESTAMP', _convert_timestamp)
+
+
+class SQLiteBackend(StorageBackend):
+    """Встроенная SQLite в режиме WAL с подключением на поток"""
+
+    name = 'sqlite'
+    Error = sqlite3.Error
+    IntegrityError = sqlite3.IntegrityError
+
+    schema = (
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username VARCHAR(50) UNIQUE NOT NULL,
+            password_hash VARCHAR(255) NOT NULL,
+            created_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS notes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title VARCHAR(255) NOT NULL,
+            content TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+            preview TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_notes_user_id ON notes (user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_notes_created_at ON notes (created_at)',
+        # Журнал изменений ленты; запись в SQLite и так последовательная,
+        # поэтому номера идут в порядке фиксации без дополнительных блокировок
+        '''
+        CREATE TABLE IF NOT EXISTS note_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            note_id INTEGER NOT NULL,
+            op VARCHAR(10) NOT NULL,
+            changed_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS notes_change_insert AFTER INSERT ON notes
+        BEGIN
+            INSERT INTO note_changes (note_id, op) VALUES (NEW.id, 'insert');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS notes_change_update AFTER UPDATE ON notes
+        BEGIN
+            INSERT INTO note_changes (note_id, op) VALUES (NEW.id, 'update');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS notes_change_delete AFTER DELETE ON notes
+        BEGIN
+            INSERT INTO note_changes (note_id, op) VALUES (OLD.id, 'delete');
+        END
+        ''',
+    )
+
+    def __init__(self, path, cached_statements=256, busy_timeout=5):
+        self.path = path
+        self.cached_statements = cached_statements
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._sql_cache = {}
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def connect(self, readonly=False):
+        # Подключение живет весь срок жизни потока; после fork создается заново
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(
+                self.path,
+                timeout=self.busy_timeout,
+                detect_types=sqlite3.PARSE_DECLTYPES,
+                cached_statements=self.cached_statements,
+                check_same_thread=False
+            )
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def release(self, conn):
+        # Незавершенная транзакция не должна переходить к следующему запросу потока
+        if conn.in_transaction:
+            conn.rollback()
+
+    def has_column(self, cursor, table, column):
+        self.execute(cursor, f"PRAGMA table_info({table})")
+        return any(row[1] == column for row in cursor.fetchall())
+
+    def sql(self, query):
+        # Один и тот же текст запроса -> одно подготовленное выражение в кэше sqlite3
+        translated = self._sql_cache.get(query)
+        if translated is None:
+            translated = query.replace('%s', '?')
+            self._sql_cache[query] = translated
+        return translated
+
+
+def create_storage_backend(name, router=None, sqlite_path='data/notes.sqlite3'):
+    """Создание хранилища по имени из конфигурации"""
+    if name == 'sqlite':
+        return SQLiteBackend(sqlite_path)
+    if name == 'postgres':
+        return PostgresBackend(router)
+    raise ValueError(f"Неизвестное хранилище: {name}")